@@ -6,12 +6,28 @@ Nuevo configuracion.py (versión modular final)
     ✔ Inserción de cabecera (DNI + EJERCICIO)
     ✔ Vista de Variables y Shell activadas
     ✔ Mensajes de guardar antes de ejecutar
+- Con FIUMH_ANTICIPADA=1, al guardar un ejercicio se corrige en segundo
+  plano para que "Corregir" responda al momento.
+- Con FIUMH_BASE_URL, los módulos (y tests.json y ficheros.zip) se
+  descargan de otro servidor en lugar de GitHub; con FIUMH_ESPEJO,
+  tests.json y ficheros.zip se piden antes a un espejo del laboratorio
+  (herramientas/espejo.py) y, si no responde, a GitHub.
 - Añade carga dinámica modular de:
     - descargar_ficheros.py
     - corregir_ejercicio.py
+- La inicialización no usa retardos fijos: cada paso espera al evento
+  WorkbenchReady de Thonny (o a la creación del editor) y se mide su
+  duración (ver informe_arranque()).
 """
 
+import os
+import re
 import sys
+import time
+import types
+import socket
+import logging
+import urllib.error
 import urllib.request
 import importlib.util
 from thonny import get_workbench
@@ -22,16 +38,189 @@ from tkinter import messagebox
 # CONFIGURACIÓN
 # -------------------------------------------------------------------------
 
-BASE_URL = "https://raw.githubusercontent.com/FI-UMH/Thonny/main/"
+# Origen de los módulos; FIUMH_BASE_URL lo cambia (un espejo del
+# laboratorio, o herramientas/servidor_simulado.py para medir sin red)
+BASE_URL = os.environ.get(
+    "FIUMH_BASE_URL", "https://raw.githubusercontent.com/FI-UMH/Thonny/main/"
+).rstrip("/") + "/"
+
+# Espejo del laboratorio (herramientas/espejo.py): FIUMH_ESPEJO es su URL,
+# o "auto" para buscarlo en la red local. Solo los ficheros de datos
+# (ESPEJO_RECURSOS) se piden primero al espejo y, si no responde, a
+# BASE_URL. Los módulos .py se ejecutan, así que vienen siempre de
+# BASE_URL. Con "auto" cualquier equipo del aula podría responder a la
+# búsqueda, así que de un espejo encontrado así solo se toma lo que nunca
+# se ejecuta (ESPEJO_RECURSOS_AUTO): tests.json puede traer programas de
+# referencia que se ejecutan en el equipo del alumno. Una vez resuelto,
+# el valor se deja en FIUMH_ESPEJO ("" si no hay espejo o se ha caído).
+ESPEJO_ENV = "FIUMH_ESPEJO"
+ESPEJO_RECURSOS = ("tests.json", "ficheros.zip")
+ESPEJO_RECURSOS_AUTO = ("ficheros.zip",)
+ESPEJO_PUERTO_ANUNCIO = 8801
+ESPEJO_BUSQUEDA = 0.3        # segundos esperando respuesta al buscarlo
+ESPEJO_TIMEOUT = 3           # segundos por petición al espejo
 
 # Se usará para rellenar la cabecera
 ALUMNO_DNI = ""
 
+# Corrección anticipada al guardar (opcional, ver corregir_ejercicio.py)
+CORRECCION_ANTICIPADA = os.environ.get("FIUMH_ANTICIPADA", "") == "1"
+
+logger = logging.getLogger("fiumh.configuracion")
+
+
+# -------------------------------------------------------------------------
+# PERFIL DE ARRANQUE
+# -------------------------------------------------------------------------
+
+_ARRANQUE_T0 = time.perf_counter()
+_TIEMPOS_ARRANQUE = []   # (paso, inicio_ms, duración_ms) desde configurar()
+
+
+def _medido(nombre, funcion):
+    """Envuelve funcion para anotar cuándo empieza y cuánto tarda."""
+    def envoltorio(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            fin = time.perf_counter()
+            _TIEMPOS_ARRANQUE.append(
+                (nombre, (inicio - _ARRANQUE_T0) * 1000, (fin - inicio) * 1000)
+            )
+    return envoltorio
+
+
+def informe_arranque() -> str:
+    """Texto con el momento y la duración de cada paso de la inicialización."""
+    lineas = [f"{'paso':<32}{'inicio (ms)':>12}{'duración (ms)':>15}"]
+    for nombre, inicio, duracion in _TIEMPOS_ARRANQUE:
+        lineas.append(f"{nombre:<32}{inicio:>12.1f}{duracion:>15.1f}")
+    return "\n".join(lineas)
+
+
+# -------------------------------------------------------------------------
+# ESPERA AL WORKBENCH
+# -------------------------------------------------------------------------
+
+_PENDIENTES_LISTO = []
+
+
+def _cuando_listo(nombre, accion):
+    """
+    Ejecuta accion cuando el workbench de Thonny esté listo (evento
+    WorkbenchReady). Si ya lo está, se ejecuta en cuanto el bucle de
+    eventos quede libre.
+    """
+    wb = get_workbench()
+    accion = _medido(nombre, accion)
+
+    if getattr(wb, "ready", False):
+        wb.after_idle(accion)
+        return
+
+    if not _PENDIENTES_LISTO:
+        wb.bind("WorkbenchReady", _al_estar_listo, True)
+    _PENDIENTES_LISTO.append(accion)
+
+
+def _al_estar_listo(event=None):
+    _TIEMPOS_ARRANQUE.append(
+        ("WorkbenchReady", (time.perf_counter() - _ARRANQUE_T0) * 1000, 0.0)
+    )
+    pendientes = list(_PENDIENTES_LISTO)
+    _PENDIENTES_LISTO.clear()
+    for accion in pendientes:
+        try:
+            accion()
+        except Exception:
+            logger.exception("Error en la inicialización")
+    logger.info("Perfil de arranque:\n%s", informe_arranque())
+
+
+# -------------------------------------------------------------------------
+# ESPEJO DEL LABORATORIO
+# -------------------------------------------------------------------------
+
+def _buscar_espejo():
+    """URL del espejo que responde al anuncio por difusión UDP, o ""."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            s.settimeout(ESPEJO_BUSQUEDA)
+            s.sendto(b"FIUMH-ESPEJO?", ("<broadcast>", ESPEJO_PUERTO_ANUNCIO))
+            respuesta, _ = s.recvfrom(512)
+    except OSError:
+        return ""
+    prefijo, _, url = respuesta.decode("utf-8", "replace").partition(" ")
+    return url.strip() if prefijo == "FIUMH-ESPEJO" and url.startswith("http") else ""
+
+
+# El espejo se ha encontrado por difusión (FIUMH_ESPEJO=auto), no
+# configurado con su URL
+_ESPEJO_BUSCADO = os.environ.get(ESPEJO_ENV, "") == "auto"
+
+
+def _espejo():
+    """URL base del espejo (con "/" final) o "" si no se usa."""
+    global _ESPEJO_BUSCADO
+    valor = os.environ.get(ESPEJO_ENV, "")
+    if valor == "auto":
+        _ESPEJO_BUSCADO = True
+        valor = _buscar_espejo()
+        os.environ[ESPEJO_ENV] = valor
+        logger.info("Espejo del laboratorio: %s", valor or "no encontrado")
+    return valor.rstrip("/") + "/" if valor.startswith("http") else ""
+
+
+def abrir_recurso(nombre, url=None, timeout=None, cabeceras=None):
+    """
+    Abre url (por defecto BASE_URL + nombre) pasando antes por el espejo
+    si nombre es uno de ESPEJO_RECURSOS (ESPEJO_RECURSOS_AUTO con un
+    espejo encontrado por difusión) y url es la de BASE_URL. Si el
+    espejo no responde se deja de usar durante el resto de la sesión. Lo
+    usan también corregir_ejercicio.py (tests.json) y
+    descargar_ficheros.py (ficheros.zip).
+    """
+    url = url or BASE_URL + nombre
+    espejo = ""
+    if nombre in ESPEJO_RECURSOS and url == BASE_URL + nombre:
+        espejo = _espejo()
+        if _ESPEJO_BUSCADO and nombre not in ESPEJO_RECURSOS_AUTO:
+            espejo = ""
+    if espejo:
+        try:
+            req = urllib.request.Request(espejo + nombre, headers=cabeceras or {})
+            return urllib.request.urlopen(req, timeout=ESPEJO_TIMEOUT)
+        except urllib.error.HTTPError:
+            pass
+        except OSError:
+            os.environ[ESPEJO_ENV] = ""
+    req = urllib.request.Request(url, headers=cabeceras or {})
+    if timeout is None:
+        return urllib.request.urlopen(req)
+    return urllib.request.urlopen(req, timeout=timeout)
+
 
 # -------------------------------------------------------------------------
 # CARGADOR DINÁMICO DE MÓDULOS
 # -------------------------------------------------------------------------
 
+def _registrar_modulo():
+    """
+    Deja este módulo importable como "configuracion" (lo ejecuta
+    descargar_configuracion.py en un módulo propio) para que los módulos
+    descargados puedan usar abrir_recurso.
+    """
+    if "configuracion" in sys.modules:
+        return
+    propio = sys.modules.get(__name__)
+    if getattr(propio, "cargar_o_importar", None) is not cargar_o_importar:
+        propio = types.ModuleType("configuracion")
+        propio.__dict__.update(globals())
+    sys.modules["configuracion"] = propio
+
+
 def cargar_o_importar(nombre_modulo):
     """
     Carga el módulo desde FI-UMH/Thonny si no existe en sys.modules.
@@ -39,11 +228,10 @@ def cargar_o_importar(nombre_modulo):
     """
     if nombre_modulo in sys.modules:
         return sys.modules[nombre_modulo]
-
-    url = BASE_URL + nombre_modulo + ".py"
+    _registrar_modulo()
 
     try:
-        with urllib.request.urlopen(url) as resp:
+        with abrir_recurso(nombre_modulo + ".py") as resp:
             codigo = resp.read().decode("utf-8")
     except Exception as e:
         messagebox.showerror("Error", f"No se pudo descargar {nombre_modulo}.py:\n{e}")
@@ -86,13 +274,15 @@ def _config_cabecera():
         except:
             editor.set_text(cabecera)
 
+    insertar_cabecera = _medido("cabecera (editor nuevo)", insertar_cabecera)
+
     def hook_init(self, *args, **kwargs):
         Editor.__old_init__(self, *args, **kwargs)
 
-        # Si el archivo es nuevo
+        # Si el archivo es nuevo, insertamos la cabecera en cuanto Thonny
+        # termine de montar el editor (primer momento libre del bucle)
         if self.get_filename() is None:
-            # Esperamos a que exista el widget gráfico (Thonny tarda en crearlo)
-            wb.after(200, lambda ed=self: insertar_cabecera(ed))
+            wb.after_idle(lambda ed=self: insertar_cabecera(ed))
 
     # Reemplazar __init__ de Editor conservando el original
     if not hasattr(Editor, "__old_init__"):
@@ -103,9 +293,11 @@ def _config_cabecera():
     def inicial():
         ed = wb.get_editor_notebook().get_current_editor()
         if ed and ed.get_filename() is None:
-            insertar_cabecera(ed)
+            text = ed.get_text_widget().get("1.0", "end-1c")
+            if not text.startswith("# DNI"):
+                insertar_cabecera(ed)
 
-    wb.after(300, inicial)
+    _cuando_listo("cabecera (pestaña inicial)", inicial)
 
 
 
@@ -123,7 +315,7 @@ def _config_vistas():
         except Exception:
             pass
 
-    wb.after(800, activar)
+    _cuando_listo("vistas", activar)
 
 
 # -------------------------------------------------------------------------
@@ -162,18 +354,49 @@ def _config_guardar_antes():
     wb.bind("<<DebugCurrentScript>>", intercept, True)
 
 
+# -------------------------------------------------------------------------
+# CORRECCIÓN ANTICIPADA AL GUARDAR (opcional)
+# -------------------------------------------------------------------------
+
+def _config_correccion_anticipada():
+    if not CORRECCION_ANTICIPADA:
+        return
+    wb = get_workbench()
+
+    def al_guardar(event=None):
+        ed = getattr(event, "editor", None) or \
+            wb.get_editor_notebook().get_current_editor()
+        if ed is None:
+            return
+        try:
+            fuente = ed.get_text_widget().get("1.0", "end-1c")
+        except Exception:
+            return
+        # Solo los ficheros con ejercicio en la cabecera
+        if not re.search(r"^\s*#\s*EJERCICIO\s*=\s*\S", fuente[:500], re.MULTILINE):
+            return
+        mod = cargar_o_importar("corregir_ejercicio")
+        if mod and hasattr(mod, "corregir_anticipado"):
+            mod.corregir_anticipado(fuente)
+
+    # Un "Guardar como" puede emitir los dos eventos: _Anticipador.programar
+    # descarta el segundo si la fuente es la misma
+    wb.bind("Save", al_guardar, True)
+    wb.bind("SaveAs", al_guardar, True)
+
+
 # -------------------------------------------------------------------------
 # MENÚS DINÁMICOS
 # -------------------------------------------------------------------------
 
 def _crear_menus():
+    _cuando_listo("menús", _anadir_menus)
+
+
+def _anadir_menus():
     wb = get_workbench()
     menu = wb.get_menu("tools")
 
-    if not menu:
-        wb.after(700, _crear_menus)
-        return
-
     # Acción: Descargar ficheros
     def accion_descargar():
         mod = cargar_o_importar("descargar_ficheros")
@@ -197,7 +420,13 @@ def _crear_menus():
 
 def configurar(modulo):
     """configuracion.py se ejecuta dentro de mod_configuracion."""
-    _config_cabecera()
-    _config_vistas()
-    _config_guardar_antes()
-    _crear_menus()
+    global _ARRANQUE_T0
+    _ARRANQUE_T0 = time.perf_counter()
+    _TIEMPOS_ARRANQUE.clear()
+
+    _medido("_config_cabecera", _config_cabecera)()
+    _medido("_config_vistas", _config_vistas)()
+    _medido("_config_guardar_antes", _config_guardar_antes)()
+    _medido("_config_correccion_anticipada", _config_correccion_anticipada)()
+    _medido("_crear_menus", _crear_menus)()
+
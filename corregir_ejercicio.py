@@ -10,7 +10,29 @@ Versión unificada para FI-UMH/Thonny
     * fXXX  -> funciones.
 - Usa SIEMPRE un entorno aislado:
     * tempfile.TemporaryDirectory
-    * subprocess.run con timeout.
+    * subprocess.run con timeout, o un proceso trabajador ya arrancado
+      (mismo intérprete que el Shell de Thonny) que hace fork por caso.
+    * o, si el test declara "pasos": N, un límite de líneas ejecutadas
+      (el mismo veredicto aunque el equipo esté cargado).
+- Los casos con "complejidad" comprueban además la eficiencia: el coste
+  con entradas crecientes no debe superar la cota declarada (O(n), ...).
+- Además de casos literales, tests.json admite generadores (rejillas de
+  parámetros, entradas aleatorias con semilla, plantillas de ficheros)
+  que se expanden caso a caso solo cuando se van a ejecutar.
+- Los ejercicios superados se guardan en una cola persistente
+  (~/.fiumh_thonny/subidas.sqlite3) que un único hilo envía en segundo
+  plano, con reintentos, aunque falle la red o se cierre Thonny.
+- Con FIUMH_ANTICIPADA=1, cada fichero guardado se corrige en segundo
+  plano (baja prioridad); "Corregir" muestra ese resultado al momento.
+- Con FIUMH_SERVIDOR, la corrección se pide a un servidor del laboratorio
+  (herramientas/servidor_correccion.py) y, si falla, se hace en local.
+- Con la variable de entorno FIUMH_TRAZA, cada corrección deja una traza
+  en formato Chrome trace-event con el tiempo de cada fase de cada test.
+- Cada test ejecutado deja un registro de telemetría (tiempos, veredicto,
+  tamaño de la salida) en ~/.fiumh_thonny/telemetria/; se resume con
+  herramientas/telemetria.py.
+- Si un test excede el tiempo, el informe incluye las líneas del alumno
+  en las que se quedó el programa (muestreo dentro del subproceso).
 - Muestra:
     * messagebox.showerror para errores "globales".
     * Ventana con scroll (_mostrar_error_scroll) para el detalle
@@ -25,24 +47,234 @@ import json
 import subprocess
 import tempfile
 import traceback
+import urllib.error
 import urllib.request
 import urllib.parse
 import socket
 import uuid
 import threading
-from collections import Counter
+import time
+import random
+import atexit
+import sqlite3
+import contextlib
+import functools
+import hashlib
+import gzip
+import math
+import struct
+import itertools
+import string
+import select
+import shutil
+import signal
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from thonny import get_workbench
 from tkinter import messagebox, Toplevel, Text, Scrollbar, Frame
 import tkinter.font as tkfont
+from configuracion import abrir_recurso
 
 # -------------------------------------------------------------------------
 # CONFIG
 # -------------------------------------------------------------------------
 
-TESTS_URL = "https://raw.githubusercontent.com/FI-UMH/Thonny/main/tests.json"
+# Mismo origen que los módulos (FIUMH_BASE_URL, ver configuracion.py);
+# FIUMH_TESTS_URL cambia solo este fichero. Con un espejo del laboratorio
+# (FIUMH_ESPEJO) se pide primero a él (configuracion.abrir_recurso)
+BASE_URL = os.environ.get(
+    "FIUMH_BASE_URL", "https://raw.githubusercontent.com/FI-UMH/Thonny/main/"
+).rstrip("/") + "/"
+TESTS_URL = os.environ.get("FIUMH_TESTS_URL", BASE_URL + "tests.json")
 _TESTS_CACHE = None
 
+# Tiempo máximo (segundos) de cada ejecución del código del alumno
+TIMEOUT_TEST = 5
+
+# Carpeta local para los datos persistentes del corrector
+DATOS_DIR = os.environ.get(
+    "FIUMH_DATOS_DIR", os.path.join(os.path.expanduser("~"), ".fiumh_thonny")
+)
+
+# -------------------------------------------------------------------------
+# TRAZAS DE CORRECCIÓN (opcional)
+# -------------------------------------------------------------------------
+#
+# Con la variable de entorno FIUMH_TRAZA definida, cada corrección deja un
+# fichero en formato Chrome trace-event (chrome://tracing, Perfetto) con un
+# tramo por fase de cada test. Si FIUMH_TRAZA termina en .json se usa como
+# ruta; si no, se guarda en DATOS_DIR/trazas/. Desactivada, cada fase solo
+# cuesta dos llamadas a perf_counter.
+
+TRAZA_ENV = "FIUMH_TRAZA"
+
+# Traza de la corrección en curso (None = desactivada)
+_TRAZA = None
+
+
+class _Traza:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.pid = os.getpid()
+        self.eventos = []
+
+    def tramo(self, nombre, inicio, duracion, args):
+        self.eventos.append({
+            "name": nombre,
+            "cat": "corregir",
+            "ph": "X",
+            "ts": round((inicio - self.t0) * 1e6, 1),
+            "dur": round(duracion * 1e6, 1),
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args or {},
+        })
+
+    def guardar(self, ruta):
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(
+                {"traceEvents": self.eventos, "displayTimeUnit": "ms"},
+                f, ensure_ascii=False,
+            )
+
+
+class _fase:
+    """
+    Mide un bloque: guarda su duración en tiempos[nombre] (si se pasa un
+    dict) y lo añade a la traza activa. args se puede completar dentro
+    del bloque.
+    """
+
+    __slots__ = ("tiempos", "nombre", "args", "inicio")
+
+    def __init__(self, tiempos, nombre, **args):
+        self.tiempos = tiempos
+        self.nombre = nombre
+        self.args = args
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duracion = time.perf_counter() - self.inicio
+        if self.tiempos is not None:
+            self.tiempos[self.nombre] = duracion
+        if _TRAZA is not None:
+            _TRAZA.tramo(self.nombre, self.inicio, duracion, self.args)
+        return False
+
+
+def _iniciar_traza():
+    global _TRAZA
+    _TRAZA = _Traza() if os.environ.get(TRAZA_ENV) else None
+
+
+def _terminar_traza():
+    """Escribe la traza activa (si la hay) y devuelve su ruta."""
+    global _TRAZA
+    traza, _TRAZA = _TRAZA, None
+    if traza is None:
+        return None
+    destino = os.environ.get(TRAZA_ENV, "")
+    if destino.lower().endswith(".json"):
+        ruta = destino
+    else:
+        ruta = os.path.join(
+            DATOS_DIR, "trazas",
+            f"corregir-{time.strftime('%Y%m%d-%H%M%S')}.json",
+        )
+    try:
+        traza.guardar(ruta)
+        return ruta
+    except Exception:
+        return None
+
+
+# -------------------------------------------------------------------------
+# TELEMETRÍA LOCAL
+# -------------------------------------------------------------------------
+#
+# Cada test ejecutado añade un registro binario de tamaño fijo (más el
+# nombre del ejercicio) a DATOS_DIR/telemetria/telemetria.bin: fecha,
+# ejercicio, número de test, veredicto, error_tipo, tiempo real y de CPU
+# del test y tamaño de la salida. Cuando el fichero supera
+# TELEMETRIA_MAX_BYTES se rota (telemetria.bin.1, .2, ...) y se conservan
+# TELEMETRIA_FICHEROS. El informe lo hace herramientas/telemetria.py.
+# FIUMH_TELEMETRIA=0 la desactiva; un fallo al escribir nunca afecta a
+# la corrección.
+
+TELEMETRIA_ACTIVA = os.environ.get("FIUMH_TELEMETRIA", "1") != "0"
+TELEMETRIA_PATH = os.path.join(DATOS_DIR, "telemetria", "telemetria.bin")
+TELEMETRIA_MAX_BYTES = 1024 * 1024
+TELEMETRIA_FICHEROS = 5
+
+# fecha (s), test, superado, error_tipo, pared (s), cpu (s), bytes de salida
+_REGISTRO = struct.Struct("<IHBBffI")
+_ERRORES_TIPO = (None, "tiempo", "ejecucion", "interno")
+_TELEMETRIA_LOCK = threading.Lock()
+
+
+def _codificar_registro(ejercicio, idx, superado, error_tipo, pared, cpu, salida):
+    nombre = (ejercicio or "").encode("utf-8")[:255]
+    codigo = _ERRORES_TIPO.index(error_tipo) if error_tipo in _ERRORES_TIPO else 3
+    return _REGISTRO.pack(
+        int(time.time()), min(idx, 0xFFFF), bool(superado), codigo,
+        pared, cpu, min(salida, 0xFFFFFFFF),
+    ) + bytes([len(nombre)]) + nombre
+
+
+def _leer_telemetria(ruta: str):
+    """Registros (dicts) de un fichero de telemetría, en orden."""
+    with open(ruta, "rb") as f:
+        datos = f.read()
+    pos = 0
+    while pos + _REGISTRO.size < len(datos):
+        fecha, idx, superado, codigo, pared, cpu, salida = _REGISTRO.unpack_from(datos, pos)
+        pos += _REGISTRO.size
+        n = datos[pos]
+        ejercicio = datos[pos + 1:pos + 1 + n].decode("utf-8", errors="replace")
+        pos += 1 + n
+        yield {
+            "fecha": fecha, "ejercicio": ejercicio, "test": idx,
+            "superado": bool(superado), "error_tipo": _ERRORES_TIPO[codigo],
+            "pared": pared, "cpu": cpu, "salida": salida,
+        }
+
+
+def _rotar_telemetria():
+    for i in range(TELEMETRIA_FICHEROS - 1, 0, -1):
+        origen = TELEMETRIA_PATH + (f".{i - 1}" if i > 1 else "")
+        if os.path.exists(origen):
+            os.replace(origen, f"{TELEMETRIA_PATH}.{i}")
+
+
+def _registrar_telemetria(ejercicio, idx, res, errores, pared):
+    if not TELEMETRIA_ACTIVA:
+        return
+    salida = len(res.get("stdout") or "") + sum(
+        len(c) for c in (res.get("files_end") or {}).values()
+    )
+    registro = _codificar_registro(
+        ejercicio, idx, not errores, res.get("error_tipo"),
+        pared, res.get("tiempos", {}).get("cpu", 0.0), salida,
+    )
+    try:
+        with _TELEMETRIA_LOCK:
+            os.makedirs(os.path.dirname(TELEMETRIA_PATH), exist_ok=True)
+            try:
+                if os.path.getsize(TELEMETRIA_PATH) >= TELEMETRIA_MAX_BYTES:
+                    _rotar_telemetria()
+            except OSError:
+                pass
+            with open(TELEMETRIA_PATH, "ab") as f:
+                f.write(registro)
+    except OSError:
+        pass
+
+
 # -------------------------------------------------------------------------
 # UTILIDADES DE INTERFAZ
 # -------------------------------------------------------------------------
@@ -52,6 +284,11 @@ from tkinter import Toplevel, Text, Scrollbar, Frame
 import tkinter.font as tkfont
 
 def _mostrar_error_scroll(titulo, mensaje):
+    with _fase(None, "_mostrar_error_scroll", bytes=len(mensaje)):
+        _crear_ventana_error(titulo, mensaje)
+
+
+def _crear_ventana_error(titulo, mensaje):
     win = Toplevel()
     win.title(titulo)
     win.geometry("820x520")
@@ -127,58 +364,368 @@ def _mostrar_error_scroll(titulo, mensaje):
 # ======================================================================
 #                SUBIR EJERCICIOS SIN REQUESTS
 # ======================================================================
-
-
-def _send_post(url, data):
+#
+# Los ejercicios superados no se envían directamente: se guardan en una
+# cola persistente (sqlite) y un único hilo emisor en segundo plano la
+# va vaciando. Así no se pierde ningún envío por un corte de red o
+# porque el alumno cierre Thonny, y no se crea un hilo por cada subida.
+#
+# Cada fila de la cola es un par (envío, endpoint): si un endpoint
+# responde y el otro no, solo se reintenta el que ha fallado.
+
+
+# FIUMH_SUBIDA_FI / FIUMH_SUBIDA_POMARES cambian los endpoints (p. ej.
+# para medir las subidas contra herramientas/servidor_simulado.py)
+URL_SUBIDA_FI = os.environ.get("FIUMH_SUBIDA_FI", (
+    "https://script.google.com/macros/s/"
+    "AKfycby3wCtvhy2sqLmp9TAl5aEQ4zHTceMAxwA_4M2HCjFJQpvxWmstEoRa5NohH0Re2eQa/exec"
+))
+URL_SUBIDA_POMARES = os.environ.get("FIUMH_SUBIDA_POMARES", (
+    "https://script.google.com/macros/s/"
+    "AKfycbw1CMfaQcJuP1cLBmt5eHryrmb83Tb0oIrWu_XHfRQpYt8kWY_g6TpsQx92QwhB_SjyYg/exec"
+))
+URLS_SUBIDA = [URL_SUBIDA_FI, URL_SUBIDA_POMARES]
+
+COLA_SUBIDAS_PATH = os.path.join(DATOS_DIR, "subidas.sqlite3")
+
+SUBIDA_TIMEOUT = 10          # segundos por POST
+SUBIDA_LOTE = 20             # filas que se sacan de la cola en cada vuelta
+SUBIDA_HILOS = 4             # POST simultáneos como máximo
+SUBIDA_ESPERA_BASE = 2.0     # primer reintento (segundos)
+SUBIDA_ESPERA_MAX = 300.0    # tope del backoff exponencial
+SUBIDA_FLUSH_SALIDA = 3.0    # segundos que se dedican a vaciar la cola al salir
+SUBIDA_ENTREGADOS_MAX = 2000 # fuentes entregadas que se recuerdan (las más recientes)
+# Cambian el formato de lo que reciben los scripts de Apps Script, que
+# no son de este repositorio: solo se activan (FIUMH_SUBIDA_GZIP=1,
+# FIUMH_SUBIDA_REFS=1) contra receptores que los admitan, como
+# herramientas/servidor_simulado.py. e.parameter no descomprime gzip.
+SUBIDA_COMPRIMIR = os.environ.get("FIUMH_SUBIDA_GZIP", "") == "1"    # cuerpos con gzip
+SUBIDA_REFERENCIAS = os.environ.get("FIUMH_SUBIDA_REFS", "") == "1"  # fuente repetida -> hash
+
+# Identidad del equipo (nombre, IP local, MAC): se calcula una vez por sesión
+_IDENTIDAD_CACHE = None
+
+
+def _send_post(url, data, timeout=SUBIDA_TIMEOUT):
+    """
+    Devuelve el cuerpo de la respuesta, None si el envío ha fallado y hay
+    que reintentarlo, o False si el endpoint lo rechaza definitivamente
+    (4xx salvo 408 y 429: reintentarlo daría siempre lo mismo).
+    """
     try:
         encoded = urllib.parse.urlencode(data).encode("utf-8")
         req = urllib.request.Request(url, data=encoded, method="POST")
         req.add_header("Content-Type", "application/x-www-form-urlencoded")
-        with urllib.request.urlopen(req, timeout=10) as f:
+        if SUBIDA_COMPRIMIR:
+            req.data = gzip.compress(encoded)
+            req.add_header("Content-Encoding", "gzip")
+        with urllib.request.urlopen(req, timeout=timeout) as f:
             return f.read().decode("utf-8", errors="replace")
+    except urllib.error.HTTPError as e:
+        if 400 <= e.code < 500 and e.code not in (408, 429):
+            return False
+        return None
     except Exception:
         return None
 
 
-def _subir_ejercicios(dni, ejercicio, fuente):
-    """Envía el ejercicio a los dos scripts de Google Apps Script."""
-    try:
-        hostname = socket.gethostname()
+class _ColaSubidas:
+    """
+    Cola persistente de envíos pendientes sobre sqlite.
+    Cada operación abre su propia conexión, de modo que puede usarse
+    desde el hilo de la interfaz y desde el hilo emisor a la vez.
+    """
 
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip_local = s.getsockname()[0]
-            s.close()
-        except Exception:
-            ip_local = None
+    def __init__(self, ruta):
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        with self._conectar() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS pendientes ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " url TEXT NOT NULL,"
+                " datos TEXT NOT NULL,"
+                " intentos INTEGER NOT NULL DEFAULT 0,"
+                " proximo REAL NOT NULL DEFAULT 0,"
+                " creado REAL NOT NULL)"
+            )
+            # Fuentes ya entregadas a cada endpoint: (url, dni, ejercicio, hash)
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS entregados ("
+                " url TEXT NOT NULL,"
+                " dni TEXT NOT NULL,"
+                " ejercicio TEXT NOT NULL,"
+                " hash TEXT NOT NULL,"
+                " PRIMARY KEY (url, dni, ejercicio, hash))"
+            )
 
-        mac_raw = uuid.getnode()
-        mac = ":".join(
-            f"{(mac_raw >> shift) & 0xff:02x}" for shift in range(40, -1, -8)
-        )
+    def _conectar(self):
+        con = sqlite3.connect(self.ruta, timeout=5)
+        con.execute("PRAGMA journal_mode=WAL")
+        return contextlib.closing(con)
+
+    def encolar(self, datos: dict, urls):
+        ahora = time.time()
+        texto = json.dumps(datos, ensure_ascii=False)
+        with self._conectar() as con, con:
+            con.executemany(
+                "INSERT INTO pendientes (url, datos, creado) VALUES (?, ?, ?)",
+                [(url, texto, ahora) for url in urls],
+            )
 
-        url_fi = (
-            "https://script.google.com/macros/s/"
-            "AKfycby3wCtvhy2sqLmp9TAl5aEQ4zHTceMAxwA_4M2HCjFJQpvxWmstEoRa5NohH0Re2eQa/exec"
-        )
-        url_pomares = (
-            "https://script.google.com/macros/s/"
-            "AKfycbw1CMfaQcJuP1cLBmt5eHryrmb83Tb0oIrWu_XHfRQpYt8kWY_g6TpsQx92QwhB_SjyYg/exec"
+    def listos(self, ahora: float, limite: int):
+        """Filas cuyo próximo intento ya ha vencido, las más antiguas primero."""
+        with self._conectar() as con:
+            filas = con.execute(
+                "SELECT id, url, datos, intentos FROM pendientes"
+                " WHERE proximo <= ? ORDER BY id LIMIT ?",
+                (ahora, limite),
+            ).fetchall()
+        return [(i, url, json.loads(datos), n) for i, url, datos, n in filas]
+
+    def proximo_vencimiento(self):
+        """Instante del próximo reintento pendiente (None si la cola está vacía)."""
+        with self._conectar() as con:
+            (proximo,) = con.execute("SELECT MIN(proximo) FROM pendientes").fetchone()
+        return proximo
+
+    def confirmar(self, ids):
+        """Borra las filas enviadas y recuerda qué fuente recibió cada endpoint."""
+        if not ids:
+            return
+        with self._conectar() as con, con:
+            marcas = ",".join("?" * len(ids))
+            filas = con.execute(
+                f"SELECT url, datos FROM pendientes WHERE id IN ({marcas})", list(ids)
+            ).fetchall()
+            entregados = []
+            for url, datos in filas:
+                datos = json.loads(datos)
+                if datos.get("fuente_sha256"):
+                    entregados.append(
+                        (url, datos.get("dni") or "", datos.get("ejercicio") or "",
+                         datos["fuente_sha256"])
+                    )
+            # REPLACE renueva el rowid: al recortar se olvidan las más antiguas
+            con.executemany(
+                "INSERT OR REPLACE INTO entregados VALUES (?, ?, ?, ?)", entregados
+            )
+            con.execute(
+                "DELETE FROM entregados WHERE rowid <="
+                " (SELECT MAX(rowid) FROM entregados) - ?",
+                (SUBIDA_ENTREGADOS_MAX,),
+            )
+            con.executemany("DELETE FROM pendientes WHERE id = ?", [(i,) for i in ids])
+
+    def descartar(self, ids):
+        """Borra filas que el endpoint ha rechazado definitivamente."""
+        if not ids:
+            return
+        with self._conectar() as con, con:
+            con.executemany("DELETE FROM pendientes WHERE id = ?", [(i,) for i in ids])
+
+    def ya_entregado(self, url: str, datos: dict) -> bool:
+        """True si este endpoint ya tiene la fuente de (dni, ejercicio)."""
+        if not datos.get("fuente_sha256"):
+            return False
+        with self._conectar() as con:
+            fila = con.execute(
+                "SELECT 1 FROM entregados"
+                " WHERE url = ? AND dni = ? AND ejercicio = ? AND hash = ?",
+                (url, datos.get("dni") or "", datos.get("ejercicio") or "",
+                 datos["fuente_sha256"]),
+            ).fetchone()
+        return fila is not None
+
+    def aplazar(self, id_fila: int, intentos: int, proximo: float):
+        with self._conectar() as con, con:
+            con.execute(
+                "UPDATE pendientes SET intentos = ?, proximo = ? WHERE id = ?",
+                (intentos, proximo, id_fila),
+            )
+
+    def __len__(self):
+        with self._conectar() as con:
+            return con.execute("SELECT COUNT(*) FROM pendientes").fetchone()[0]
+
+
+def _espera_reintento(intentos: int) -> float:
+    """Backoff exponencial con algo de aleatoriedad para no sincronizar el aula."""
+    espera = min(SUBIDA_ESPERA_MAX, SUBIDA_ESPERA_BASE * (2 ** (intentos - 1)))
+    return espera * random.uniform(0.5, 1.0)
+
+
+class _EmisorSubidas:
+    """
+    Único hilo que vacía la cola de subidas.
+    - Saca lotes de hasta SUBIDA_LOTE filas vencidas.
+    - Los envía en paralelo (SUBIDA_HILOS POST simultáneos).
+    - Borra las que se confirman o se rechazan definitivamente y aplaza
+      las que fallan con backoff.
+    """
+
+    def __init__(self, cola: _ColaSubidas, enviar=_send_post):
+        self.cola = cola
+        self.enviar = enviar
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+        self._pool = ThreadPoolExecutor(
+            max_workers=SUBIDA_HILOS, thread_name_prefix="subidas"
         )
 
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(
+                target=self._bucle, name="emisor-subidas", daemon=True
+            )
+            self._hilo.start()
+
+    def avisar(self):
+        """Indica al hilo que hay trabajo nuevo en la cola."""
+        self._despertar.set()
+
+    def drenar(self, limite_tiempo=None, parar=None) -> int:
+        """
+        Envía todo lo que esté vencido, lote a lote, hasta vaciar la cola,
+        agotar limite_tiempo, quedarse solo con filas aplazadas o (entre
+        lotes) activarse parar. Devuelve el número de envíos confirmados.
+        """
+        fin = None if limite_tiempo is None else time.monotonic() + limite_tiempo
+        enviados = 0
+        while (fin is None or time.monotonic() < fin) and not (parar and parar.is_set()):
+            lote = self.cola.listos(time.time(), SUBIDA_LOTE)
+            if not lote:
+                break
+            timeout = SUBIDA_TIMEOUT
+            if fin is not None:
+                timeout = max(0.5, min(timeout, fin - time.monotonic()))
+            futuros = [
+                (fila, self._pool.submit(
+                    self.enviar, fila[1], self._cuerpo(fila[1], fila[2]), timeout
+                ))
+                for fila in lote
+            ]
+            ok, rechazados = [], []
+            for (id_fila, _url, _datos, intentos), fut in futuros:
+                respuesta = fut.result()
+                if respuesta is False:
+                    rechazados.append(id_fila)
+                elif respuesta is not None:
+                    ok.append(id_fila)
+                else:
+                    n = intentos + 1
+                    self.cola.aplazar(id_fila, n, time.time() + _espera_reintento(n))
+            self.cola.confirmar(ok)
+            self.cola.descartar(rechazados)
+            enviados += len(ok)
+        return enviados
+
+    def _cuerpo(self, url: str, datos: dict) -> dict:
+        """
+        Con SUBIDA_REFERENCIAS, si el endpoint ya recibió esta misma fuente
+        para (dni, ejercicio), solo se envía su hash como referencia.
+        """
+        if SUBIDA_REFERENCIAS and self.cola.ya_entregado(url, datos):
+            datos = dict(datos)
+            datos["fuente"] = ""
+            datos["fuente_ref"] = datos["fuente_sha256"]
+        return datos
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                self.drenar(parar=self._parar)
+                proximo = self.cola.proximo_vencimiento()
+            except Exception:
+                # Base de datos bloqueada o corrupta: reintentamos más tarde
+                proximo = time.time() + SUBIDA_ESPERA_MAX
+            espera = None if proximo is None else max(0.0, proximo - time.time())
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+    def cerrar(self, limite_tiempo=SUBIDA_FLUSH_SALIDA):
+        """
+        Último intento de vaciar la cola antes de salir de Thonny. Primero
+        se detiene el hilo emisor (termina el lote en curso), para no
+        enviar dos veces las mismas filas; si no termina a tiempo, lo que
+        quede pendiente se enviará en la próxima sesión.
+        """
+        fin = time.monotonic() + limite_tiempo
+        self._parar.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(limite_tiempo)
+        if self._hilo is None or not self._hilo.is_alive():
+            try:
+                self.drenar(max(0.0, fin - time.monotonic()))
+            except Exception:
+                pass
+        self._pool.shutdown(wait=False)
+
+
+_EMISOR = None
+_EMISOR_LOCK = threading.Lock()
+
+
+def _obtener_emisor():
+    """Crea (una sola vez por sesión) la cola y su hilo emisor."""
+    global _EMISOR
+    with _EMISOR_LOCK:
+        if _EMISOR is None:
+            _EMISOR = _EmisorSubidas(_ColaSubidas(COLA_SUBIDAS_PATH))
+            atexit.register(_EMISOR.cerrar)
+            _EMISOR.iniciar()
+        return _EMISOR
+
+
+def _identidad_equipo() -> dict:
+    """Nombre, IP local y MAC del equipo (calculados una vez por sesión)."""
+    global _IDENTIDAD_CACHE
+    if _IDENTIDAD_CACHE is not None:
+        return _IDENTIDAD_CACHE
+
+    hostname = socket.gethostname()
+
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        ip_local = s.getsockname()[0]
+        s.close()
+    except Exception:
+        ip_local = None
+
+    mac_raw = uuid.getnode()
+    mac = ":".join(
+        f"{(mac_raw >> shift) & 0xff:02x}" for shift in range(40, -1, -8)
+    )
+
+    _IDENTIDAD_CACHE = {"ordenador": hostname, "ip": ip_local, "mac": mac}
+    return _IDENTIDAD_CACHE
+
+
+def _subir_ejercicios(dni, ejercicio, fuente):
+    """Encola el ejercicio para los dos scripts de Google Apps Script."""
+    try:
         data = {
             "key": "Thonny#fi",
-            "ordenador": hostname,
-            "ip": ip_local,
-            "mac": mac,
+            **_identidad_equipo(),
             "dni": dni,
             "ejercicio": ejercicio,
             "fuente": fuente,
+            "fuente_sha256": hashlib.sha256(fuente.encode("utf-8")).hexdigest(),
         }
 
-        _send_post(url_fi, data)
-        _send_post(url_pomares, data)
+        try:
+            emisor = _obtener_emisor()
+            emisor.cola.encolar(data, URLS_SUBIDA)
+            emisor.avisar()
+        except Exception:
+            # Sin cola local (disco de solo lectura, ...): envío directo
+            threading.Thread(
+                target=lambda: [_send_post(url, data) for url in URLS_SUBIDA],
+                daemon=True,
+            ).start()
 
     except Exception:
         # No queremos romper la corrección por un fallo de red
@@ -190,24 +737,104 @@ def _subir_ejercicios(dni, ejercicio, fuente):
 # -------------------------------------------------------------------------
 
 
-def _descargar_tests():
-    """Descarga y cachea tests.json."""
+def _descargar_tests(avisar=True):
+    """Descarga y cachea tests.json (avisar=False: sin ventanas de error)."""
     global _TESTS_CACHE
     if _TESTS_CACHE is not None:
         return _TESTS_CACHE
 
     try:
-        with urllib.request.urlopen(TESTS_URL, timeout=5) as resp:
+        with _fase(None, "_descargar_tests"), \
+                abrir_recurso("tests.json", TESTS_URL, timeout=5) as resp:
             data = resp.read().decode("utf-8")
-            _TESTS_CACHE = json.loads(data)
+            _TESTS_CACHE = _internar_tests(json.loads(data))
             return _TESTS_CACHE
     except Exception as e:
-        messagebox.showerror(
-            "Error", f"No se pudo descargar tests.json desde GitHub:\n{e}"
-        )
+        if avisar:
+            messagebox.showerror(
+                "Error", f"No se pudo descargar tests.json desde GitHub:\n{e}"
+            )
         return None
 
 
+# -------------------------------------------------------------------------
+# CONTENIDOS DE FICHEROS COMPARTIDOS
+# -------------------------------------------------------------------------
+#
+# En tests.json los mismos contenidos ("Alejandro", "Martinez", ...) y los
+# mismos conjuntos de ficheros se repiten en muchos casos. Al cargar se
+# guardan una sola vez en una tabla indexada por hash: cada caso apunta al
+# conjunto compartido, y los bytes que se escriben en el sandbox se
+# codifican una vez por contenido distinto.
+
+# hash -> contenido
+_BLOBS = {}
+# hash -> bytes listos para escribir en disco
+_BLOBS_BYTES = {}
+# huella del conjunto -> _ConjuntoFicheros compartido
+_CONJUNTOS = {}
+
+
+def _hash_contenido(contenido: str) -> str:
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()
+
+
+class _ConjuntoFicheros(dict):
+    """
+    Diccionario nombre -> contenido compartido entre casos. hashes guarda
+    nombre -> hash del contenido y huella identifica el conjunto completo.
+    """
+
+    __slots__ = ("hashes", "huella")
+
+
+def _internar_ficheros(ficheros):
+    if not ficheros or isinstance(ficheros, _ConjuntoFicheros):
+        return ficheros
+    hashes = {}
+    for nombre, contenido in ficheros.items():
+        h = _hash_contenido(contenido)
+        _BLOBS.setdefault(h, contenido)
+        hashes[sys.intern(nombre)] = h
+    huella = _hash_contenido(json.dumps(list(hashes.items())))
+    conjunto = _CONJUNTOS.get(huella)
+    if conjunto is None:
+        conjunto = _ConjuntoFicheros((n, _BLOBS[h]) for n, h in hashes.items())
+        conjunto.hashes = hashes
+        conjunto.huella = huella
+        _CONJUNTOS[huella] = conjunto
+    return conjunto
+
+
+def _internar_tests(tests: dict) -> dict:
+    """Sustituye filesIni / filesEnd_ok de cada caso por conjuntos compartidos."""
+    for lista in tests.values():
+        for test in lista:
+            for campo in ("filesIni", "filesEnd_ok"):
+                if test.get(campo):
+                    test[campo] = _internar_ficheros(test[campo])
+    return tests
+
+
+def _codificar_fichero(contenido: str) -> bytes:
+    """Bytes tal y como los escribe open(..., "w", encoding="utf-8")."""
+    return contenido.replace("\n", os.linesep).encode("utf-8")
+
+
+def _bytes_ficheros(ficheros: dict):
+    """(nombre, bytes) de cada fichero; los compartidos se codifican una vez."""
+    hashes = getattr(ficheros, "hashes", None)
+    if hashes is None:
+        return [(n, _codificar_fichero(c)) for n, c in ficheros.items()]
+    resultado = []
+    for nombre, h in hashes.items():
+        datos = _BLOBS_BYTES.get(h)
+        if datos is None:
+            datos = _BLOBS_BYTES[h] = _codificar_fichero(_BLOBS[h])
+        resultado.append((nombre, datos))
+    return resultado
+
+
 # -------------------------------------------------------------------------
 # UTILIDADES DE EJECUCIÓN Y COMPARACIÓN
 # -------------------------------------------------------------------------
@@ -226,10 +853,12 @@ def _extraer_dni_ejercicio(fuente: str):
 def _preprocesar_fuente(src: str) -> str:
     """
     Sustituye input(...) por inputt(...), para que se vean en pantalla
-    las entradas por teclado del alumno durante la corrección.
+    las entradas por teclado del alumno durante la corrección. Antepone
+    también la línea de arranque de los ganchos del corrector (_ARRANQUE).
     """
     src_mod = re.sub(r"input\s*\(", "inputt(", src)
     cabecera = (
+        _ARRANQUE +
         "def inputt(msg=''):\n"
         "    x = input(msg)\n"
         "    print(x)\n"
@@ -347,9 +976,919 @@ def _formatear_dict_ficheros(d: dict) -> str:
     return "\n".join(lineas)
 
 
+# -------------------------------------------------------------------------
+# CANAL DE RESULTADOS DE FUNCIONES
+# -------------------------------------------------------------------------
+#
+# El valor devuelto por la función del alumno no viaja por stdout: el
+# envoltorio lo escribe en un fichero propio (fuera del directorio del
+# test) con una codificación JSON que conserva tuplas, conjuntos,
+# diccionarios con claves no str y bytes. Junto al valor van la excepción
+# (si la hubo) y el tiempo que tardó la llamada.
+
+_ENVOLTORIO_FUNCION = r'''
+import json, sys, time, traceback
+
+def _cod(v):
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    if isinstance(v, list):
+        return [_cod(x) for x in v]
+    if isinstance(v, tuple):
+        return {"__t": "tuple", "v": [_cod(x) for x in v]}
+    if isinstance(v, (set, frozenset)):
+        return {"__t": type(v).__name__, "v": [_cod(x) for x in v]}
+    if isinstance(v, dict):
+        if "__t" not in v and all(type(k) is str for k in v):
+            return {k: _cod(x) for k, x in v.items()}
+        return {"__t": "dict", "v": [[_cod(k), _cod(x)] for k, x in v.items()]}
+    if isinstance(v, (bytes, bytearray)):
+        return {"__t": "bytes", "v": bytes(v).hex()}
+    return {"__t": "repr", "v": repr(v), "tipo": type(v).__name__}
+
+def _escribir(res):
+    with open(_canal, "w", encoding="utf-8") as f:
+        json.dump(res, f, ensure_ascii=False)
+
+_nombre, _args, _canal = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3]
+del sys.argv[1:]
+import alumno
+_t0 = time.perf_counter()
+try:
+    _ret = getattr(alumno, _nombre)(*_args)
+except BaseException as _e:
+    _escribir({
+        "ok": False,
+        "t": time.perf_counter() - _t0,
+        "exc": {
+            "tipo": type(_e).__name__,
+            "mensaje": str(_e),
+            "traceback": traceback.format_exc(),
+        },
+    })
+    raise
+_t = time.perf_counter() - _t0
+sys.stdout.flush()
+_escribir({"ok": True, "t": _t, "ret": _cod(_ret)})
+'''
+
+
+class _ValorRepr:
+    """Valor devuelto que no se puede reconstruir: se conserva su repr."""
+
+    def __init__(self, texto, tipo):
+        self.texto = texto
+        self.tipo = tipo
+
+    def __repr__(self):
+        return self.texto
+
+    def __eq__(self, otro):
+        return isinstance(otro, _ValorRepr) and otro.texto == self.texto
+
+    def __hash__(self):
+        return hash(self.texto)
+
+
+def _decodificar_valor(v):
+    """Inverso de _cod (en _ENVOLTORIO_FUNCION)."""
+    if isinstance(v, list):
+        return [_decodificar_valor(x) for x in v]
+    if not isinstance(v, dict):
+        return v
+    etiqueta = v.get("__t")
+    if etiqueta is None:
+        return {k: _decodificar_valor(x) for k, x in v.items()}
+    if etiqueta == "tuple":
+        return tuple(_decodificar_valor(x) for x in v["v"])
+    if etiqueta == "set":
+        return set(_decodificar_valor(x) for x in v["v"])
+    if etiqueta == "frozenset":
+        return frozenset(_decodificar_valor(x) for x in v["v"])
+    if etiqueta == "dict":
+        return {_decodificar_valor(k): _decodificar_valor(x) for k, x in v["v"]}
+    if etiqueta == "bytes":
+        return bytes.fromhex(v["v"])
+    return _ValorRepr(v.get("v", ""), v.get("tipo", ""))
+
+
+def _como_json(v):
+    """
+    Forma en la que tests.json puede expresar un valor: tuplas y conjuntos
+    como listas (conjuntos ordenados si se puede), claves como str.
+    """
+    if isinstance(v, (list, tuple)):
+        return [_como_json(x) for x in v]
+    if isinstance(v, (set, frozenset)):
+        elementos = [_como_json(x) for x in v]
+        try:
+            return sorted(elementos)
+        except TypeError:
+            return elementos
+    if isinstance(v, dict):
+        return {_clave_json(k): _como_json(x) for k, x in v.items()}
+    return v
+
+
+def _clave_json(k):
+    """Clave de diccionario tal y como la escribiría json.dumps."""
+    if isinstance(k, str):
+        return k
+    if k is None or isinstance(k, (bool, int, float)):
+        return json.dumps(k)
+    return repr(k)
+
+
+def _leer_canal(ruta: str):
+    """Contenido del canal de resultados, o None si la función no llegó a escribirlo."""
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            texto = f.read()
+    except OSError:
+        return None
+    if not texto:
+        return None
+    return json.loads(texto)
+
+
+# -------------------------------------------------------------------------
+# CÓDIGO DE ARRANQUE DE alumno.py
+# -------------------------------------------------------------------------
+#
+# La primera línea de alumno.py ejecuta, cada uno en un espacio de nombres
+# propio, los ganchos que el corrector le pasa por el entorno (perfil de
+# muestreo y, si el test lo pide, presupuesto de pasos). Fuera del
+# corrector la variable no existe y la línea no hace nada.
+
+_ARRANQUE_ENV = "FIUMH_ARRANQUE"
+
+_ARRANQUE = f"exec(__import__('os').environ.pop('{_ARRANQUE_ENV}', ''), {{}})\n"
+
+
+# -------------------------------------------------------------------------
+# PERFIL DE MUESTREO (al exceder el tiempo)
+# -------------------------------------------------------------------------
+#
+# Si una ejecución dura más de PERFIL_RETARDO, un hilo del propio proceso
+# del alumno empieza a mirar cada PERFIL_INTERVALO en qué línea de
+# alumno.py está el hilo principal y va dejando el recuento en un canal.
+# Además, faulthandler vuelca la pila justo antes de que se agote el
+# tiempo. Si el test excede el tiempo, el informe dice en qué líneas se
+# quedó el programa. Las ejecuciones normales terminan antes del retardo
+# y no pagan nada. El muestreo tiende a señalar la cabecera de los bucles
+# (es donde el intérprete cede el control a otros hilos); la pila final
+# de faulthandler da la línea exacta.
+
+PERFIL_RETARDO = 0.5
+PERFIL_INTERVALO = 0.005
+PERFIL_LINEAS = 5
+
+_PERFIL_GANCHO = r'''
+import os, sys, json, time, threading, faulthandler
+
+_canal = os.environ.pop("FIUMH_PERFIL_CANAL")
+_limite = float(os.environ.pop("FIUMH_PERFIL_LIMITE"))
+_retardo = float(os.environ.pop("FIUMH_PERFIL_RETARDO"))
+_intervalo = float(os.environ.pop("FIUMH_PERFIL_INTERVALO"))
+_principal = threading.get_ident()
+
+_pila = open(_canal + ".pila", "w")
+faulthandler.dump_traceback_later(_limite, file=_pila)
+
+def _muestrear():
+    time.sleep(_retardo)
+    cuentas = {}
+    volcado = time.monotonic() + 0.25
+    while True:
+        f = sys._current_frames().get(_principal)
+        while f is not None and not f.f_code.co_filename.endswith("alumno.py"):
+            f = f.f_back
+        if f is not None:
+            cuentas[f.f_lineno] = cuentas.get(f.f_lineno, 0) + 1
+        if time.monotonic() >= volcado:
+            with open(_canal + ".tmp", "w") as s:
+                json.dump(cuentas, s)
+            os.replace(_canal + ".tmp", _canal)
+            volcado = time.monotonic() + 0.25
+        time.sleep(_intervalo)
+
+threading.Thread(target=_muestrear, daemon=True).start()
+'''
+
+
+def _leer_perfil(canal: str):
+    """{"muestras": {línea: n}, "pila": texto} del canal de perfil."""
+    muestras = _leer_canal(canal) or {}
+    try:
+        with open(canal + ".pila", "r", encoding="utf-8", errors="replace") as f:
+            pila = f.read()
+    except OSError:
+        pila = ""
+    return {"muestras": {int(n): c for n, c in muestras.items()}, "pila": pila}
+
+
+def _informe_perfil(perfil, fuente: str) -> str:
+    """Líneas más frecuentes y pila final, con la numeración del alumno."""
+    if not perfil:
+        return ""
+    desplazamiento = _preprocesar_fuente("").count("\n")
+    lineas = fuente.splitlines()
+
+    def texto(n):
+        return lineas[n - 1].strip() if 0 < n <= len(lineas) else ""
+
+    partes = []
+    muestras = {
+        n - desplazamiento: c for n, c in perfil.get("muestras", {}).items()
+        if n > desplazamiento
+    }
+    total = sum(muestras.values())
+    if total:
+        partes.append("Líneas de tu código en las que se quedó el programa:")
+        mas_frecuentes = sorted(muestras.items(), key=lambda x: -x[1])
+        for n, c in mas_frecuentes[:PERFIL_LINEAS]:
+            partes.append(f"   línea {n:>4} ({c / total:4.0%}):  {texto(n)}")
+
+    pila = []
+    for m in re.finditer(r'File ".*alumno\.py", line (\d+) in (\S+)',
+                         perfil.get("pila", "")):
+        n = int(m.group(1)) - desplazamiento
+        if n > 0:
+            donde = "programa principal" if m.group(2) == "<module>" else m.group(2)
+            pila.append(f"   línea {n:>4} ({donde}):  {texto(n)}")
+    if pila:
+        # faulthandler escribe primero la llamada más interna
+        partes.append("Estaba ejecutando (de la llamada más interna a la más externa):")
+        partes.extend(pila)
+    return "\n".join(partes)
+
+
+# -------------------------------------------------------------------------
+# PRESUPUESTO DE PASOS (opcional, por test)
+# -------------------------------------------------------------------------
+#
+# Un test con "pasos": N no se limita por tiempo sino por líneas de
+# alumno.py ejecutadas: al llegar a N el proceso se detiene y el test
+# falla por tiempo, igual en un PC libre que en un laboratorio cargado.
+# El recuento lo hace un gancho que se instala al empezar alumno.py
+# (sys.monitoring desde Python 3.12, sys.settrace antes, ver
+# _canales_arranque) y que deja en
+# un canal propio los pasos usados. Solo cuentan las líneas del alumno,
+# no las de la cabecera de _preprocesar_fuente (inputt incluida), y la
+# vuelta al principio de un bucle escrito en una sola línea cuenta como
+# un paso aunque el intérprete no emita un evento de línea nuevo.
+# TIMEOUT_PASOS queda como red de seguridad por si el alumno se bloquea
+# fuera de su código (input, sleep).
+
+TIMEOUT_PASOS = 60
+
+_PASOS_ENV = "FIUMH_PASOS"
+
+_PASOS_GANCHO = r'''
+import os, sys, json, atexit
+
+_max = int(os.environ.pop("FIUMH_PASOS_MAX"))
+_canal = os.environ.pop("FIUMH_PASOS_CANAL")
+_desde = int(os.environ.pop("FIUMH_PASOS_DESDE", "0"))
+_pasos = 0
+
+def _escribir(agotado):
+    with open(_canal, "w", encoding="utf-8") as f:
+        json.dump({"pasos": _pasos, "max": _max, "agotado": agotado}, f)
+
+def _agotado():
+    _escribir(True)
+    for s in (sys.stdout, sys.stderr):
+        try:
+            s.flush()
+        except Exception:
+            pass
+    os._exit(3)
+
+def _contar():
+    global _pasos
+    _pasos += 1
+    if _pasos > _max:
+        _agotado()
+
+atexit.register(_escribir, False)
+
+if hasattr(sys, "monitoring"):
+    _m = sys.monitoring
+    _id = _m.COVERAGE_ID
+
+    _lineas = {}
+
+    def _linea(code, n):
+        if not code.co_filename.endswith("alumno.py") or n <= _desde:
+            return _m.DISABLE
+        _contar()
+
+    def _salto(code, origen, destino):
+        # La vuelta al principio de un bucle escrito en una sola línea
+        # también es un paso (LINE no se emite si no cambia la línea)
+        if not code.co_filename.endswith("alumno.py"):
+            return _m.DISABLE
+        if destino > origen:
+            return None
+        lineas = _lineas.get(code)
+        if lineas is None:
+            lineas = _lineas[code] = {}
+            for ini, fin, ln in code.co_lines():
+                for i in range(ini, fin, 2):
+                    lineas[i] = ln
+        linea = lineas.get(origen)
+        if linea == lineas.get(destino) and (linea or 0) > _desde:
+            _contar()
+
+    _m.use_tool_id(_id, "fiumh")
+    _m.register_callback(_id, _m.events.LINE, _linea)
+    _m.register_callback(_id, _m.events.JUMP, _salto)
+    _m.set_events(_id, _m.events.LINE | _m.events.JUMP)
+else:
+    import dis
+
+    _destinos = {}
+
+    def _bucles_linea(code):
+        # Destinos de los saltos hacia atrás que no cambian de línea: en
+        # 3.10 y 3.11 "while True: pass" no emite eventos de línea al dar
+        # la vuelta, así que en esos marcos se trazan también los opcodes
+        destinos = _destinos.get(code)
+        if destinos is None:
+            destinos = set()
+            instrucciones = list(dis.get_instructions(code))
+            lineas, linea = {}, None
+            for ins in instrucciones:
+                if ins.starts_line is not None:
+                    linea = ins.starts_line
+                lineas[ins.offset] = linea
+            for ins in instrucciones:
+                if (ins.opcode in dis.hasjrel or ins.opcode in dis.hasjabs) \
+                        and isinstance(ins.argval, int) and ins.argval <= ins.offset \
+                        and lineas.get(ins.argval) == lineas[ins.offset]:
+                    destinos.add(ins.argval)
+            _destinos[code] = destinos
+        return destinos
+
+    def _traza(frame):
+        destinos = _bucles_linea(frame.f_code)
+        if destinos:
+            frame.f_trace_opcodes = True
+        ultimo = [-1, -1]   # último opcode, opcode con evento de línea
+
+        def _local(frame, evento, arg):
+            if evento == "line":
+                ultimo[1] = frame.f_lasti
+                if frame.f_lineno > _desde:
+                    _contar()
+            elif evento == "opcode":
+                i = frame.f_lasti
+                # Vuelta de un bucle de una línea sin evento de línea propio
+                if i in destinos and i <= ultimo[0] and ultimo[1] != i \
+                        and frame.f_lineno > _desde:
+                    _contar()
+                ultimo[0], ultimo[1] = i, -1
+            return _local
+        return _local
+
+    def _global(frame, evento, arg):
+        if frame.f_code.co_filename.endswith("alumno.py"):
+            return _traza(frame)
+        return None
+
+    # El módulo alumno ya está en marcha: se traza también su marco
+    _f = sys._getframe(1)
+    while _f is not None:
+        if _f.f_code.co_filename.endswith("alumno.py"):
+            _f.f_trace = _traza(_f)
+        _f = _f.f_back
+    sys.settrace(_global)
+'''
+
+
+# Límites de recursos del proceso del alumno (resource.setrlimit), para
+# corregir código ajeno en una máquina compartida (servidor_correccion).
+# None = sin límites, como en el PC del alumno; si no, {"CPU": s,
+# "AS": bytes, "NPROC": n, "FSIZE": bytes}. Se aplican en el propio hijo,
+# antes de que empiece el programa, y el alumno no puede subirlos.
+LIMITES_RECURSOS = None
+
+_LIMITES_GANCHO = r'''
+import os, json
+try:
+    import resource
+except ImportError:
+    resource = None
+_limites = json.loads(os.environ.pop("FIUMH_LIMITES", "{}"))
+if resource is not None:
+    for _nombre, _valor in _limites.items():
+        _r = getattr(resource, "RLIMIT_" + _nombre, None)
+        if _r is None:
+            continue
+        _duro = resource.getrlimit(_r)[1]
+        if _duro != resource.RLIM_INFINITY:
+            _valor = min(_valor, _duro)
+        try:
+            resource.setrlimit(_r, (_valor, _valor))
+        except (ValueError, OSError):
+            pass
+'''
+
+
+def _presupuesto_test(test: dict):
+    """Pasos máximos declarados en el test, o None si se limita por tiempo."""
+    pasos = test.get("pasos")
+    if isinstance(pasos, int) and not isinstance(pasos, bool) and pasos > 0:
+        return pasos
+    return None
+
+
+@contextlib.contextmanager
+def _canales_arranque(pasos, timeout):
+    """
+    Entorno del subproceso con los ganchos de arranque (límites si hay
+    LIMITES_RECURSOS, perfil y, si pasos no es None, presupuesto) y sus
+    canales. Produce (env, leer_pasos,
+    leer_perfil); sin presupuesto, leer_pasos() devuelve None.
+    """
+    canales = []
+    for prefijo in ("corr_perfil_", "corr_pasos_"):
+        fd, canal = tempfile.mkstemp(prefix=prefijo, suffix=".json")
+        os.close(fd)
+        canales.append(canal)
+    canal_perfil, canal_pasos = canales
+
+    env = dict(os.environ)
+    env["FIUMH_PERFIL_CANAL"] = canal_perfil
+    env["FIUMH_PERFIL_LIMITE"] = str(max(timeout - 0.3, 0.1))
+    env["FIUMH_PERFIL_RETARDO"] = str(PERFIL_RETARDO)
+    env["FIUMH_PERFIL_INTERVALO"] = str(PERFIL_INTERVALO)
+    ganchos = [_PERFIL_GANCHO]
+    if LIMITES_RECURSOS:
+        env["FIUMH_LIMITES"] = json.dumps(LIMITES_RECURSOS)
+        ganchos.insert(0, _LIMITES_GANCHO)
+    if pasos is not None:
+        env[_PASOS_ENV + "_MAX"] = str(pasos)
+        env[_PASOS_ENV + "_CANAL"] = canal_pasos
+        env[_PASOS_ENV + "_DESDE"] = str(_preprocesar_fuente("").count("\n"))
+        ganchos.append(_PASOS_GANCHO)
+    env[_ARRANQUE_ENV] = "\n".join(f"exec({g!r}, {{}})" for g in ganchos)
+
+    try:
+        yield (
+            env,
+            (lambda: _leer_canal(canal_pasos)) if pasos is not None else (lambda: None),
+            lambda: _leer_perfil(canal_perfil),
+        )
+    finally:
+        for ruta in (canal_perfil, canal_perfil + ".tmp", canal_perfil + ".pila",
+                     canal_pasos):
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+
+def _anotar_pasos(res: dict, recuento) -> bool:
+    """
+    Copia en res los pasos usados; si se agotó el presupuesto marca el
+    error de tiempo y devuelve True.
+    """
+    if recuento is None:
+        return False
+    res["pasos"] = recuento.get("pasos", 0)
+    if not recuento.get("agotado"):
+        return False
+    res["error_tipo"] = "tiempo"
+    res["error_detalle"] = (
+        f"Se superó el límite de {recuento.get('max')} pasos "
+        "(posible bucle infinito)."
+    )
+    return True
+
+
+# -------------------------------------------------------------------------
+# TRABAJADOR CALIENTE (ejecución sin arrancar un intérprete por caso)
+# -------------------------------------------------------------------------
+#
+# Arrancar un intérprete nuevo para cada caso cuesta más que muchos de
+# los casos; en los equipos lentos del laboratorio es casi todo el tiempo
+# de corrección. Donde hay os.fork, cada caso se pasa a un proceso
+# trabajador ya arrancado (con el mismo intérprete que usa el alumno en
+# Thonny, ver _interprete) que hace fork por caso: el hijo cambia al
+# sandbox, sustituye entorno, argv y entrada/salida estándar y ejecuta
+# alumno.py (o el envoltorio de funciones) igual que lo haría
+# "python alumno.py" / "python -c ...". Cada caso empieza así desde el
+# estado limpio del trabajador, que nunca ejecuta código del alumno.
+#
+# No se usa el proceso del Shell de Thonny: tiene el estado del alumno y
+# atiende una orden cada vez. Hay un trabajador por corrección simultánea
+# (hasta TRABAJADORES_MAX); si no hay ninguno libre, en Windows, con
+# FIUMH_TRABAJADOR=0 o si el trabajador falla antes de lanzar el caso, se
+# usa el subproceso de siempre.
+
+TRABAJADOR_ACTIVO = (
+    hasattr(os, "fork") and os.environ.get("FIUMH_TRABAJADOR", "1") != "0"
+)
+TRABAJADORES_MAX = os.cpu_count() or 2
+# Segundos para arrancar el trabajador y para que lance cada caso
+TRABAJADOR_ARRANQUE = 10
+
+_TRABAJADOR_CODIGO = r'''
+import os, sys, io, gc, json, time, types, locale, atexit, builtins
+import importlib, threading, traceback, faulthandler
+
+_pet = os.fdopen(os.dup(0), "r", encoding="utf-8")
+_res = os.fdopen(os.dup(1), "w", encoding="utf-8")
+_nulo = os.open(os.devnull, os.O_RDWR)
+os.dup2(_nulo, 0)
+os.dup2(_nulo, 1)
+os.chdir(sys.argv[1])
+if hasattr(gc, "freeze"):
+    gc.freeze()
+
+def _enviar(d):
+    _res.write(json.dumps(d) + "\n")
+    _res.flush()
+
+def _codigo_salida(e):
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+def _hijo(p):
+    _pet.close()
+    _res.close()
+    if p.get("nice"):
+        os.nice(p["nice"])
+    os.chdir(p["cwd"])
+    os.environ.clear()
+    os.environ.update(p["env"])
+    for fd, ruta, modo in ((0, p["stdin"], os.O_RDONLY),
+                           (1, p["stdout"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+                           (2, p["stderr"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC)):
+        f = os.open(ruta, modo, 0o600)
+        os.dup2(f, fd)
+        os.close(f)
+    cod, _, errores = os.environ.get("PYTHONIOENCODING", "").partition(":")
+    if not cod:
+        cod = "utf-8" if os.environ.get("PYTHONUTF8") == "1" else locale.getpreferredencoding(False)
+    sys.stdin = sys.__stdin__ = io.TextIOWrapper(
+        io.open(0, "rb", closefd=False), encoding=cod, errors=errores or "strict")
+    sys.stdout = sys.__stdout__ = io.TextIOWrapper(
+        io.open(1, "wb", closefd=False), encoding=cod, errors=errores or "strict")
+    sys.stderr = sys.__stderr__ = io.TextIOWrapper(
+        io.open(2, "wb", closefd=False), encoding=cod, errors="backslashreplace",
+        line_buffering=True)
+
+    argv = p["argv"]
+    principal = types.ModuleType("__main__")
+    principal.__builtins__ = builtins
+    if argv[0] == "-c":
+        nombre, fuente = "<string>", argv[1]
+        sys.argv = ["-c"] + argv[2:]
+        sys.path[0] = ""
+    else:
+        nombre = principal.__file__ = argv[0]
+        with open(nombre, "rb") as f:
+            fuente = f.read()
+        sys.argv = list(argv)
+        sys.path[0] = os.path.dirname(nombre)
+    sys.modules["__main__"] = principal
+    importlib.invalidate_caches()
+
+    estado = 0
+    try:
+        exec(compile(fuente, nombre, "exec"), principal.__dict__)
+    except SystemExit as e:
+        estado = _codigo_salida(e)
+    except BaseException as e:
+        # Sin el marco de este envoltorio, como lo mostraría el intérprete
+        e = e.with_traceback(e.__traceback__.tb_next)
+        sys.excepthook(type(e), e, e.__traceback__)
+        estado = 1
+    for hilo in threading.enumerate():
+        if hilo is not threading.current_thread() and not hilo.daemon:
+            hilo.join()
+    try:
+        atexit._run_exitfuncs()
+    except SystemExit as e:
+        estado = _codigo_salida(e)
+    for flujo in (sys.stdout, sys.stderr):
+        try:
+            flujo.flush()
+        except Exception:
+            pass
+    os._exit(estado)
+
+for _linea in _pet:
+    _p = json.loads(_linea)
+    _pid = os.fork()
+    if _pid == 0:
+        try:
+            _hijo(_p)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(1)
+    _enviar({"pid": _pid})
+    _, _estado, _uso = os.wait4(_pid, 0)
+    _codigo = -os.WTERMSIG(_estado) if os.WIFSIGNALED(_estado) else os.WEXITSTATUS(_estado)
+    _enviar({"codigo": _codigo, "cpu": _uso.ru_utime + _uso.ru_stime})
+'''
+
+
+class _TrabajadorRoto(Exception):
+    """El trabajador no responde: se descarta y se usa un subproceso."""
+
+
+class _ProcesoTrabajador:
+    """Caso en marcha en un trabajador; se cancela como un Popen."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+
+class _Trabajador:
+    def __init__(self, interprete: str):
+        self.interprete = interprete
+        self.dir = tempfile.mkdtemp(prefix="corr_trab_")
+        self._buffer = b""
+        self.proc = subprocess.Popen(
+            [interprete, "-c", _TRABAJADOR_CODIGO, self.dir],
+            cwd=self.dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._fd = self.proc.stdout.fileno()
+
+    def vivo(self) -> bool:
+        return self.proc.poll() is None
+
+    def _mensaje(self, limite):
+        """Siguiente mensaje del trabajador, o None si pasan limite segundos."""
+        fin = time.monotonic() + limite
+        while b"\n" not in self._buffer:
+            listos, _, _ = select.select([self._fd], [], [], max(fin - time.monotonic(), 0))
+            if not listos:
+                return None
+            datos = os.read(self._fd, 65536)
+            if not datos:
+                raise _TrabajadorRoto("El trabajador de corrección ha terminado.")
+            self._buffer += datos
+        linea, _, self._buffer = self._buffer.partition(b"\n")
+        return json.loads(linea)
+
+    def ejecutar(self, cmd, td, stdin_content, tiempos, env, timeout, trabajo):
+        """Como _ejecutar_aislado; _TrabajadorRoto si el caso no llegó a lanzarse."""
+        entrada = os.path.join(self.dir, "entrada")
+        salida = os.path.join(self.dir, "salida")
+        errores = os.path.join(self.dir, "errores")
+        with open(entrada, "wb") as f:
+            f.write(stdin_content.encode("utf-8"))
+        peticion = {
+            "argv": list(cmd[1:]), "cwd": td,
+            "env": dict(os.environ if env is None else env),
+            "stdin": entrada, "stdout": salida, "stderr": errores,
+            "nice": ANTICIPADA_NICE if trabajo is not None else 0,
+        }
+        with _fase(tiempos, "lanzar"):
+            try:
+                self.proc.stdin.write(json.dumps(peticion).encode("utf-8") + b"\n")
+                self.proc.stdin.flush()
+            except OSError as e:
+                raise _TrabajadorRoto(str(e))
+            inicio = self._mensaje(TRABAJADOR_ARRANQUE)
+            if inicio is None:
+                raise _TrabajadorRoto("El trabajador de corrección no responde.")
+        proceso = _ProcesoTrabajador(inicio["pid"])
+        if trabajo is not None:
+            trabajo.proceso = proceso
+            if trabajo.cancelado.is_set():
+                proceso.kill()
+
+        with _fase(tiempos, "ejecutar") as f:
+            try:
+                fin = self._mensaje(timeout)
+                if fin is None:
+                    proceso.kill()
+                    if self._mensaje(TRABAJADOR_ARRANQUE) is None:
+                        self.proc.kill()
+                    f.args["timeout"] = True
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+            except _TrabajadorRoto as e:
+                # El caso ya estaba en marcha: no se puede repetir sin más
+                raise RuntimeError(str(e))
+            proceso.returncode = fin["codigo"]
+            tiempos["cpu"] = fin["cpu"]
+            f.args["returncode"] = fin["codigo"]
+        with open(salida, "rb") as f:
+            stdout = f.read()
+        with open(errores, "rb") as f:
+            stderr = f.read()
+        return subprocess.CompletedProcess(cmd, fin["codigo"], stdout, stderr)
+
+    def cerrar(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=1)
+        except Exception:
+            self.proc.kill()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+_TRABAJADORES_LIBRES = []
+_TRABAJADORES_TOTAL = 0
+_TRABAJADORES_LOCK = threading.Lock()
+
+
+def _interprete() -> str:
+    """Intérprete con el que el alumno ejecuta sus programas en Thonny."""
+    try:
+        from thonny import get_runner
+        ejecutable = get_runner().get_local_executable()
+    except Exception:
+        ejecutable = None
+    return ejecutable if ejecutable and os.path.exists(ejecutable) else sys.executable
+
+
+def _tomar_trabajador(interprete: str):
+    """Trabajador libre para interprete (lo arranca si hace falta) o None."""
+    global _TRABAJADORES_TOTAL
+    if not TRABAJADOR_ACTIVO:
+        return None
+    with _TRABAJADORES_LOCK:
+        while _TRABAJADORES_LIBRES:
+            trabajador = _TRABAJADORES_LIBRES.pop()
+            if trabajador.vivo() and trabajador.interprete == interprete:
+                return trabajador
+            _TRABAJADORES_TOTAL -= 1
+            trabajador.cerrar()
+        if _TRABAJADORES_TOTAL >= TRABAJADORES_MAX:
+            return None
+        _TRABAJADORES_TOTAL += 1
+    try:
+        return _Trabajador(interprete)
+    except OSError:
+        with _TRABAJADORES_LOCK:
+            _TRABAJADORES_TOTAL -= 1
+        return None
+
+
+def _devolver_trabajador(trabajador, roto=False):
+    global _TRABAJADORES_TOTAL
+    if roto or not trabajador.vivo():
+        with _TRABAJADORES_LOCK:
+            _TRABAJADORES_TOTAL -= 1
+        trabajador.cerrar()
+        return
+    with _TRABAJADORES_LOCK:
+        _TRABAJADORES_LIBRES.append(trabajador)
+
+
+@atexit.register
+def _cerrar_trabajadores():
+    with _TRABAJADORES_LOCK:
+        libres = list(_TRABAJADORES_LIBRES)
+        _TRABAJADORES_LIBRES.clear()
+    for trabajador in libres:
+        trabajador.cerrar()
+
+
 # -------------------------------------------------------------------------
 # EJECUCIÓN AISLADA EN SUBPROCESO
 # -------------------------------------------------------------------------
+#
+# Cada ejecución anota en res["tiempos"] (segundos) lo que dura cada fase:
+#   preparar -> lanzar -> ejecutar -> recoger -> limpiar  (y comparar,
+# que añade _evaluar_test). "cpu" no es una fase: es el tiempo de CPU
+# del subproceso. Lo usan las herramientas de medición y, si
+# está activa, la traza de la corrección.
+
+
+@functools.lru_cache(maxsize=4)
+def _alumno_bytes(fuente: str) -> bytes:
+    """alumno.py preprocesado y codificado (igual para todos los tests)."""
+    return _codificar_fichero(_preprocesar_fuente(fuente))
+
+
+def _preparar_sandbox(td: str, fuente: str, files_ini: dict):
+    """Escribe alumno.py y los ficheros iniciales del test en td."""
+    alumno_py = os.path.join(td, "alumno.py")
+    with open(alumno_py, "wb") as f:
+        f.write(_alumno_bytes(fuente))
+
+    for fn, datos in _bytes_ficheros(files_ini):
+        fn_path = os.path.join(td, fn)
+        os.makedirs(os.path.dirname(fn_path) or td, exist_ok=True)
+        with open(fn_path, "wb") as f:
+            f.write(datos)
+    return alumno_py
+
+
+def _ejecutar_aislado(cmd, td: str, stdin_content: str, tiempos: dict,
+                      env=None, timeout=TIMEOUT_TEST):
+    """
+    Lanza cmd en td con la entrada indicada y espera a que termine.
+    Lanza subprocess.TimeoutExpired (tras matar el proceso) si excede
+    timeout (TIMEOUT_TEST, o TIMEOUT_PASOS con presupuesto de pasos).
+    Si hay un trabajador caliente disponible, el caso se ejecuta en él.
+    """
+    # En una corrección anticipada: baja prioridad y cancelable
+    trabajo = getattr(_CONTEXTO, "trabajo", None)
+    opciones = {}
+    if trabajo is not None:
+        if trabajo.cancelado.is_set():
+            raise _Cancelado()
+        opciones = _opciones_baja_prioridad()
+
+    trabajador = _tomar_trabajador(cmd[0])
+    if trabajador is not None:
+        roto = True
+        try:
+            completed = trabajador.ejecutar(
+                cmd, td, stdin_content, tiempos, env, timeout, trabajo
+            )
+            roto = False
+            return completed
+        except subprocess.TimeoutExpired:
+            roto = False
+            raise
+        except _TrabajadorRoto:
+            pass
+        finally:
+            _devolver_trabajador(trabajador, roto)
+
+    with _fase(tiempos, "lanzar"):
+        proc = subprocess.Popen(
+            cmd,
+            cwd=td,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            **opciones,
+        )
+    if trabajo is not None:
+        _bajar_prioridad(proc.pid)
+        trabajo.proceso = proc
+        if trabajo.cancelado.is_set():
+            proc.kill()
+    with _fase(tiempos, "ejecutar") as f:
+        cpu0 = os.times()
+        try:
+            stdout, stderr = proc.communicate(
+                stdin_content.encode("utf-8"), timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            f.args["timeout"] = True
+            raise
+        finally:
+            # CPU de los hijos terminados mientras tanto (aproximado si hay
+            # varias correcciones en paralelo; 0 en Windows)
+            cpu1 = os.times()
+            tiempos["cpu"] = (cpu1.children_user - cpu0.children_user
+                              + cpu1.children_system - cpu0.children_system)
+        f.args["returncode"] = proc.returncode
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def _leer_ficheros_finales(td: str) -> dict:
+    """Ficheros finales (solo nivel raíz, excepto alumno.py)."""
+    files_now = {}
+    for name in os.listdir(td):
+        p = os.path.join(td, name)
+        if os.path.isdir(p):
+            continue
+        if name == "alumno.py":
+            continue
+        with open(p, "r", encoding="utf-8", errors="replace") as f:
+            files_now[name] = f.read()
+    return files_now
+
+
+def _detalle_tiempo(e: subprocess.TimeoutExpired, fuente: str) -> str:
+    detalle = "Tiempo excedido (posible bucle infinito)."
+    informe = _informe_perfil(getattr(e, "perfil", None), fuente)
+    return detalle + "\n\n" + informe if informe else detalle
 
 
 def _run_test_programa(fuente: str, test: dict) -> dict:
@@ -360,7 +1899,9 @@ def _run_test_programa(fuente: str, test: dict) -> dict:
             "stdout": str,
             "files_end": dict,
             "error_tipo": None | "tiempo" | "ejecucion" | "interno",
-            "error_detalle": str
+            "error_detalle": str,
+            "tiempos": dict,
+            "pasos": int (solo con presupuesto de pasos)
         }
     """
     res = {
@@ -368,64 +1909,55 @@ def _run_test_programa(fuente: str, test: dict) -> dict:
         "files_end": {},
         "error_tipo": None,
         "error_detalle": "",
+        "tiempos": {},
     }
+    tiempos = res["tiempos"]
 
     stdin_content = test.get("stdin", "")
     files_ini = test.get("filesIni") or {}
+    pasos = _presupuesto_test(test)
 
     try:
-        with tempfile.TemporaryDirectory(prefix="corr_") as td:
-            # Escribir fuente del alumno
-            alumno_py = os.path.join(td, "alumno.py")
-            src_mod = _preprocesar_fuente(fuente)
-            with open(alumno_py, "w", encoding="utf-8") as f:
-                f.write(src_mod)
-
-            # Ficheros iniciales
-            for fn, content in files_ini.items():
-                fn_path = os.path.join(td, fn)
-                os.makedirs(os.path.dirname(fn_path) or td, exist_ok=True)
-                with open(fn_path, "w", encoding="utf-8") as f:
-                    f.write(content)
-
-            # Ejecutar
-            completed = subprocess.run(
-                [sys.executable, alumno_py],
-                cwd=td,
-                input=stdin_content.encode("utf-8"),
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=5,
-            )
-
-            stdout = _decode_bytes(completed.stdout)
-            stderr = _decode_bytes(completed.stderr)
-
-            res["stdout"] = stdout
-
-            # Ficheros finales (solo nivel raíz, excepto alumno.py)
-            files_now = {}
-            for name in os.listdir(td):
-                p = os.path.join(td, name)
-                if os.path.isdir(p):
-                    continue
-                if name == "alumno.py":
-                    continue
-                with open(p, "r", encoding="utf-8", errors="replace") as f:
-                    files_now[name] = f.read()
-
-            res["files_end"] = files_now
-
-            if completed.returncode != 0:
+        with _fase(tiempos, "preparar"):
+            sandbox = tempfile.TemporaryDirectory(prefix="corr_")
+            td = sandbox.name
+            alumno_py = _preparar_sandbox(td, fuente, files_ini)
+        try:
+            timeout = TIMEOUT_PASOS if pasos else TIMEOUT_TEST
+            with _canales_arranque(pasos, timeout) as (env, leer_pasos, leer_perfil):
+                try:
+                    completed = _ejecutar_aislado(
+                        [_interprete(), alumno_py], td, stdin_content, tiempos,
+                        env=env, timeout=timeout,
+                    )
+                except subprocess.TimeoutExpired as e:
+                    e.perfil = leer_perfil()
+                    raise
+                recuento = leer_pasos()
+
+            with _fase(tiempos, "recoger"):
+                stdout = _decode_bytes(completed.stdout)
+                stderr = _decode_bytes(completed.stderr)
+
+                res["stdout"] = stdout
+                res["files_end"] = _leer_ficheros_finales(td)
+
+            if _anotar_pasos(res, recuento):
+                # Detenido por el presupuesto: no es un error de ejecución
+                pass
+            elif completed.returncode != 0:
                 res["error_tipo"] = "ejecucion"
                 res["error_detalle"] = (
                     stderr
                     or f"El intérprete terminó con código de salida {completed.returncode}."
                 )
+        finally:
+            with _fase(tiempos, "limpiar"):
+                sandbox.cleanup()
 
-    except subprocess.TimeoutExpired:
+    except subprocess.TimeoutExpired as e:
         res["error_tipo"] = "tiempo"
-        res["error_detalle"] = "Tiempo excedido (posible bucle infinito)."
+        res["error_detalle"] = _detalle_tiempo(e, fuente)
     except Exception as e:
         res["error_tipo"] = "interno"
         res["error_detalle"] = (
@@ -444,22 +1976,29 @@ def _run_test_funcion(fuente: str, test: dict) -> dict:
             "stdout": str,
             "files_end": dict,
             "ret": Any,
+            "excepcion": None | {"tipo", "mensaje", "traceback"},
             "error_tipo": None | "tiempo" | "ejecucion" | "interno",
-            "error_detalle": str
+            "error_detalle": str,
+            "tiempos": dict,
+            "pasos": int (solo con presupuesto de pasos)
         }
     """
     res = {
         "stdout": "",
         "files_end": {},
         "ret": None,
+        "excepcion": None,
         "error_tipo": None,
         "error_detalle": "",
+        "tiempos": {},
     }
+    tiempos = res["tiempos"]
 
     nombre_funcion = test.get("funcName")
     args = test.get("args", [])
     stdin_content = test.get("stdin", "")
     files_ini = test.get("filesIni") or {}
+    pasos = _presupuesto_test(test)
 
     if not nombre_funcion:
         res["error_tipo"] = "interno"
@@ -467,53 +2006,46 @@ def _run_test_funcion(fuente: str, test: dict) -> dict:
         return res
 
     try:
-        with tempfile.TemporaryDirectory(prefix="corr_") as td:
-            # Escribir fuente del alumno
-            alumno_py = os.path.join(td, "alumno.py")
-            src_mod = _preprocesar_fuente(fuente)
-            with open(alumno_py, "w", encoding="utf-8") as f:
-                f.write(src_mod)
-
-            # Ficheros iniciales
-            for fn, content in files_ini.items():
-                fn_path = os.path.join(td, fn)
-                os.makedirs(os.path.dirname(fn_path) or td, exist_ok=True)
-                with open(fn_path, "w", encoding="utf-8") as f:
-                    f.write(content)
-
-            # Script envoltorio que importa alumno y llama a la función
+        with _fase(tiempos, "preparar"):
+            sandbox = tempfile.TemporaryDirectory(prefix="corr_")
+            td = sandbox.name
+            _preparar_sandbox(td, fuente, files_ini)
+        try:
+            # Envoltorio que importa alumno, llama a la función y deja el
+            # resultado en el canal (fuera del directorio del test)
             args_json = json.dumps(args, ensure_ascii=False)
-            wrapper_code = (
-                "import json, alumno, sys\n"
-                "args = json.loads(sys.argv[1])\n"
-                f"ret = getattr(alumno, {nombre_funcion!r})(*args)\n"
-                "print('__RET__=' + json.dumps(ret, ensure_ascii=False))\n"
-            )
+            fd, canal = tempfile.mkstemp(prefix="corr_ret_", suffix=".json")
+            os.close(fd)
+            try:
+                timeout = TIMEOUT_PASOS if pasos else TIMEOUT_TEST
+                with _canales_arranque(pasos, timeout) as (env, leer_pasos, leer_perfil):
+                    try:
+                        completed = _ejecutar_aislado(
+                            [_interprete(), "-c", _ENVOLTORIO_FUNCION,
+                             nombre_funcion, args_json, canal],
+                            td, stdin_content, tiempos,
+                            env=env, timeout=timeout,
+                        )
+                    except subprocess.TimeoutExpired as e:
+                        e.perfil = leer_perfil()
+                        raise
+                    recuento = leer_pasos()
+                resultado = _leer_canal(canal)
+            finally:
+                os.remove(canal)
 
-            completed = subprocess.run(
-                [sys.executable, "-c", wrapper_code, args_json],
-                cwd=td,
-                input=stdin_content.encode("utf-8"),
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=5,
-            )
+            with _fase(tiempos, "recoger"):
+                res["stdout"] = _decode_bytes(completed.stdout)
+                stderr = _decode_bytes(completed.stderr)
 
-            stdout_total = _decode_bytes(completed.stdout)
-            stderr = _decode_bytes(completed.stderr)
+                res["files_end"] = _leer_ficheros_finales(td)
 
-            # Ficheros finales (solo nivel raíz, excepto alumno.py)
-            files_now = {}
-            for name in os.listdir(td):
-                p = os.path.join(td, name)
-                if os.path.isdir(p):
-                    continue
-                if name == "alumno.py":
-                    continue
-                with open(p, "r", encoding="utf-8", errors="replace") as f:
-                    files_now[name] = f.read()
+            if resultado is not None:
+                tiempos["funcion"] = resultado.get("t", 0.0)
+                res["excepcion"] = resultado.get("exc")
 
-            res["files_end"] = files_now
+            if _anotar_pasos(res, recuento):
+                return res
 
             if completed.returncode != 0:
                 res["error_tipo"] = "ejecucion"
@@ -521,46 +2053,24 @@ def _run_test_funcion(fuente: str, test: dict) -> dict:
                     stderr
                     or f"El intérprete terminó con código de salida {completed.returncode}."
                 )
-                res["stdout"] = stdout_total
                 return res
 
-            # Extraer la línea __RET__=... del stdout y decodificar el JSON
-            sentinel = "__RET__="
-            lineas = stdout_total.splitlines(keepends=True)
-            idx_sentinel = None
-            for i in range(len(lineas) - 1, -1, -1):
-                if lineas[i].startswith(sentinel):
-                    idx_sentinel = i
-                    break
-
-            if idx_sentinel is None:
+            if resultado is None or not resultado.get("ok"):
                 res["error_tipo"] = "ejecucion"
                 res["error_detalle"] = (
                     "No se pudo obtener el valor devuelto de la función "
-                    "(no se encontró la marca __RET__ en la salida)."
+                    "(el programa terminó antes de que la función retornase)."
                 )
-                res["stdout"] = stdout_total
                 return res
 
-            linea_ret = lineas.pop(idx_sentinel)
-            ret_json = linea_ret[len(sentinel) :].strip()
+            res["ret"] = _decodificar_valor(resultado.get("ret"))
+        finally:
+            with _fase(tiempos, "limpiar"):
+                sandbox.cleanup()
 
-            try:
-                ret_val = json.loads(ret_json)
-            except Exception as e:
-                res["error_tipo"] = "ejecucion"
-                res["error_detalle"] = (
-                    f"No se pudo decodificar el valor retornado de la función:\n{e}"
-                )
-                res["stdout"] = "".join(lineas)
-                return res
-
-            res["ret"] = ret_val
-            res["stdout"] = "".join(lineas)
-
-    except subprocess.TimeoutExpired:
+    except subprocess.TimeoutExpired as e:
         res["error_tipo"] = "tiempo"
-        res["error_detalle"] = "Tiempo excedido (posible bucle infinito)."
+        res["error_detalle"] = _detalle_tiempo(e, fuente)
     except Exception as e:
         res["error_tipo"] = "interno"
         res["error_detalle"] = (
@@ -570,6 +2080,550 @@ def _run_test_funcion(fuente: str, test: dict) -> dict:
     return res
 
 
+# -------------------------------------------------------------------------
+# COMPROBACIÓN DE RESULTADOS
+# -------------------------------------------------------------------------
+
+
+def _tipo_ejercicio(ejercicio: str):
+    """'programa' (pXXX), 'funcion' (fXXX) o None si el prefijo no es válido."""
+    ej_lower = (ejercicio or "").lower()
+    if ej_lower.startswith("p"):
+        return "programa"
+    if ej_lower.startswith("f"):
+        return "funcion"
+    return None
+
+
+def _comprobar_programa(test: dict, res: dict) -> list:
+    """
+    Chequeos en el orden solicitado:
+        tiempo -> ejecución -> ficheros -> pantalla
+    """
+    errores = []
+    if res["error_tipo"] == "tiempo":
+        errores.append(res["error_detalle"])
+    elif res["error_tipo"] == "ejecucion":
+        errores.append("Error de ejecución del programa.")
+        if res["error_detalle"]:
+            errores.append(res["error_detalle"])
+    elif res["error_tipo"] == "interno":
+        errores.append("Error interno en el sistema de corrección.")
+        if res["error_detalle"]:
+            errores.append(res["error_detalle"])
+    else:
+        # Comparación de ficheros
+        exp_files = test.get("filesEnd_ok") or {}
+        with _fase(None, "_comparar_ficheros"):
+            ok_files, dif_files = _comparar_ficheros(
+                res.get("files_end", {}), exp_files
+            )
+        if not ok_files:
+            errores.append("Error al comparar ficheros finales.")
+            errores.extend(dif_files)
+        else:
+            # Comparación de salida por pantalla
+            exp_stdout = test.get("stdout_ok", "")
+            with _fase(None, "_comparar_resultados_pantalla"):
+                ok_out, dif_out = _comparar_resultados_pantalla(
+                    res.get("stdout", ""), exp_stdout
+                )
+            if not ok_out:
+                errores.append("Error al comparar la salida por pantalla.")
+                errores.extend(dif_out)
+    return errores
+
+
+def _comprobar_funcion(test: dict, res: dict) -> list:
+    """
+    Chequeos en el orden solicitado:
+        tiempo -> ejecución -> retorno -> pantalla -> ficheros
+    """
+    errores = []
+    ret_obt = res.get("ret", None)
+    if res["error_tipo"] == "tiempo":
+        errores.append(res["error_detalle"])
+    elif res["error_tipo"] == "ejecucion":
+        errores.append("Error de ejecución de la función.")
+        if res["error_detalle"]:
+            errores.append(res["error_detalle"])
+    elif res["error_tipo"] == "interno":
+        errores.append("Error interno en el sistema de corrección.")
+        if res["error_detalle"]:
+            errores.append(res["error_detalle"])
+    else:
+        # Retorno
+        exp_ret = test.get("return_ok")
+        if _como_json(ret_obt) != exp_ret:
+            errores.append("Error al comparar el retorno de la función.")
+            errores.append(f"Obtenido: {ret_obt!r}")
+            errores.append(f"Correcto: {exp_ret!r}")
+        else:
+            # Pantalla
+            exp_stdout = test.get("stdout_ok", "")
+            with _fase(None, "_comparar_resultados_pantalla"):
+                ok_out, dif_out = _comparar_resultados_pantalla(
+                    res.get("stdout", ""), exp_stdout
+                )
+            if not ok_out:
+                errores.append("Error al comparar la salida por pantalla.")
+                errores.extend(dif_out)
+            else:
+                # Ficheros
+                exp_files = test.get("filesEnd_ok") or {}
+                with _fase(None, "_comparar_ficheros"):
+                    ok_files, dif_files = _comparar_ficheros(
+                        res.get("files_end", {}), exp_files
+                    )
+                if not ok_files:
+                    errores.append("Error al comparar los ficheros finales.")
+                    errores.extend(dif_files)
+    return errores
+
+
+def _evaluar_test(tipo: str, fuente: str, test: dict):
+    """
+    Ejecuta un test en el entorno aislado y compara el resultado.
+    Devuelve (res, errores); errores vacío si el test se supera.
+    """
+    if test.get("complejidad"):
+        return _evaluar_complejidad(tipo, fuente, test)
+    if test.get("error_generador"):
+        res = {"stdout": "", "files_end": {}, "error_tipo": "interno",
+               "error_detalle": test["error_generador"], "tiempos": {}}
+        return res, _comprobar(tipo, test, res)
+    if tipo == "programa":
+        res = _run_test_programa(fuente, test)
+    else:
+        res = _run_test_funcion(fuente, test)
+    with _fase(res.setdefault("tiempos", {}), "comparar"):
+        errores = _comprobar(tipo, test, res)
+    return res, errores
+
+
+def _comprobar(tipo: str, test: dict, res: dict) -> list:
+    if tipo == "programa":
+        return _comprobar_programa(test, res)
+    return _comprobar_funcion(test, res)
+
+
+# -------------------------------------------------------------------------
+# TESTS DE COMPLEJIDAD
+# -------------------------------------------------------------------------
+#
+# Un caso con "complejidad" no compara resultados: ejecuta la función (o
+# el programa) con entradas de tamaño creciente y comprueba que el coste
+# no crece más deprisa que la cota declarada. Por ejemplo:
+#
+#   {"funcName": "f010",
+#    "complejidad": {"cota": "n",
+#                    "tamanos": [250, 500, 1000, 2000, 4000],
+#                    "args": [{"gen": "lista", "max": 1000}],
+#                    "semilla": 7}}
+#
+# Cada elemento de "args" (y "stdin", en programas) es un valor literal o
+# un generador: {"gen": "n"} (el tamaño), {"gen": "lista"} (n enteros
+# aleatorios entre "min" y "max"), {"gen": "lista_ordenada"} o
+# {"gen": "cadena"} (n caracteres de "alfabeto"). Las entradas se generan
+# con una semilla fija, así que son las mismas en cada corrección.
+#
+# Por defecto el coste se mide en pasos (líneas ejecutadas, el mismo
+# recuento del presupuesto de pasos), que no depende de la carga del
+# equipo, pero solo ve el código del alumno (sorted, in o list.index
+# cuentan como un paso); con "medida": "tiempo" se usa el mínimo de
+# "repeticiones" ejecuciones. La curva de crecimiento es la clase de CLASES_COMPLEJIDAD
+# que mejor ajusta coste = a + b·f(n) por mínimos cuadrados.
+
+CLASES_COMPLEJIDAD = (
+    ("1", lambda n: 1.0),
+    ("log n", lambda n: math.log2(n)),
+    ("n", lambda n: float(n)),
+    ("n log n", lambda n: n * math.log2(n)),
+    ("n²", lambda n: float(n) ** 2),
+    ("n³", lambda n: float(n) ** 3),
+)
+
+# Cota de pasos de cada ejecución de un test de complejidad
+PASOS_COMPLEJIDAD = 50_000_000
+
+_NOMBRES_COMPLEJIDAD = {
+    "1": "1", "logn": "log n", "n": "n", "nlogn": "n log n",
+    "n2": "n²", "n^2": "n²", "n**2": "n²", "n²": "n²",
+    "n3": "n³", "n^3": "n³", "n**3": "n³", "n³": "n³",
+}
+
+
+def _clase_complejidad(cota: str):
+    """Nombre normalizado de la cota ("O(n^2)" -> "n²"), o None si no se reconoce."""
+    texto = (cota or "").replace(" ", "").replace("·", "").lower()
+    if texto.startswith("o(") and texto.endswith(")"):
+        texto = texto[2:-1]
+    return _NOMBRES_COMPLEJIDAD.get(texto)
+
+
+def _generar_valor(spec, n, rnd: random.Random):
+    """
+    Valor de una entrada para el tamaño n (literal o generador). Con n
+    None (casos generados) el tamaño es el "n" del propio generador.
+    """
+    if not isinstance(spec, dict) or "gen" not in spec:
+        return spec
+    gen = spec["gen"]
+    n = spec.get("n", 10) if n is None else n
+    if gen == "n":
+        return n
+    if gen == "entero":
+        return rnd.randint(spec.get("min", 0), spec.get("max", 1000))
+    if gen == "elegir":
+        return rnd.choice(spec["opciones"])
+    if gen in ("lista", "lista_ordenada"):
+        lo, hi = spec.get("min", 0), spec.get("max", 1000)
+        valores = [rnd.randint(lo, hi) for _ in range(n)]
+        return sorted(valores) if gen == "lista_ordenada" else valores
+    if gen == "cadena":
+        alfabeto = spec.get("alfabeto", "abcdefghijklmnopqrstuvwxyz")
+        return "".join(rnd.choice(alfabeto) for _ in range(n))
+    raise ValueError(f"Generador desconocido: {gen!r}")
+
+
+def _caso_complejidad(test: dict, n: int) -> dict:
+    """Caso normal (como los de tests.json) para el tamaño n."""
+    spec = test["complejidad"]
+    rnd = random.Random(f"{spec.get('semilla', 0)}:{n}")
+    caso = {
+        "funcName": test.get("funcName"),
+        "args": [_generar_valor(a, n, rnd) for a in spec.get("args", [])],
+        "filesIni": test.get("filesIni") or {},
+    }
+    stdin = _generar_valor(spec.get("stdin", test.get("stdin", "")), n, rnd)
+    if isinstance(stdin, list):
+        stdin = "".join(f"{x}\n" for x in stdin)
+    caso["stdin"] = str(stdin)
+    if spec.get("medida", "pasos") == "pasos":
+        caso["pasos"] = spec.get("pasos", PASOS_COMPLEJIDAD)
+    return caso
+
+
+def _ajustar_complejidad(medidas):
+    """
+    Clase de CLASES_COMPLEJIDAD que mejor explica [(n, coste)]. A igualdad
+    de ajuste (error relativo dentro de un 5 %) se elige la más baja.
+    """
+    ys = [c for _n, c in medidas]
+    total = sum(y * y for y in ys) or 1.0
+    errores = []
+    for nombre, f in CLASES_COMPLEJIDAD:
+        xs = [f(n) for n, _c in medidas]
+        mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+        sxx = sum((x - mx) ** 2 for x in xs)
+        b = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx if sxx else 0.0
+        b = max(b, 0.0)
+        a = my - b * mx
+        residuo = sum((y - a - b * x) ** 2 for x, y in zip(xs, ys))
+        errores.append((nombre, residuo / total))
+    mejor = min(e for _n, e in errores)
+    for nombre, error in errores:
+        if error <= mejor * 1.05 + 1e-12:
+            return nombre
+    return errores[-1][0]
+
+
+def _evaluar_complejidad(tipo: str, fuente: str, test: dict):
+    """Como _evaluar_test, para un caso con "complejidad"."""
+    spec = test["complejidad"]
+    runner = _run_test_programa if tipo == "programa" else _run_test_funcion
+    medida = spec.get("medida", "pasos")
+    cota = _clase_complejidad(spec.get("cota"))
+    res = {"stdout": "", "files_end": {}, "error_tipo": None,
+           "error_detalle": "", "tiempos": {}, "medidas": []}
+
+    if cota is None:
+        res["error_tipo"] = "interno"
+        res["error_detalle"] = f"Cota de complejidad no reconocida: {spec.get('cota')!r}"
+        return res, _comprobar_complejidad(test, res)
+
+    for n in spec.get("tamanos", [64, 128, 256, 512, 1024]):
+        caso = _caso_complejidad(test, n)
+        repeticiones = 1 if medida == "pasos" else spec.get("repeticiones", 3)
+        costes = []
+        for _ in range(repeticiones):
+            r = runner(fuente, caso)
+            for fase, t in r.get("tiempos", {}).items():
+                res["tiempos"][fase] = res["tiempos"].get(fase, 0.0) + t
+            if r.get("error_tipo"):
+                for campo in ("stdout", "files_end", "error_tipo", "error_detalle"):
+                    res[campo] = r.get(campo)
+                res["tamano_fallo"] = n
+                return res, _comprobar_complejidad(test, res)
+            if medida == "pasos":
+                costes.append(r.get("pasos", 0))
+            else:
+                costes.append(r["tiempos"].get("funcion", r["tiempos"].get("ejecutar", 0.0)))
+        res["medidas"].append((n, min(costes)))
+
+    res["observada"] = _ajustar_complejidad(res["medidas"])
+    return res, _comprobar_complejidad(test, res)
+
+
+def _comprobar_complejidad(test: dict, res: dict) -> list:
+    errores = []
+    cota = _clase_complejidad(test["complejidad"].get("cota"))
+    if res["error_tipo"] == "interno":
+        errores.append("Error interno en el sistema de corrección.")
+        if res["error_detalle"]:
+            errores.append(res["error_detalle"])
+    elif res["error_tipo"]:
+        errores.append(f"Error con una entrada de tamaño n = {res.get('tamano_fallo')}.")
+        if res["error_detalle"]:
+            errores.append(res["error_detalle"])
+    else:
+        orden = [nombre for nombre, _f in CLASES_COMPLEJIDAD]
+        observada = res["observada"]
+        if orden.index(observada) > orden.index(cota):
+            errores.append(
+                f"Complejidad excesiva: se esperaba O({cota}) "
+                f"y se observa ~O({observada})."
+            )
+    return errores
+
+
+# -------------------------------------------------------------------------
+# CASOS GENERADOS
+# -------------------------------------------------------------------------
+#
+# Además de casos literales, una lista de tests.json puede contener
+# especificaciones {"generador": {...}} que se expanden en casos normales
+# (los mismos dicts que consumen _run_test_programa y _run_test_funcion).
+# Los 32 casos de f000, por ejemplo, caben en:
+#
+#   {"generador": {
+#      "rejilla": {"fin": ["nombre.txt", "apellido.txt"],
+#                  "fout": ["salida1.txt", "salida2.txt"],
+#                  "stdin": ["1\n2\n", "-1\n-2\n"],
+#                  "nombre": ["Alejandro", "Pepe"],
+#                  "apellido": ["Martinez", "Lopez"]},
+#      "caso": {"funcName": "f000", "args": ["{fin}", "{fout}"],
+#               "stdin": "{stdin}",
+#               "filesIni": {"nombre.txt": "{nombre}", "apellido.txt": "{apellido}"}},
+#      "referencia": "def f000(fin, fout):\n    ..."}}
+#
+# - "rejilla": producto cartesiano de los valores de cada parámetro (el
+#   último varía más deprisa).
+# - "aleatorios": parámetros generados con _generar_valor ({"gen":
+#   "entero", "min", "max"}, {"gen": "elegir", "opciones"}, "lista",
+#   "cadena"... con "n" elementos), con "semilla" fija: "casos" sorteos
+#   por cada punto de la rejilla.
+# - "caso": plantilla del caso. En sus cadenas (y nombres de fichero)
+#   {parametro} se sustituye por su valor, e {i} por el número de caso
+#   dentro del generador; una cadena que es solo "{parametro}" toma el
+#   valor tal cual (p. ej. un entero en "args"). Las llaves literales se
+#   escriben {{ y }}. En las funciones la plantilla lleva "funcName".
+# - Resultados esperados: "esperados" (lista en el orden de expansión,
+#   con return_ok / stdout_ok / filesEnd_ok) o "referencia", una solución
+#   que se ejecuta en el mismo entorno aislado la primera vez que se
+#   necesita un caso; el resultado se guarda en ESPERADOS_DIR indexado por
+#   el hash de (referencia, caso), así que cada caso se calcula una vez
+#   por equipo.
+# - "rapido": true marca todos los casos del generador como nivel rápido.
+#
+# La expansión es perezosa: cada caso (y su resultado esperado) se
+# construye solo cuando le toca ejecutarse, y los que siguen al primer
+# fallo no llegan a generarse.
+
+ESPERADOS_DIR = os.path.join(DATOS_DIR, "esperados")
+
+# hash de (referencia, caso) -> campos *_ok
+_ESPERADOS_CACHE = {}
+_ESPERADOS_LOCK = threading.Lock()
+
+
+def _num_casos(entrada: dict) -> int:
+    """Número de casos en que se expande una entrada de la lista."""
+    spec = entrada.get("generador")
+    if spec is None:
+        return 1
+    total = spec.get("casos", 1)
+    for valores in spec.get("rejilla", {}).values():
+        total *= len(valores)
+    return total
+
+
+def _total_casos(lista_tests) -> int:
+    return sum(_num_casos(t) for t in lista_tests)
+
+
+_PLANTILLA_SOLO = re.compile(r"\{(\w+)\}")
+
+
+def _rellenar(plantilla, valores: dict):
+    if isinstance(plantilla, str):
+        solo = _PLANTILLA_SOLO.fullmatch(plantilla)
+        if solo and solo.group(1) in valores:
+            return valores[solo.group(1)]
+        return plantilla.format_map(valores)
+    if isinstance(plantilla, list):
+        return [_rellenar(v, valores) for v in plantilla]
+    if isinstance(plantilla, dict):
+        return {str(_rellenar(k, valores)): _rellenar(v, valores)
+                for k, v in plantilla.items()}
+    return plantilla
+
+
+def _campos_plantilla(plantilla) -> set:
+    """Nombres usados como {campo} en la plantilla (ValueError si está mal formada)."""
+    if isinstance(plantilla, str):
+        return {re.match(r"\w*", campo).group()
+                for _lit, campo, _fmt, _conv in string.Formatter().parse(plantilla)
+                if campo is not None}
+    if isinstance(plantilla, list):
+        return set().union(*(_campos_plantilla(v) for v in plantilla))
+    if isinstance(plantilla, dict):
+        return set().union(*(_campos_plantilla(k) | _campos_plantilla(v)
+                             for k, v in plantilla.items()))
+    return set()
+
+
+def _validar_generador(spec: dict):
+    """Qué falla en la especificación de un generador, o None si nada."""
+    if not isinstance(spec.get("caso", {}), dict):
+        return "La plantilla del generador (\"caso\") debe ser un objeto."
+    definidos = set(spec.get("rejilla", {})) | set(spec.get("aleatorios", {})) | {"i"}
+    try:
+        usados = _campos_plantilla(spec.get("caso", {}))
+    except ValueError as e:
+        return f"La plantilla del generador no es válida: {e}."
+    desconocidos = sorted(usados - definidos)
+    if desconocidos:
+        return ("La plantilla del generador usa campos sin definir: "
+                + ", ".join(desconocidos) + ".")
+    esperados = spec.get("esperados")
+    if esperados is not None:
+        n = _num_casos({"generador": spec})
+        if not isinstance(esperados, list) or len(esperados) != n:
+            hay = len(esperados) if isinstance(esperados, list) else 0
+            return f"El generador tiene {n} casos y {hay} resultados esperados."
+        if not all(isinstance(e, dict) for e in esperados):
+            return "Cada resultado esperado del generador debe ser un objeto."
+    return None
+
+
+def _resultado_esperado(tipo: str, res: dict) -> dict:
+    """Campos *_ok de un caso a partir de la ejecución de la referencia."""
+    esperado = {}
+    if tipo == "funcion":
+        esperado["return_ok"] = _como_json(res.get("ret"))
+    esperado["stdout_ok"] = res.get("stdout", "")
+    esperado["filesEnd_ok"] = dict(sorted(res.get("files_end", {}).items()))
+    return esperado
+
+
+def _esperado_referencia(referencia: str, caso: dict) -> dict:
+    """
+    Campos *_ok del caso según la referencia (de la caché si ya se
+    calcularon), o {"error_generador": detalle} si la referencia falla.
+    """
+    clave = _hash_contenido(
+        json.dumps([referencia, caso], sort_keys=True, ensure_ascii=False)
+    )
+    with _ESPERADOS_LOCK:
+        esperado = _ESPERADOS_CACHE.get(clave)
+    if esperado is not None:
+        return esperado
+    ruta = os.path.join(ESPERADOS_DIR, clave + ".json")
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            esperado = json.load(f)
+    except (OSError, ValueError):
+        tipo = "funcion" if caso.get("funcName") else "programa"
+        runner = _run_test_funcion if tipo == "funcion" else _run_test_programa
+        res = runner(referencia, caso)
+        if res.get("error_tipo"):
+            # No se guarda: puede ser un fallo pasajero (p. ej. tiempo)
+            return {"error_generador": "La solución de referencia falla en este caso:\n"
+                                       + res.get("error_detalle", "")}
+        esperado = _resultado_esperado(tipo, res)
+        try:
+            os.makedirs(ESPERADOS_DIR, exist_ok=True)
+            temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(esperado, f, ensure_ascii=False)
+            os.replace(temporal, ruta)
+        except OSError:
+            pass
+    with _ESPERADOS_LOCK:
+        _ESPERADOS_CACHE[clave] = esperado
+    return esperado
+
+
+def _expandir_generador(spec: dict, con_esperados=True):
+    """
+    Genera uno a uno los casos de una especificación "generador" (con
+    con_esperados=False, solo las entradas). Si la especificación o un
+    caso no se pueden construir, el caso lleva "error_generador" (sin
+    esperados, ValueError).
+    """
+    if con_esperados:
+        error = _validar_generador(spec)
+    else:
+        # Los esperados que haya se van a sustituir: no se comprueban
+        error = _validar_generador({k: v for k, v in spec.items() if k != "esperados"})
+    rejilla = spec.get("rejilla", {})
+    aleatorios = spec.get("aleatorios", {})
+    esperados = spec.get("esperados")
+    referencia = spec.get("referencia")
+    plantilla = spec.get("caso", {})
+    semilla = spec.get("semilla", 0)
+    huella = _hash_contenido(json.dumps(spec, sort_keys=True, ensure_ascii=False))
+    i = 0
+    for punto in itertools.product(*rejilla.values()):
+        for _ in range(spec.get("casos", 1)):
+            i += 1
+            caso = {}
+            if error is None:
+                try:
+                    valores = dict(zip(rejilla, punto))
+                    rnd = random.Random(f"{semilla}:{i}")
+                    for nombre, gen in aleatorios.items():
+                        valores[nombre] = _generar_valor(gen, None, rnd)
+                    valores["i"] = i
+                    caso = _rellenar(plantilla, valores)
+                except (KeyError, IndexError, ValueError, TypeError) as e:
+                    caso = {"error_generador": f"El generador falla en el caso {i}: {e!r}"}
+            else:
+                caso["error_generador"] = error
+            if caso.get("filesIni"):
+                caso["filesIni"] = _internar_ficheros(caso["filesIni"])
+            if not con_esperados:
+                if "error_generador" in caso:
+                    raise ValueError(caso["error_generador"])
+                yield caso
+                continue
+            if "error_generador" in caso:
+                pass   # el motivo ya está en el caso
+            elif esperados is not None:
+                caso.update(esperados[i - 1])
+            elif referencia is not None:
+                caso.update(_esperado_referencia(referencia, caso))
+            else:
+                caso["error_generador"] = "El generador no tiene resultados esperados."
+            if caso.get("filesEnd_ok"):
+                caso["filesEnd_ok"] = _internar_ficheros(caso["filesEnd_ok"])
+            if spec.get("rapido"):
+                caso["rapido"] = True
+            # Identifica el caso aunque cada expansión cree un dict nuevo
+            caso["generado"] = f"{huella[:12]}:{i}"
+            yield caso
+
+
+def _casos(lista_tests):
+    """Todos los casos de la lista, con los generadores expandidos."""
+    for entrada in lista_tests:
+        if "generador" in entrada:
+            yield from _expandir_generador(entrada["generador"])
+        else:
+            yield entrada
+
+
 # -------------------------------------------------------------------------
 # FORMATEO DE MENSAJES DE ERROR
 # -------------------------------------------------------------------------
@@ -658,6 +2712,432 @@ def _mensaje_error_funcion(errores, test, stdout_obt, files_end_text, ret_obt):
     return "\n".join(partes)
 
 
+def _mensaje_error_complejidad(errores, test, res):
+    spec = test["complejidad"]
+    unidad = "pasos" if spec.get("medida", "pasos") == "pasos" else "segundos"
+
+    partes = []
+    partes.append("El ejercicio no supera el test de eficiencia")
+    partes.append("")
+
+    if errores:
+        partes.append("   ERRORES DETECTADOS:")
+        for err in errores:
+            partes.append(f"- {err}")
+        partes.append("")
+
+    if res.get("medidas"):
+        partes.append("   COSTE MEDIDO")
+        partes.append(f"{'n':>10}  {unidad:>14}")
+        for n, coste in res["medidas"]:
+            valor = f"{coste:.6f}" if unidad == "segundos" else str(coste)
+            partes.append(f"{n:>10}  {valor:>14}")
+    elif res.get("stdout"):
+        partes.append("   RESULTADO OBTENIDO")
+        partes.append("────────Pantalla─────────")
+        partes.append(res["stdout"])
+
+    return "\n".join(partes)
+
+
+def _mensaje_error(tipo: str, errores, test: dict, res: dict) -> str:
+    """Informe del test fallado, según el tipo de ejercicio."""
+    if test.get("complejidad"):
+        return _mensaje_error_complejidad(errores, test, res)
+    files_end_text = _formatear_dict_ficheros(res.get("files_end", {}))
+    if tipo == "programa":
+        return _mensaje_error_programa(
+            errores, test, res.get("stdout", ""), files_end_text
+        )
+    return _mensaje_error_funcion(
+        errores, test, res.get("stdout", ""), files_end_text, res.get("ret", None)
+    )
+
+
+def _orden_tests(lista_tests):
+    """
+    (idx, test) en el orden de ejecución: primero el nivel rápido (tests
+    con "rapido": true, elegidos por herramientas/minimizar_tests.py) y,
+    solo si se superan, el resto de la batería en su orden original. Los
+    tests de complejidad, que son los más caros, van al final.
+
+    Es un generador: los casos de los generadores (ver _casos) se
+    expanden al llegar a ellos, y idx es el número de caso en la batería
+    expandida.
+    """
+    def pasada(elegir):
+        idx = 1
+        for entrada in lista_tests:
+            if elegir(entrada.get("generador", entrada)):
+                if "generador" in entrada:
+                    yield from enumerate(_expandir_generador(entrada["generador"]), idx)
+                else:
+                    yield idx, entrada
+            idx += _num_casos(entrada)
+
+    yield from pasada(lambda t: t.get("rapido") and not t.get("complejidad"))
+    yield from pasada(lambda t: not t.get("rapido") and not t.get("complejidad"))
+    yield from pasada(lambda t: t.get("complejidad"))
+
+
+def _primer_fallo(tipo: str, ejercicio: str, fuente: str, lista_tests,
+                  clases=None):
+    """
+    Ejecuta los tests (ver _orden_tests) hasta el primero que falla.
+    Devuelve (idx, test, res, errores) de ese test, o None si se superan todos.
+    Con clases (_ClasesResultado) la comprobación se comparte entre envíos
+    que producen el mismo resultado.
+    """
+    evaluar = clases.evaluar if clases is not None else _evaluar_test
+    for idx, test in _orden_tests(lista_tests):
+        with _fase(None, f"test {idx}", ejercicio=ejercicio) as f:
+            t0 = time.perf_counter()
+            res, errores = evaluar(tipo, fuente, test)
+            _registrar_telemetria(
+                ejercicio, idx, res, errores, time.perf_counter() - t0
+            )
+            f.args["superado"] = not errores
+            f.args["error_tipo"] = res.get("error_tipo")
+            if "pasos" in res:
+                f.args["pasos"] = res["pasos"]
+        if errores:
+            return idx, test, res, errores
+    return None
+
+
+# -------------------------------------------------------------------------
+# CLASES DE RESULTADOS (corrección por lotes)
+# -------------------------------------------------------------------------
+#
+# Al corregir muchos envíos del mismo ejercicio, la mayoría producen en
+# cada caso exactamente la misma salida, ficheros y retorno. La
+# comprobación (_comparar_resultados_pantalla, _comparar_ficheros) y el
+# informe de error dependen solo de ese resultado, así que se calculan una
+# vez por clase (caso, hash del resultado) y se reutilizan. La ejecución
+# en el sandbox sí es siempre por envío.
+
+CLASES_MAX = 4096
+
+
+class _ClasesResultado:
+    def __init__(self, maximo=CLASES_MAX):
+        self.maximo = maximo
+        self.aciertos = 0
+        self.fallos = 0
+        self._errores = OrderedDict()   # (id test o "generado", hash res) -> errores
+        self._mensajes = OrderedDict()  # (id test o "generado", hash res) -> mensaje
+        self._tests = OrderedDict()     # id test -> test (mantiene el id válido)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def huella(res: dict) -> str:
+        ret = res.get("ret")
+        partes = [
+            res.get("error_tipo"), res.get("error_detalle"),
+            res.get("stdout"), sorted((res.get("files_end") or {}).items()),
+            type(ret).__name__, repr(ret), res.get("excepcion"),
+        ]
+        return _hash_contenido(json.dumps(partes, ensure_ascii=False, default=repr))
+
+    def _clave(self, test: dict, res: dict):
+        if test.get("generado"):
+            return test["generado"], self.huella(res)
+        with self._lock:
+            if id(test) in self._tests:
+                self._tests.move_to_end(id(test))
+            else:
+                self._tests[id(test)] = test
+                if len(self._tests) > self.maximo:
+                    # Al soltar el test su id puede reutilizarse: se olvidan
+                    # también sus clases
+                    viejo, _ = self._tests.popitem(last=False)
+                    for tabla in (self._errores, self._mensajes):
+                        for clave in [c for c in tabla if c[0] == viejo]:
+                            del tabla[clave]
+        return id(test), self.huella(res)
+
+    def _buscar(self, tabla, clave):
+        with self._lock:
+            valor = tabla.get(clave)
+            if valor is not None:
+                tabla.move_to_end(clave)
+            return valor
+
+    def _guardar(self, tabla, clave, valor):
+        with self._lock:
+            tabla[clave] = valor
+            if len(tabla) > self.maximo:
+                tabla.popitem(last=False)
+
+    def evaluar(self, tipo: str, fuente: str, test: dict):
+        """Como _evaluar_test, compartiendo la comprobación por clase."""
+        if test.get("complejidad") or test.get("error_generador"):
+            return _evaluar_test(tipo, fuente, test)
+        if tipo == "programa":
+            res = _run_test_programa(fuente, test)
+        else:
+            res = _run_test_funcion(fuente, test)
+        with _fase(res.setdefault("tiempos", {}), "comparar"):
+            clave = self._clave(test, res)
+            res["clase"] = clave
+            errores = self._buscar(self._errores, clave)
+            if errores is None:
+                self.fallos += 1
+                errores = _comprobar(tipo, test, res)
+                self._guardar(self._errores, clave, errores)
+            else:
+                self.aciertos += 1
+        return res, errores
+
+    def mensaje(self, tipo: str, errores, test: dict, res: dict) -> str:
+        """Como _mensaje_error, una vez por clase."""
+        clave = res.get("clase")
+        if clave is None:
+            return _mensaje_error(tipo, errores, test, res)
+        msg = self._buscar(self._mensajes, clave)
+        if msg is None:
+            msg = _mensaje_error(tipo, errores, test, res)
+            self._guardar(self._mensajes, clave, msg)
+        return msg
+
+
+# -------------------------------------------------------------------------
+# CORRECCIÓN EN SERVIDOR (opcional)
+# -------------------------------------------------------------------------
+#
+# Si FIUMH_SERVIDOR apunta a un servidor de corrección del laboratorio
+# (herramientas/servidor_correccion.py), se le envía el ejercicio. Si no
+# responde, está saturado o no conoce el ejercicio, se corrige en local.
+
+SERVIDOR_CORRECCION = os.environ.get("FIUMH_SERVIDOR", "")
+SERVIDOR_TIMEOUT = 60
+
+
+def _corregir_en_servidor(dni, ejercicio, fuente):
+    """Resultado del servidor ({"superado", "test", "mensaje"}) o None."""
+    if not SERVIDOR_CORRECCION:
+        return None
+    try:
+        cuerpo = json.dumps(
+            {"dni": dni, "ejercicio": ejercicio, "fuente": fuente},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        req = urllib.request.Request(
+            SERVIDOR_CORRECCION.rstrip("/") + "/corregir",
+            data=cuerpo, method="POST",
+        )
+        req.add_header("Content-Type", "application/json")
+        with _fase(None, "servidor"), \
+                urllib.request.urlopen(req, timeout=SERVIDOR_TIMEOUT) as resp:
+            resultado = json.loads(resp.read().decode("utf-8"))
+    except Exception:
+        return None
+    if "superado" not in resultado:
+        return None
+    return resultado
+
+
+# -------------------------------------------------------------------------
+# RESULTADOS Y CORRECCIÓN ANTICIPADA AL GUARDAR (opcional)
+# -------------------------------------------------------------------------
+#
+# El resultado de cada corrección local se guarda en memoria indexado por
+# (ejercicio, hash de la fuente, hash de sus tests): volver a pulsar
+# "Corregir" sin cambiar nada, o pulsarlo después de una corrección
+# anticipada, muestra el veredicto sin ejecutar nada. No se guardan los
+# fallos por tiempo real (dependen de la carga del equipo) ni los internos.
+#
+# Con FIUMH_ANTICIPADA=1, configuracion.py llama a corregir_anticipado()
+# cada vez que se guarda un fichero: si su cabecera indica un ejercicio
+# con tests, se corrige en un hilo aparte, de uno en uno y con los
+# subprocesos a baja prioridad. Un guardado nuevo cancela la corrección
+# anticipada en curso (y mata su subproceso), y también "Corregir" si
+# aquella no termina en ANTICIPADA_ESPERA segundos.
+
+RESULTADOS_MAX = 32
+ANTICIPADA_NICE = 10
+# Segundos que "Corregir" espera a una corrección anticipada de la misma
+# fuente (en el hilo de Tk); si no ha terminado, se cancela
+ANTICIPADA_ESPERA = 0.5
+
+_RESULTADOS = OrderedDict()   # clave -> mensaje (None = supera)
+_RESULTADOS_LOCK = threading.Lock()
+
+# Trabajo anticipado que corrige el hilo actual (lo mira _ejecutar_aislado)
+_CONTEXTO = threading.local()
+
+
+class _Cancelado(Exception):
+    pass
+
+
+def _opciones_baja_prioridad() -> dict:
+    if os.name == "nt":
+        return {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+    return {}
+
+
+def _bajar_prioridad(pid: int):
+    """
+    Baja la prioridad de un subproceso ya lanzado. No se usa preexec_fn:
+    Thonny tiene varios hilos y con ellos puede bloquear al hijo.
+    """
+    if not hasattr(os, "setpriority"):
+        return
+    try:
+        actual = os.getpriority(os.PRIO_PROCESS, 0)
+        os.setpriority(os.PRIO_PROCESS, pid, actual + ANTICIPADA_NICE)
+    except OSError:
+        pass
+
+
+def _clave_resultado(ejercicio, fuente, lista_tests):
+    tests_json = json.dumps(lista_tests, sort_keys=True, ensure_ascii=False)
+    return ejercicio, _hash_contenido(fuente), _hash_contenido(tests_json)
+
+
+def _resultado_guardado(clave):
+    """(True, mensaje) si hay resultado para clave; (False, None) si no."""
+    with _RESULTADOS_LOCK:
+        if clave not in _RESULTADOS:
+            return False, None
+        _RESULTADOS.move_to_end(clave)
+        return True, _RESULTADOS[clave]
+
+
+def _fallo_estable(fallo) -> bool:
+    """
+    Si el resultado de _primer_fallo se puede reutilizar: no lo es un fallo
+    interno ni uno por tiempo real (depende de la carga del equipo).
+    """
+    if fallo is None:
+        return True
+    res = fallo[2]
+    tipo_error = res.get("error_tipo")
+    return not (tipo_error == "interno" or (tipo_error == "tiempo" and "pasos" not in res))
+
+
+def _guardar_resultado(clave, fallo):
+    """Guarda el resultado de _primer_fallo si no depende de la carga."""
+    msg = None
+    if fallo is not None:
+        if not _fallo_estable(fallo):
+            return None
+        _idx, test, res, errores = fallo
+        msg = _mensaje_error(_tipo_ejercicio(clave[0]), errores, test, res)
+    with _RESULTADOS_LOCK:
+        _RESULTADOS[clave] = msg
+        while len(_RESULTADOS) > RESULTADOS_MAX:
+            _RESULTADOS.popitem(last=False)
+    return msg
+
+
+class _TrabajoAnticipado:
+    def __init__(self, dni, ejercicio, fuente):
+        self.dni = dni
+        self.ejercicio = ejercicio
+        self.fuente = fuente
+        self.cancelado = threading.Event()
+        self.terminado = threading.Event()
+        self.proceso = None
+
+    def cancelar(self):
+        self.cancelado.set()
+        proc = self.proceso
+        if proc is not None and proc.poll() is None:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+
+
+class _Anticipador:
+    """Un hilo que corrige el último fichero guardado; el resto se descarta."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._siguiente = None
+        self._actual = None
+        self._hilo = threading.Thread(
+            target=self._bucle, name="fiumh-anticipada", daemon=True
+        )
+        self._hilo.start()
+
+    def programar(self, trabajo: _TrabajoAnticipado):
+        with self._cond:
+            # El mismo guardado puede llegar dos veces (Save y SaveAs), o
+            # guardarse sin cambios: se deja el trabajo que ya hay
+            for t in (self._actual, self._siguiente):
+                if (t is not None and not t.cancelado.is_set()
+                        and t.ejercicio == trabajo.ejercicio and t.fuente == trabajo.fuente):
+                    return
+            if self._actual is not None:
+                self._actual.cancelar()
+            if self._siguiente is not None:
+                self._siguiente.terminado.set()
+            self._siguiente = trabajo
+            self._cond.notify()
+
+    def en_curso(self, ejercicio, fuente):
+        """Trabajo pendiente o en curso con esa misma fuente, si lo hay."""
+        with self._cond:
+            for t in (self._actual, self._siguiente):
+                if (t is not None and not t.cancelado.is_set()
+                        and t.ejercicio == ejercicio and t.fuente == fuente):
+                    return t
+        return None
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while self._siguiente is None:
+                    self._cond.wait()
+                trabajo, self._siguiente = self._siguiente, None
+                self._actual = trabajo
+            try:
+                self._corregir(trabajo)
+            except Exception:
+                pass
+            finally:
+                with self._cond:
+                    self._actual = None
+                trabajo.terminado.set()
+
+    def _corregir(self, trabajo):
+        tests = _descargar_tests(avisar=False)
+        lista_tests = (tests or {}).get(trabajo.ejercicio)
+        tipo = _tipo_ejercicio(trabajo.ejercicio)
+        if not lista_tests or tipo is None:
+            return
+        clave = _clave_resultado(trabajo.ejercicio, trabajo.fuente, lista_tests)
+        if _resultado_guardado(clave)[0]:
+            return
+        _CONTEXTO.trabajo = trabajo
+        try:
+            fallo = _primer_fallo(tipo, trabajo.ejercicio, trabajo.fuente, lista_tests)
+        finally:
+            _CONTEXTO.trabajo = None
+        if not trabajo.cancelado.is_set():
+            _guardar_resultado(clave, fallo)
+
+
+_ANTICIPADOR = None
+
+
+def corregir_anticipado(fuente: str):
+    """
+    Corrige fuente en segundo plano (llamada al guardar un fichero). No
+    muestra nada: el resultado queda guardado para el siguiente "Corregir".
+    """
+    global _ANTICIPADOR
+    dni, ejercicio = _extraer_dni_ejercicio(fuente or "")
+    if not ejercicio or _tipo_ejercicio(ejercicio) is None:
+        return
+    if _ANTICIPADOR is None:
+        _ANTICIPADOR = _Anticipador()
+    _ANTICIPADOR.programar(_TrabajoAnticipado(dni, ejercicio, fuente))
+
+
 # -------------------------------------------------------------------------
 # FUNCIÓN DE CORRECCIÓN UNIFICADA
 # -------------------------------------------------------------------------
@@ -682,153 +3162,41 @@ def corregir_ejercicio(dni, ejercicio, fuente, lista_tests):
         )
         return
 
-    ej_lower = ejercicio.lower()
-    if ej_lower.startswith("p"):
-        tipo = "programa"
-    elif ej_lower.startswith("f"):
-        tipo = "funcion"
-    else:
+    tipo = _tipo_ejercicio(ejercicio)
+    if tipo is None:
         messagebox.showerror(
             "Error",
             "El identificador de ejercicio debe empezar por 'p' o por 'f'.",
         )
         return
 
-    total = len(lista_tests)
-
-    for idx, test in enumerate(lista_tests, start=1):
-        errores = []
-
-        if tipo == "programa":
-            # -----------------------------------------------------
-            # 1) Ejecutar programa en entorno aislado
-            # -----------------------------------------------------
-            res = _run_test_programa(fuente, test)
-            stdout_obt = res.get("stdout", "")
-            files_end = res.get("files_end", {})
-
-            # -----------------------------------------------------
-            # 2) Chequeos en el orden solicitado:
-            #    tiempo -> ejecución -> ficheros -> pantalla
-            # -----------------------------------------------------
-            if res["error_tipo"] == "tiempo":
-                errores.append(res["error_detalle"])
-            elif res["error_tipo"] == "ejecucion":
-                errores.append("Error de ejecución del programa.")
-                if res["error_detalle"]:
-                    errores.append(res["error_detalle"])
-            elif res["error_tipo"] == "interno":
-                errores.append("Error interno en el sistema de corrección.")
-                if res["error_detalle"]:
-                    errores.append(res["error_detalle"])
-            else:
-                # Comparación de ficheros
-                exp_files = test.get("filesEnd_ok") or {}
-                ok_files, dif_files = _comparar_ficheros(files_end, exp_files)
-                if not ok_files:
-                    errores.append("Error al comparar ficheros finales.")
-                    errores.extend(dif_files)
-                else:
-                    # Comparación de salida por pantalla
-                    exp_stdout = test.get("stdout_ok", "")
-                    ok_out, dif_out = _comparar_resultados_pantalla(
-                        stdout_obt, exp_stdout
-                    )
-                    if not ok_out:
-                        errores.append("Error al comparar la salida por pantalla.")
-                        errores.extend(dif_out)
-
-            if errores:
-                files_end_text = _formatear_dict_ficheros(files_end)
-                msg = _mensaje_error_programa(
-                    errores, test, stdout_obt, files_end_text
-                )
-                _mostrar_error_scroll("Error en el test", msg)
-                '''
-                messagebox.showerror(
-                    "Resultado de la corrección",
-                    f"El ejercicio no supera el test {idx} de {total}.",
-                )
-                '''
-                return
-
-        else:  # tipo == "funcion"
-            # -----------------------------------------------------
-            # 1) Ejecutar función en entorno aislado
-            # -----------------------------------------------------
-            res = _run_test_funcion(fuente, test)
-            stdout_obt = res.get("stdout", "")
-            files_end = res.get("files_end", {})
-            ret_obt = res.get("ret", None)
-
-            # -----------------------------------------------------
-            # 2) Chequeos en el orden solicitado:
-            #    tiempo -> ejecución -> retorno -> pantalla -> ficheros
-            # -----------------------------------------------------
-            if res["error_tipo"] == "tiempo":
-                errores.append(res["error_detalle"])
-            elif res["error_tipo"] == "ejecucion":
-                errores.append("Error de ejecución de la función.")
-                if res["error_detalle"]:
-                    errores.append(res["error_detalle"])
-            elif res["error_tipo"] == "interno":
-                errores.append("Error interno en el sistema de corrección.")
-                if res["error_detalle"]:
-                    errores.append(res["error_detalle"])
-            else:
-                # Retorno
-                exp_ret = test.get("return_ok")
-                if ret_obt != exp_ret:
-                    errores.append(
-                        "Error al comparar el retorno de la función."
-                    )
-                    errores.append(f"Obtenido: {ret_obt!r}")
-                    errores.append(f"Correcto: {exp_ret!r}")
-                else:
-                    # Pantalla
-                    exp_stdout = test.get("stdout_ok", "")
-                    ok_out, dif_out = _comparar_resultados_pantalla(
-                        stdout_obt, exp_stdout
-                    )
-                    if not ok_out:
-                        errores.append(
-                            "Error al comparar la salida por pantalla."
-                        )
-                        errores.extend(dif_out)
-                    else:
-                        # Ficheros
-                        exp_files = test.get("filesEnd_ok") or {}
-                        ok_files, dif_files = _comparar_ficheros(
-                            files_end, exp_files
-                        )
-                        if not ok_files:
-                            errores.append(
-                                "Error al comparar los ficheros finales."
-                            )
-                            errores.extend(dif_files)
-
-            if errores:
-                files_end_text = _formatear_dict_ficheros(files_end)
-                msg = _mensaje_error_funcion(
-                    errores, test, stdout_obt, files_end_text, ret_obt
-                )
-                _mostrar_error_scroll("Error en el test", msg)
-                '''
-                messagebox.showerror(
-                    "Resultado de la corrección",
-                    f"El ejercicio no supera el test {idx} de {total}.",
-                )
-                '''
-                return
+    clave = _clave_resultado(ejercicio, fuente, lista_tests)
+    anticipado = _ANTICIPADOR.en_curso(ejercicio, fuente) if _ANTICIPADOR else None
+    if anticipado is not None and not anticipado.terminado.wait(ANTICIPADA_ESPERA):
+        # Se corrige en primer plano, con prioridad normal
+        anticipado.cancelar()
+    guardado, msg = _resultado_guardado(clave)
+
+    if not guardado:
+        remoto = _corregir_en_servidor(dni, ejercicio, fuente)
+        if remoto is not None:
+            msg = remoto.get("mensaje")
+        else:
+            msg = None
+            fallo = _primer_fallo(tipo, ejercicio, fuente, lista_tests)
+            if fallo is not None:
+                _idx, test, res, errores = fallo
+                msg = _mensaje_error(tipo, errores, test, res)
+            _guardar_resultado(clave, fallo)
+
+    if msg:
+        _mostrar_error_scroll("Error en el test", msg)
+        return
 
     # -----------------------------------------------------------------
     # Si hemos llegado aquí, todos los tests han sido superados
     # -----------------------------------------------------------------
-    threading.Thread(
-        target=_subir_ejercicios,
-        args=(dni, ejercicio, fuente),
-        daemon=True,
-    ).start()
+    _subir_ejercicios(dni, ejercicio, fuente)
     messagebox.showinfo(
         "Resultado de la corrección",
         "El ejercicio supera todos los tests.",
@@ -854,6 +3222,14 @@ def _corregir_ejercicio_funcion(dni, ejercicio, fuente, lista_tests):
 
 
 def main():
+    _iniciar_traza()
+    try:
+        _main()
+    finally:
+        _terminar_traza()
+
+
+def _main():
     global _TESTS_CACHE
     _TESTS_CACHE = None
     wb = get_workbench()
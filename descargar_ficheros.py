@@ -5,26 +5,53 @@ descargar_ficheros.py
 Módulo descargado dinámicamente por configuracion.py.
 
 Funciona así:
-- Descarga el archivo ficheros.zip de FI-UMH/Thonny
-- Descomprime su contenido en memoria
-- Copia todos los ficheros a la carpeta elegida por el alumno
+- Pregunta la carpeta destino (antes de ninguna descarga)
+- Lee el directorio central de ficheros.zip de FI-UMH/Thonny y su índice
+  (indice.json: qué ficheros necesita cada ejercicio, con sus tamaños).
+  Sin indice.json, lo que esté en una carpeta con el nombre de un
+  ejercicio (p000/..., f001/...) es de ese ejercicio y el resto, común
+- Elige el ejercicio de la cabecera "# EJERCICIO =" del editor, o lo
+  pregunta al alumno
+- Copia a la carpeta elegida solo los ficheros de ese ejercicio (sin la
+  carpeta del ejercicio, si la hay) y los comunes; sin índice, o dejando
+  el ejercicio en blanco, todos tal cual
 
-No crea archivos temporales en disco salvo los estrictamente utilizados
-por zipfile (gestionados en memoria).
+Si el servidor admite rangos (GitHub y herramientas/espejo.py lo hacen)
+solo se descargan el final del zip y los ficheros elegidos; si no, el zip
+entero, en memoria. No crea archivos temporales en disco.
 """
 
 import urllib.request
 import zipfile
+import json
 import io
 import os
-from tkinter import filedialog, messagebox
+import re
+from tkinter import filedialog, messagebox, simpledialog
+from configuracion import abrir_recurso
 
 
 # -------------------------------------------------------------------------
 # CONFIGURACIÓN
 # -------------------------------------------------------------------------
 
-ZIP_URL = "https://raw.githubusercontent.com/FI-UMH/Thonny/main/ficheros.zip"
+# Mismo origen que los módulos (FIUMH_BASE_URL, ver configuracion.py);
+# FIUMH_ZIP_URL cambia solo este fichero. Con un espejo del laboratorio
+# (FIUMH_ESPEJO) se pide primero a él (configuracion.abrir_recurso)
+BASE_URL = os.environ.get(
+    "FIUMH_BASE_URL", "https://raw.githubusercontent.com/FI-UMH/Thonny/main/"
+).rstrip("/") + "/"
+ZIP_URL = os.environ.get("FIUMH_ZIP_URL", BASE_URL + "ficheros.zip")
+
+# Miembro del zip con el índice (ver herramientas/indice_ficheros.py):
+# {"comunes": {nombre: tamaño}, "ejercicios": {id: {nombre: tamaño}}}
+INDICE = "indice.json"
+
+# Bytes del final del zip pedidos de entrada: suelen bastar para el
+# directorio central completo. Cualquier otra lectura pide al menos
+# LECTURA_MIN bytes.
+COLA_INICIAL = 64 * 1024
+LECTURA_MIN = 16 * 1024
 
 
 # -------------------------------------------------------------------------
@@ -32,44 +59,278 @@ ZIP_URL = "https://raw.githubusercontent.com/FI-UMH/Thonny/main/ficheros.zip"
 # -------------------------------------------------------------------------
 
 def _descargar_zip() -> bytes:
-    """Descarga ficheros.zip desde GitHub y devuelve su contenido como bytes."""
+    """Descarga ficheros.zip (de ZIP_URL) y devuelve su contenido como bytes."""
     try:
-        with urllib.request.urlopen(ZIP_URL) as resp:
+        with abrir_recurso("ficheros.zip", ZIP_URL) as resp:
             return resp.read()
     except Exception as e:
         messagebox.showerror("Error", f"Error descargando ficheros.zip:\n{e}")
         return None
 
 
+class _ZipCambiado(Exception):
+    """El zip remoto ha cambiado entre dos peticiones de rango."""
+
+
+class _ZipRemoto:
+    """
+    Fichero de solo lectura sobre el zip remoto para zipfile.ZipFile: cada
+    lectura que no está ya descargada se pide con un Range (con If-Range,
+    para no mezclar dos versiones del zip).
+    """
+
+    def __init__(self, url, tamano, etag, inicio, datos):
+        self.url = url
+        self.tamano = tamano
+        self.etag = etag
+        self._trozos = [(inicio, datos)]
+        self._pos = 0
+        self.peticiones = 1
+        self.bytes = len(datos)
+
+    def seekable(self):
+        return True
+
+    def seek(self, desplazamiento, desde=0):
+        base = (0, self._pos, self.tamano)[desde]
+        self._pos = base + desplazamiento
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def _pedir(self, a, b):
+        cabeceras = {"Range": f"bytes={a}-{b}"}
+        if self.etag:
+            cabeceras["If-Range"] = self.etag
+        with urllib.request.urlopen(urllib.request.Request(self.url, headers=cabeceras)) as resp:
+            if resp.status != 206:
+                raise _ZipCambiado(self.url)
+            datos = resp.read()
+        self.peticiones += 1
+        self.bytes += len(datos)
+        self._trozos.append((a, datos))
+        return a, datos
+
+    def _trozo(self, pos):
+        for inicio, datos in self._trozos:
+            if inicio <= pos < inicio + len(datos):
+                return inicio, datos
+        return self._pedir(pos, min(pos + LECTURA_MIN, self.tamano) - 1)
+
+    def precargar(self, a, b):
+        """Descarga [a, b] con una sola petición si no está ya descargado."""
+        if not any(i <= a and b < i + len(d) for i, d in self._trozos):
+            self._pedir(a, b)
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.tamano - self._pos
+        n = min(n, self.tamano - self._pos)
+        partes = []
+        while n > 0:
+            inicio, datos = self._trozo(self._pos)
+            parte = datos[self._pos - inicio:self._pos - inicio + n]
+            partes.append(parte)
+            self._pos += len(parte)
+            n -= len(parte)
+        return b"".join(partes)
+
+    def close(self):
+        self._trozos = []
+
+
+def _abrir_zip():
+    """
+    ficheros.zip como zipfile.ZipFile: sobre _ZipRemoto si el servidor
+    responde al Range del final del zip, o en memoria si lo envía entero.
+    """
+    with abrir_recurso("ficheros.zip", ZIP_URL,
+                           cabeceras={"Range": f"bytes=-{COLA_INICIAL}"}) as resp:
+        datos = resp.read()
+        rango = re.match(r"bytes (\d+)-\d+/(\d+)", resp.headers.get("Content-Range", ""))
+        if resp.status != 206 or not rango:
+            return zipfile.ZipFile(io.BytesIO(datos))
+        remoto = _ZipRemoto(resp.geturl(), int(rango.group(2)), resp.headers.get("ETag"),
+                            int(rango.group(1)), datos)
+    return zipfile.ZipFile(remoto)
+
+
+# -------------------------------------------------------------------------
+# ÍNDICE Y SELECCIÓN DE FICHEROS
+# -------------------------------------------------------------------------
+
+# Carpeta de primer nivel con los ficheros de un ejercicio (zip sin índice)
+_CARPETA_EJERCICIO = re.compile(r"([pf]\w+)/")
+
+
+def _indice_por_nombres(z: zipfile.ZipFile):
+    """
+    Índice deducido de los nombres (zip sin indice.json): cada carpeta
+    p000/, f001/... es de ese ejercicio y el resto es común. None si no
+    hay ninguna carpeta así.
+    """
+    comunes, ejercicios = {}, {}
+    for info in z.infolist():
+        if info.filename.endswith("/") or info.filename == INDICE:
+            continue
+        m = _CARPETA_EJERCICIO.match(info.filename)
+        destino = ejercicios.setdefault(m.group(1), {}) if m else comunes
+        destino[info.filename] = info.file_size
+    return {"comunes": comunes, "ejercicios": ejercicios} if ejercicios else None
+
+
+def _leer_indice(z: zipfile.ZipFile):
+    """Índice del zip (indice.json, o deducido de los nombres), o None."""
+    if INDICE not in z.namelist():
+        return _indice_por_nombres(z)
+    return json.loads(z.read(INDICE).decode("utf-8"))
+
+
+def _ficheros(z: zipfile.ZipFile, indice=None, ejercicio=None) -> list:
+    """Miembros a extraer: los del ejercicio y los comunes, o todos."""
+    todos = [n for n in z.namelist() if not n.endswith("/") and n != INDICE]
+    if not indice or not ejercicio:
+        return todos
+    elegidos = set(indice.get("comunes", {})) | set(indice["ejercicios"].get(ejercicio, {}))
+    return [n for n in todos if n in elegidos]
+
+
+def _precargar(z: zipfile.ZipFile, nombres):
+    """
+    Con el zip remoto, pide de una vez cada tramo contiguo de miembros
+    elegidos (cabecera local + datos), en lugar de ir leyendo a trozos.
+    """
+    if not isinstance(z.fp, _ZipRemoto):
+        return
+    infos = sorted(z.infolist(), key=lambda i: i.header_offset)
+    fines = [i.header_offset for i in infos[1:]] + [z.start_dir]
+    elegidos = set(nombres)
+    tramos = []
+    for info, fin in zip(infos, fines):
+        if info.filename not in elegidos:
+            continue
+        if tramos and tramos[-1][1] == info.header_offset:
+            tramos[-1][1] = fin
+        else:
+            tramos.append([info.header_offset, fin])
+    for a, b in tramos:
+        z.fp.precargar(a, b - 1)
+
+
+def _ejercicio_actual():
+    """Ejercicio de la cabecera "# EJERCICIO =" del editor activo, o None."""
+    try:
+        from thonny import get_workbench
+        ed = get_workbench().get_editor_notebook().get_current_editor()
+        fuente = ed.get_text_widget().get("1.0", "end-1c") if ed else ""
+    except Exception:
+        return None
+    m = re.search(r"^\s*#\s*EJERCICIO\s*=\s*(.+)$", fuente, re.MULTILINE)
+    return m.group(1).strip() if m else None
+
+
+def _kb(tamanos: dict) -> str:
+    return f"{sum(tamanos.values()) / 1024:.0f} KB"
+
+
+def _elegir_ejercicio(indice):
+    """
+    Ejercicio cuyos ficheros se descargan: el del editor si está en el
+    índice; si no, el que indique el alumno ("" = todos, None = cancelar).
+    """
+    ejercicio = _ejercicio_actual()
+    ejercicios = indice["ejercicios"]
+    if ejercicio in ejercicios:
+        return ejercicio
+    opciones = ", ".join(f"{e} ({_kb(t)})" for e, t in sorted(ejercicios.items()))
+    while True:
+        respuesta = simpledialog.askstring(
+            "Descargar ficheros",
+            f"Ejercicio cuyos ficheros quieres descargar:\n{opciones}\n\n"
+            "Déjalo en blanco para descargarlos todos.",
+            initialvalue=ejercicio or "",
+        )
+        if respuesta is None or not respuesta.strip() or respuesta.strip() in ejercicios:
+            return respuesta.strip() if respuesta is not None else None
+        messagebox.showerror("Error", f"No hay ficheros para el ejercicio {respuesta.strip()}.")
+
+
 # -------------------------------------------------------------------------
 # EXTRACCIÓN DEL ZIP
 # -------------------------------------------------------------------------
 
-def _extraer_zip(data: bytes, destino: str):
+def _leer_miembros(z: zipfile.ZipFile, nombres):
     """
-    Extrae todos los archivos contenidos en ficheros.zip
-    dentro de la carpeta destino elegida por el usuario.
+    [(nombre, contenido)] de los miembros indicados. Si una lectura del zip
+    remoto falla (rango rechazado, zip cambiado, red), se descarga entero
+    y se leen de él; None si tampoco se puede descargar.
     """
     try:
-        with zipfile.ZipFile(io.BytesIO(data)) as z:
-            for nombre in z.namelist():
+        return [(nombre, z.read(nombre)) for nombre in nombres]
+    except Exception:
+        if not isinstance(z.fp, _ZipRemoto):
+            raise
+    data = _descargar_zip()
+    if data is None:
+        return None
+    z = zipfile.ZipFile(io.BytesIO(data))
+    return [(nombre, z.read(nombre)) for nombre in nombres]
+
+
+def _ruta_destino(destino: str, nombre: str) -> str:
+    """
+    Ruta de salida del miembro nombre dentro de destino. ValueError si
+    quedaría fuera (nombre absoluto, con unidad o con ".."): el zip puede
+    venir de un espejo del aula.
+    """
+    base = os.path.realpath(destino)
+    ruta = os.path.realpath(os.path.join(base, nombre))
+    if os.path.isabs(nombre) or os.path.commonpath([base, ruta]) != base:
+        raise ValueError(f"Nombre no válido en ficheros.zip: {nombre}")
+    return ruta
+
+
+def _nombre_salida(nombre: str, ejercicio=None) -> str:
+    """Nombre del miembro sin la carpeta del ejercicio elegido, si está en ella."""
+    if ejercicio and nombre.startswith(ejercicio + "/"):
+        return nombre[len(ejercicio) + 1:]
+    return nombre
+
 
-                # Saltar directorios
-                if nombre.endswith("/"):
-                    continue
+def _extraer_zip(z: zipfile.ZipFile, destino: str, nombres=None, ejercicio=None):
+    """
+    Extrae de ficheros.zip los miembros indicados (todos si nombres es
+    None) dentro de la carpeta destino elegida por el usuario; los de la
+    carpeta de ejercicio, sin ella.
+    """
+    if nombres is None:
+        nombres = _ficheros(z)
+    try:
+        # Antes de descargar nada, para no escribir fuera de destino
+        rutas = {nombre: _ruta_destino(destino, _nombre_salida(nombre, ejercicio))
+                 for nombre in nombres}
+        contenidos = _leer_miembros(z, nombres)
+        if contenidos is None:
+            return
+        total = 0
+        for nombre, contenido in contenidos:
 
-                contenido = z.read(nombre)
+            total += len(contenido)
 
-                ruta_salida = os.path.join(destino, nombre)
+            ruta_salida = rutas[nombre]
 
-                # Crear directorios intermedios
-                os.makedirs(os.path.dirname(ruta_salida), exist_ok=True)
+            # Crear directorios intermedios
+            os.makedirs(os.path.dirname(ruta_salida), exist_ok=True)
 
-                # Escribir fichero final
-                with open(ruta_salida, "wb") as f:
-                    f.write(contenido)
+            # Escribir fichero final
+            with open(ruta_salida, "wb") as f:
+                f.write(contenido)
 
-        messagebox.showinfo("Descargar ficheros", "Ficheros descargados correctamente.")
+        messagebox.showinfo(
+            "Descargar ficheros",
+            f"Ficheros descargados correctamente ({len(nombres)}, {total / 1024:.0f} KB).",
+        )
 
     except Exception as e:
         messagebox.showerror("Error", f"Error extrayendo ficheros.zip:\n{e}")
@@ -86,9 +347,30 @@ def main():
     if not destino:
         return
 
-    data = _descargar_zip()
-    if data is None:
-        return
+    try:
+        z = _abrir_zip()
+        indice = _leer_indice(z)
+    except Exception:
+        # Servidor que no sirve bien los rangos, o zip cambiado a mitad:
+        # se descarga entero
+        data = _descargar_zip()
+        if data is None:
+            return
+        z = zipfile.ZipFile(io.BytesIO(data))
+        indice = _leer_indice(z)
 
-    _extraer_zip(data, destino)
+    ejercicio = None
+    if indice:
+        ejercicio = _elegir_ejercicio(indice)
+        if ejercicio is None:
+            return
 
+    nombres = _ficheros(z, indice, ejercicio)
+    try:
+        _precargar(z, nombres)
+    except Exception:
+        data = _descargar_zip()
+        if data is None:
+            return
+        z = zipfile.ZipFile(io.BytesIO(data))
+    _extraer_zip(z, destino, nombres, ejercicio)
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Herramientas del profesorado para FI-UMH/Thonny.
+
+Estos módulos no se descargan en los equipos de los alumnos: se ejecutan
+desde un clon del repositorio (python -m herramientas.<módulo>) y usan la
+lógica de corregir_ejercicio.py sin Thonny ni interfaz gráfica.
+"""
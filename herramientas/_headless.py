@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Carga de corregir_ejercicio.py fuera de Thonny.
+
+- Sustituye el paquete thonny por un módulo mínimo (no hay workbench).
+- Si tkinter no está instalado, lo sustituye también.
+- Los avisos (messagebox, ventana de errores) se guardan en AVISOS en
+  lugar de mostrarse.
+"""
+
+import os
+import sys
+import json
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS_PATH = os.path.join(REPO_DIR, "tests.json")
+
+# (titulo, mensaje) de cada aviso que el corrector habría mostrado
+AVISOS = []
+
+
+def _modulo_falso(nombre, **atributos):
+    mod = types.ModuleType(nombre)
+    mod.__dict__.update(atributos)
+    sys.modules[nombre] = mod
+    return mod
+
+
+def _sin_workbench():
+    raise RuntimeError("No hay workbench de Thonny en modo headless.")
+
+
+def _aviso(titulo, mensaje="", **kwargs):
+    AVISOS.append((titulo, mensaje))
+
+
+class _MessageboxHeadless:
+    showerror = showinfo = showwarning = staticmethod(_aviso)
+
+
+def _instalar_sustitutos():
+    if "thonny" not in sys.modules:
+        _modulo_falso("thonny", get_workbench=_sin_workbench)
+
+    try:
+        import tkinter  # noqa: F401
+        import tkinter.font  # noqa: F401
+    except ImportError:
+        class _Widget:
+            def __init__(self, *args, **kwargs):
+                raise RuntimeError("tkinter no disponible en modo headless.")
+
+        tk = _modulo_falso(
+            "tkinter", Toplevel=_Widget, Text=_Widget, Scrollbar=_Widget, Frame=_Widget
+        )
+        tk.messagebox = _modulo_falso("tkinter.messagebox")
+        tk.filedialog = _modulo_falso("tkinter.filedialog")
+        tk.font = _modulo_falso("tkinter.font", Font=_Widget)
+
+
+def cargar_modulo(nombre: str):
+    """Importa uno de los módulos del repositorio sin interfaz gráfica."""
+    _instalar_sustitutos()
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return sin_interfaz(__import__(nombre))
+
+
+def sin_interfaz(mod):
+    """
+    Hace que los avisos de mod se guarden en AVISOS (sirve también para
+    los módulos cargados con configuracion.cargar_o_importar).
+    """
+    if hasattr(mod, "messagebox"):
+        mod.messagebox = _MessageboxHeadless()
+    if hasattr(mod, "_mostrar_error_scroll"):
+        mod._mostrar_error_scroll = _aviso
+    return mod
+
+
+def cargar_corrector():
+    """corregir_ejercicio preparado para usarse sin Thonny."""
+    return cargar_modulo("corregir_ejercicio")
+
+
+def cargar_tests(ruta: str = TESTS_PATH) -> dict:
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def guardar_tests(tests: dict, ruta: str = TESTS_PATH):
+    """
+    Escribe tests.json con el mismo formato que el del repositorio. La
+    copia cifrada (tests.json.cr) no se puede regenerar desde aquí: si
+    existe, se avisa de que ha quedado desfasada.
+    """
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(tests, f, indent=2, ensure_ascii=False)
+    if os.path.exists(ruta + ".cr"):
+        print(f"Aviso: {os.path.basename(ruta)}.cr no se ha actualizado; vuelve a "
+              "cifrarlo antes de publicar los cambios.", file=sys.stderr)
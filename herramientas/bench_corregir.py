@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+bench_corregir.py
+----------------------
+Benchmark headless del proceso de corrección.
+
+Corrige los ejercicios reales de tests.json (f000, p000) con una serie de
+envíos sintéticos y mide cada fase de cada test:
+
+    preparar  -> directorio temporal + alumno.py + ficheros iniciales
+    lanzar    -> creación del subproceso
+    ejecutar  -> ejecución hasta que termina (o TIMEOUT_TEST)
+    recoger   -> decodificación de la salida y lectura de ficheros
+    limpiar   -> borrado del directorio temporal
+    comparar  -> _comprobar_programa / _comprobar_funcion
+
+Uso:
+    python -m herramientas.bench_corregir
+    python -m herramientas.bench_corregir --repeticiones 5 --guardar base.json
+    python -m herramientas.bench_corregir --comparar base.json
+
+Con --comparar se termina con código 1 si alguna mediana empeora más
+del umbral indicado respecto a la referencia.
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+
+from herramientas._headless import cargar_corrector, cargar_tests
+
+FASES = ("preparar", "lanzar", "ejecutar", "recoger", "limpiar", "comparar")
+
+
+# -------------------------------------------------------------------------
+# ENVÍOS SINTÉTICOS
+# -------------------------------------------------------------------------
+
+# Soluciones de referencia. {extra} se sustituye por el código propio de
+# cada tipo de envío (al principio del cuerpo).
+
+_REFERENCIA = {
+    "f000": (
+        "import os\n"
+        "def f000(fin, fout):\n"
+        "{extra}"
+        "    with open(fin) as f:\n"
+        "        texto = f.read()\n"
+        "    with open(fout, 'w') as f:\n"
+        "        f.write(texto)\n"
+        "    a = input()\n"
+        "    b = input()\n"
+        "    {falla}\n"
+        "    print(f'({{a}}) ({{b}})')\n"
+        "    return [fin, fout, a, b]\n"
+    ),
+    "p000": (
+        "import os\n"
+        "def main():\n"
+        "{extra}"
+        "    with open('nombre.txt') as f:\n"
+        "        nombre = f.read()\n"
+        "    with open('apellido.txt') as f:\n"
+        "        apellido = f.read()\n"
+        "    with open('salida.txt', 'w') as f:\n"
+        "        f.write(nombre + ' ' + apellido)\n"
+        "    a = input()\n"
+        "    b = input()\n"
+        "    {falla}\n"
+        "    print(f'({{a}}) ({{b}})')\n"
+        "main()\n"
+    ),
+}
+
+# Cambia la salida solo si el contexto coincide con el del último test
+_FALLA_ULTIMO = "if _es_ultimo(a, b, {args}): a = a + '0'"
+
+# Argumentos con los que se llama a la función, para reconocer el caso
+_ARGS = {"f000": "[fin, fout]", "p000": "[]"}
+
+_ES_ULTIMO = (
+    "def _es_ultimo(a, b, args):\n"
+    "    ultimo = {ultimo!r}\n"
+    "    if a + '\\n' + b + '\\n' != ultimo['stdin'] or args != ultimo['args']:\n"
+    "        return False\n"
+    "    for nombre, contenido in ultimo['filesIni'].items():\n"
+    "        with open(nombre) as f:\n"
+    "            if f.read() != contenido:\n"
+    "                return False\n"
+    "    return True\n\n"
+)
+
+_EXTRA = {
+    "correcto": "",
+    "falla_ultimo": "",
+    "bucle_infinito": "    while True:\n        pass\n",
+    "salida_masiva": "    for i in range(50000):\n        print('linea de relleno', i)\n",
+    "ficheros_grandes": (
+        "    with open('grande.txt', 'w') as g:\n"
+        "        g.write('x' * (8 * 1024 * 1024))\n"
+    ),
+}
+
+ENVIOS = tuple(_EXTRA)
+
+
+def fuente_sintetica(ejercicio: str, envio: str, lista_tests) -> str:
+    cabecera = f"# DNI = 00000000B\n# EJERCICIO = {ejercicio}\n\n"
+    falla = "pass"
+    previo = ""
+    if envio == "falla_ultimo":
+        ultimo = lista_tests[-1]
+        previo = _ES_ULTIMO.format(
+            ultimo={"stdin": ultimo.get("stdin", ""),
+                    "args": ultimo.get("args", []),
+                    "filesIni": dict(ultimo.get("filesIni") or {})}
+        )
+        falla = _FALLA_ULTIMO.format(args=_ARGS[ejercicio])
+    cuerpo = _REFERENCIA[ejercicio].format(extra=_EXTRA[envio], falla=falla)
+    return cabecera + previo + cuerpo
+
+
+# -------------------------------------------------------------------------
+# MEDICIÓN
+# -------------------------------------------------------------------------
+
+
+def corregir_medido(ce, ejercicio, fuente, lista_tests):
+    """
+    Mismo recorrido que corregir_ejercicio (se para en el primer fallo).
+    Devuelve (tests_ejecutados, superado, lista de dicts de tiempos, total).
+    """
+    tipo = ce._tipo_ejercicio(ejercicio)
+    tiempos = []
+    t0 = time.perf_counter()
+    superado = True
+    for _idx, test in ce._orden_tests(lista_tests):
+        res, errores = ce._evaluar_test(tipo, fuente, test)
+        tiempos.append(res.get("tiempos", {}))
+        if errores:
+            superado = False
+            break
+    return len(tiempos), superado, tiempos, time.perf_counter() - t0
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) con interpolación lineal; 0.0 sin valores."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def _resumen(valores):
+    return {
+        "n": len(valores),
+        "p50": percentil(valores, 50),
+        "p95": percentil(valores, 95),
+        "max": max(valores) if valores else 0.0,
+        "media": statistics.fmean(valores) if valores else 0.0,
+    }
+
+
+def ejecutar_benchmark(ejercicios, envios, repeticiones):
+    ce = cargar_corrector()
+    tests = ce._internar_tests(cargar_tests())
+    resultados = {}
+
+    for ejercicio in ejercicios:
+        lista_tests = list(ce._casos(tests[ejercicio]))
+        resultados[ejercicio] = {}
+        for envio in envios:
+            fuente = fuente_sintetica(ejercicio, envio, lista_tests)
+            por_fase = {fase: [] for fase in FASES}
+            totales = []
+            n_tests = 0
+            superado = None
+            for _ in range(repeticiones):
+                n, superado, tiempos, total = corregir_medido(
+                    ce, ejercicio, fuente, lista_tests
+                )
+                n_tests += n
+                totales.append(total)
+                for t in tiempos:
+                    for fase in FASES:
+                        if fase in t:
+                            por_fase[fase].append(t[fase])
+            resultados[ejercicio][envio] = {
+                "superado": superado,
+                "tests_por_envio": n_tests // repeticiones,
+                "fases": {f: _resumen(v) for f, v in por_fase.items()},
+                "total": _resumen(totales),
+                "tests_por_segundo": n_tests / sum(totales) if sum(totales) else 0.0,
+            }
+            print(f"  {ejercicio:<6}{envio:<18}{statistics.fmean(totales):8.3f} s",
+                  file=sys.stderr)
+    return resultados
+
+
+# -------------------------------------------------------------------------
+# INFORMES
+# -------------------------------------------------------------------------
+
+
+def imprimir_informe(resultados):
+    for ejercicio, por_envio in resultados.items():
+        print(f"\n=== {ejercicio} ===")
+        for envio, r in por_envio.items():
+            estado = "supera" if r["superado"] else "falla"
+            print(
+                f"\n{envio} ({estado}, {r['tests_por_envio']} tests, "
+                f"{r['tests_por_segundo']:.1f} tests/s, "
+                f"total p50 {r['total']['p50'] * 1000:.1f} ms)"
+            )
+            print(f"  {'fase':<10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+            for fase in FASES:
+                s = r["fases"][fase]
+                if not s["n"]:
+                    continue
+                print(
+                    f"  {fase:<10}{s['p50'] * 1000:>10.2f}"
+                    f"{s['p95'] * 1000:>10.2f}{s['max'] * 1000:>10.2f}"
+                )
+
+
+def comparar_con_referencia(resultados, referencia, umbral):
+    """Devuelve la lista de regresiones (medianas que empeoran > umbral)."""
+    regresiones = []
+    base = referencia.get("resultados", {})
+    for ejercicio, por_envio in resultados.items():
+        for envio, r in por_envio.items():
+            ref = base.get(ejercicio, {}).get(envio)
+            if not ref:
+                continue
+            medidas = [("total", r["total"]["p50"], ref["total"]["p50"])]
+            for fase in FASES:
+                medidas.append(
+                    (fase, r["fases"][fase]["p50"], ref["fases"][fase]["p50"])
+                )
+            for nombre, actual, anterior in medidas:
+                if anterior > 0 and actual > anterior * (1 + umbral):
+                    regresiones.append(
+                        f"{ejercicio}/{envio}/{nombre}: "
+                        f"{anterior * 1000:.2f} ms -> {actual * 1000:.2f} ms "
+                        f"(+{(actual / anterior - 1) * 100:.0f}%)"
+                    )
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--ejercicios", nargs="+", default=["f000", "p000"])
+    parser.add_argument("--envios", nargs="+", default=list(ENVIOS), choices=ENVIOS)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--guardar", metavar="JSON",
+                        help="guarda los resultados como nueva referencia")
+    parser.add_argument("--comparar", metavar="JSON",
+                        help="compara con una referencia guardada")
+    parser.add_argument("--umbral", type=float, default=0.20,
+                        help="empeoramiento tolerado de las medianas (0.20 = 20%%)")
+    args = parser.parse_args(argv)
+
+    resultados = ejecutar_benchmark(args.ejercicios, args.envios, args.repeticiones)
+    imprimir_informe(resultados)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": sys.version.split()[0],
+                    "plataforma": platform.platform(),
+                    "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "repeticiones": args.repeticiones,
+                    "resultados": resultados,
+                },
+                f, indent=2, ensure_ascii=False,
+            )
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            referencia = json.load(f)
+        regresiones = comparar_con_referencia(resultados, referencia, args.umbral)
+        if regresiones:
+            print("\nREGRESIONES:")
+            for r in regresiones:
+                print(f"  {r}")
+            return 1
+        print("\nSin regresiones respecto a la referencia.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+carga_clientes.py
+----------------------
+Generador de carga: simula N equipos del aula que arrancan Thonny a la
+vez contra el mismo servidor (por defecto, un servidor_simulado local con
+la latencia, el ancho de banda y la tasa de errores indicados).
+
+Cada cliente es un proceso aparte con su propio ~/.fiumh_thonny y sigue
+los mismos caminos de red que el plugin, con el código real:
+
+    corregir_ejercicio.py, descargar_ficheros.py -> configuracion.cargar_o_importar
+    tests.json                                   -> _descargar_tests
+    ficheros.zip                                 -> descargar_ficheros._descargar_zip
+    subida                                       -> _subir_ejercicios, hasta que
+                                                    la cola queda vacía
+
+Al final se muestran p50/p95/máximo de cada paso y lo que ha visto el
+servidor (peticiones, 304, bytes, subidas). Con --espejo los clientes
+descargan tests.json y ficheros.zip a través de un espejo del
+laboratorio (herramientas/espejo.py; sin URL, uno local delante del
+servidor) y se muestran también sus estadísticas.
+
+Uso:
+    python -m herramientas.carga_clientes --clientes 60 --latencia 80 --ancho-banda 4000
+    python -m herramientas.carga_clientes --clientes 30 --escalonado 10 --errores 0.2
+    python -m herramientas.carga_clientes --clientes 30 --base http://servidor:8800/
+    python -m herramientas.carga_clientes --clientes 60 --espejo --latencia 150
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+
+from herramientas._headless import REPO_DIR
+from herramientas.bench_corregir import percentil
+from herramientas.servidor_simulado import crear_servidor, variables_cliente
+from herramientas import espejo as espejo_lab
+
+PASOS = ("corregir_ejercicio.py", "descargar_ficheros.py", "tests.json",
+         "ficheros.zip", "subida")
+
+_FUENTE = "# DNI = 00000000B\n# EJERCICIO = f000\n\ndef f000(fin, fout):\n    pass\n"
+
+
+# -------------------------------------------------------------------------
+# UN CLIENTE (proceso hijo)
+# -------------------------------------------------------------------------
+
+
+def simular_cliente(id_cliente: int, espera_subida: float) -> dict:
+    from herramientas._headless import cargar_modulo, sin_interfaz
+
+    tiempos, errores = {}, []
+
+    def medir(paso, funcion):
+        t0 = time.perf_counter()
+        try:
+            valor = funcion()
+        except Exception as e:
+            errores.append(f"{paso}: {e}")
+            return None
+        if valor is None or valor is False:
+            errores.append(paso)
+            return None
+        tiempos[paso] = time.perf_counter() - t0
+        return valor
+
+    conf = cargar_modulo("configuracion")
+    ce = medir("corregir_ejercicio.py", lambda: conf.cargar_o_importar("corregir_ejercicio"))
+    df = medir("descargar_ficheros.py", lambda: conf.cargar_o_importar("descargar_ficheros"))
+    if ce is not None:
+        sin_interfaz(ce)
+        medir("tests.json", lambda: ce._descargar_tests(avisar=False))
+    if df is not None:
+        sin_interfaz(df)
+        medir("ficheros.zip", df._descargar_zip)
+
+    def subir():
+        ce._subir_ejercicios(f"{id_cliente:08d}X", "f000", _FUENTE)
+        cola = ce._obtener_emisor().cola
+        fin = time.monotonic() + espera_subida
+        while len(cola) and time.monotonic() < fin:
+            time.sleep(0.05)
+        return not len(cola)
+
+    if ce is not None:
+        medir("subida", subir)
+    return {"cliente": id_cliente, "tiempos": tiempos, "errores": errores}
+
+
+# -------------------------------------------------------------------------
+# LANZAMIENTO Y RESUMEN
+# -------------------------------------------------------------------------
+
+
+def lanzar_clientes(n, url_base, escalonado=0.0, espera_subida=60.0, url_espejo=None):
+    """Lanza n clientes repartidos en escalonado segundos; [resultado]."""
+    resultados = [None] * n
+    with tempfile.TemporaryDirectory(prefix="carga_") as raiz:
+
+        def cliente(i):
+            time.sleep(escalonado * i / n if n else 0)
+            env = dict(os.environ, **variables_cliente(url_base))
+            env["FIUMH_DATOS_DIR"] = os.path.join(raiz, f"cliente{i}")
+            env["FIUMH_TELEMETRIA"] = "0"
+            if url_espejo:
+                env["FIUMH_ESPEJO"] = url_espejo
+            proc = subprocess.run(
+                [sys.executable, "-m", "herramientas.carga_clientes",
+                 "--cliente", str(i), "--espera-subida", str(espera_subida)],
+                cwd=REPO_DIR, env=env, capture_output=True, text=True,
+            )
+            try:
+                resultados[i] = json.loads(proc.stdout.strip().splitlines()[-1])
+            except (ValueError, IndexError):
+                resultados[i] = {"cliente": i, "tiempos": {},
+                                 "errores": [proc.stderr.strip()[-300:] or "sin salida"]}
+
+        hilos = [threading.Thread(target=cliente, args=(i,)) for i in range(n)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+    return resultados
+
+
+def resumir(resultados) -> dict:
+    resumen = {}
+    for paso in PASOS:
+        valores = [r["tiempos"][paso] for r in resultados if paso in r["tiempos"]]
+        resumen[paso] = {
+            "ok": len(valores),
+            "fallos": len(resultados) - len(valores),
+            "p50": percentil(valores, 50),
+            "p95": percentil(valores, 95),
+            "max": max(valores) if valores else 0.0,
+        }
+    return resumen
+
+
+def imprimir_informe(resumen, estado_servidor=None):
+    print(f"{'paso':<24}{'ok':>5}{'fallos':>8}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for paso, s in resumen.items():
+        print(f"{paso:<24}{s['ok']:>5}{s['fallos']:>8}{s['p50'] * 1000:>9.0f}"
+              f"{s['p95'] * 1000:>9.0f}{s['max'] * 1000:>9.0f}")
+    if estado_servidor:
+        print(f"\nServidor: respuestas {estado_servidor['codigos']}, "
+              f"{estado_servidor['bytes_enviados'] / 1024:.0f} KB enviados, "
+              f"subidas {estado_servidor['subidas']} "
+              f"({estado_servidor['subidas_solo_hash']} solo con hash)")
+
+
+def _estado_remoto(url_base):
+    try:
+        with urllib.request.urlopen(url_base.rstrip("/") + "/__estado", timeout=5) as r:
+            return json.loads(r.read().decode("utf-8"))
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulación de N clientes Thonny.")
+    parser.add_argument("--clientes", type=int, default=30)
+    parser.add_argument("--escalonado", type=float, default=0.0,
+                        help="segundos en los que se reparten los arranques")
+    parser.add_argument("--espera-subida", type=float, default=60.0,
+                        help="segundos máximos para vaciar la cola de subidas")
+    parser.add_argument("--base", help="servidor ya en marcha (si no, uno simulado local)")
+    parser.add_argument("--latencia", type=float, default=50.0, help="ms por respuesta")
+    parser.add_argument("--variacion", type=float, default=20.0, help="± ms")
+    parser.add_argument("--ancho-banda", type=float, default=None,
+                        help="KB/s del enlace compartido")
+    parser.add_argument("--errores", type=float, default=0.0,
+                        help="probabilidad de 503 por petición")
+    parser.add_argument("--espejo", nargs="?", const="local",
+                        help="URL de un espejo; sin URL, uno local delante del servidor")
+    parser.add_argument("--json", help="guarda los resultados de cada cliente")
+    parser.add_argument("--cliente", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.cliente is not None:
+        print(json.dumps(simular_cliente(args.cliente, args.espera_subida)))
+        return 0
+
+    servidor = None
+    url_base = args.base
+    if not url_base:
+        servidor = crear_servidor(
+            "127.0.0.1", 0, latencia=args.latencia, variacion=args.variacion,
+            ancho_banda=args.ancho_banda * 1024 if args.ancho_banda else None,
+            errores=args.errores,
+        )
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        url_base = f"http://127.0.0.1:{servidor.server_port}/"
+
+    espejo = None
+    url_espejo = args.espejo
+    if url_espejo == "local":
+        espejo = espejo_lab.crear_servidor("127.0.0.1", 0, origen=url_base,
+                                           cache_dir=tempfile.mkdtemp(prefix="espejo_"))
+        threading.Thread(target=espejo.serve_forever, daemon=True).start()
+        url_espejo = f"http://127.0.0.1:{espejo.server_port}/"
+
+    t0 = time.perf_counter()
+    resultados = lanzar_clientes(args.clientes, url_base, args.escalonado,
+                                 args.espera_subida, url_espejo)
+    total = time.perf_counter() - t0
+
+    estado = servidor.simulacion.estado() if servidor else _estado_remoto(url_base)
+    print(f"{args.clientes} clientes contra {url_base} en {total:.1f} s\n")
+    imprimir_informe(resumir(resultados), estado)
+    if url_espejo:
+        estado_espejo = espejo.espejo.estado() if espejo else _estado_remoto(url_espejo)
+        if estado_espejo:
+            print(f"Espejo {url_espejo}: {estado_espejo['stats']}")
+    errores = [e for r in resultados for e in r["errores"]]
+    if errores:
+        print(f"\n{len(errores)} errores; el primero: {errores[0]}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"url": url_base, "resultados": resultados, "servidor": estado},
+                      f, indent=2, ensure_ascii=False)
+    for s in (espejo, servidor):
+        if s:
+            s.shutdown()
+    if espejo:
+        shutil.rmtree(espejo.espejo.cache_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
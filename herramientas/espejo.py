@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+espejo.py
+----------------------
+Espejo de laboratorio: un equipo cualquiera del aula guarda una copia de
+los ficheros de datos de BASE_URL (tests.json y ficheros.zip) y los sirve
+por HTTP al resto, de modo que al empezar la clase los 60 equipos no
+salen a GitHub a la vez. Los módulos .py no se sirven: los clientes los
+ejecutan y siempre los descargan de BASE_URL.
+
+- Cada recurso se guarda en memoria y en --cache (sobrevive a reinicios).
+  Pasados --frescura segundos desde la última comprobación se revalida
+  con el origen (If-None-Match / If-Modified-Since): un 304 solo renueva
+  la comprobación.
+- Las peticiones simultáneas de un recurso que hay que descargar o
+  revalidar esperan a una única petición al origen.
+- Si el origen no responde se sirve la última copia, aunque esté vencida.
+- A los clientes se sirve con ETag y Last-Modified (304 con
+  If-None-Match / If-Modified-Since) y Range de un intervalo (206).
+- Responde a la búsqueda por difusión UDP de los clientes con
+  FIUMH_ESPEJO=auto (puerto 8801).
+- GET /__estado -> aciertos, revalidaciones, descargas del origen,
+  esperas compartidas, copias vencidas servidas y bytes.
+
+En los clientes: FIUMH_ESPEJO=http://equipo:8800/ o FIUMH_ESPEJO=auto. Si
+el espejo no responde, descargan de GitHub como siempre. Con "auto"
+(cualquier equipo puede contestar a la búsqueda) solo se toma del espejo
+ficheros.zip; tests.json, que puede traer programas de referencia, se
+pide siempre a BASE_URL.
+
+Uso:
+    python -m herramientas.espejo --puerto 8800 --precargar
+    python -m herramientas.espejo --origen http://127.0.0.1:8900/ --frescura 10
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from herramientas.servidor_simulado import _rango, BINARIO
+
+
+ORIGEN = os.environ.get(
+    "FIUMH_BASE_URL", "https://raw.githubusercontent.com/FI-UMH/Thonny/main/"
+).rstrip("/") + "/"
+CACHE_DIR = os.path.join(
+    os.environ.get("FIUMH_DATOS_DIR", os.path.join(os.path.expanduser("~"), ".fiumh_thonny")),
+    "espejo",
+)
+# Lo único que se sirve (como configuracion.ESPEJO_RECURSOS)
+RECURSOS = ("tests.json", "ficheros.zip")
+
+# Mismo puerto y mensajes que configuracion._buscar_espejo
+PUERTO_ANUNCIO = 8801
+PREGUNTA = b"FIUMH-ESPEJO?"
+
+
+# -------------------------------------------------------------------------
+# CACHÉ CON REVALIDACIÓN
+# -------------------------------------------------------------------------
+
+
+class Entrada:
+    """
+    Copia de un recurso: datos, ETag propio (sha1 de los datos), los
+    validadores del origen y la fecha de la última comprobación.
+    """
+
+    def __init__(self, datos, etag_origen=None, modificado_origen=None, comprobado=0.0):
+        self.datos = datos
+        self.etag = '"' + hashlib.sha1(datos).hexdigest() + '"'
+        self.etag_origen = etag_origen
+        self.modificado_origen = modificado_origen
+        self.comprobado = comprobado
+
+    @property
+    def modificado(self) -> float:
+        if self.modificado_origen:
+            try:
+                return parsedate_to_datetime(self.modificado_origen).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return self.comprobado
+
+
+class Espejo:
+    def __init__(self, origen=ORIGEN, cache_dir=CACHE_DIR, frescura=60.0, timeout=15.0):
+        self.origen = origen.rstrip("/") + "/"
+        self.cache_dir = cache_dir
+        self.frescura = frescura
+        self.timeout = timeout
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entradas = {}     # ruta -> Entrada
+        self._ausentes = {}     # ruta -> fecha del 404 del origen
+        self._cerrojos = {}     # ruta -> Lock de su descarga
+        self.stats = Counter()
+
+    # --- disco ---
+
+    def _fichero(self, ruta: str) -> str:
+        return os.path.join(self.cache_dir, urllib.parse.quote(ruta, safe=""))
+
+    def _leer_disco(self, ruta):
+        fichero = self._fichero(ruta)
+        try:
+            with open(fichero + ".meta", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(fichero, "rb") as f:
+                datos = f.read()
+        except (OSError, ValueError):
+            return None
+        entrada = Entrada(datos, meta.get("etag"), meta.get("modificado"),
+                          meta.get("comprobado", 0.0))
+        return entrada if entrada.etag == meta.get("sha1") else None
+
+    def _guardar_disco(self, ruta, entrada: Entrada, con_datos=True):
+        fichero = self._fichero(ruta)
+        meta = {"etag": entrada.etag_origen, "modificado": entrada.modificado_origen,
+                "comprobado": entrada.comprobado, "sha1": entrada.etag}
+        try:
+            if con_datos:
+                with open(fichero + ".tmp", "wb") as f:
+                    f.write(entrada.datos)
+                os.replace(fichero + ".tmp", fichero)
+            with open(fichero + ".meta.tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(fichero + ".meta.tmp", fichero + ".meta")
+        except OSError:
+            pass
+
+    # --- origen ---
+
+    def _cerrojo(self, ruta) -> threading.Lock:
+        with self._lock:
+            return self._cerrojos.setdefault(ruta, threading.Lock())
+
+    def _fresca(self, ruta, ahora):
+        """Entrada sin vencer (o False si el origen dio 404 hace poco), o None."""
+        entrada = self._entradas.get(ruta)
+        if entrada is not None and ahora - entrada.comprobado < self.frescura:
+            return entrada
+        if ahora - self._ausentes.get(ruta, -self.frescura) < self.frescura:
+            return False
+        return None
+
+    def _pedir_origen(self, ruta, entrada):
+        """
+        Descarga o revalida ruta. Devuelve la entrada vigente, o None si el
+        origen no la tiene; lanza OSError si el origen no responde.
+        """
+        cabeceras = {}
+        if entrada is not None:
+            if entrada.etag_origen:
+                cabeceras["If-None-Match"] = entrada.etag_origen
+            if entrada.modificado_origen:
+                cabeceras["If-Modified-Since"] = entrada.modificado_origen
+        req = urllib.request.Request(self.origen + ruta, headers=cabeceras)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                datos = resp.read()
+                nueva = Entrada(datos, resp.headers.get("ETag"),
+                                resp.headers.get("Last-Modified"), time.time())
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entrada is not None:
+                self.stats["revalidadas"] += 1
+                entrada.comprobado = time.time()
+                self._guardar_disco(ruta, entrada, con_datos=False)
+                return entrada
+            if e.code in (403, 404, 410):
+                self.stats["ausentes"] += 1
+                return None
+            raise
+        self.stats["descargas"] += 1
+        self.stats["bytes_origen"] += len(datos)
+        self._guardar_disco(ruta, nueva)
+        return nueva
+
+    def obtener(self, ruta: str):
+        """
+        Entrada vigente de ruta, o None si el origen no la tiene. Lanza
+        OSError si no hay copia y el origen no responde.
+        """
+        vigente = self._fresca(ruta, time.time())
+        if vigente is not None:
+            self.stats["aciertos"] += 1
+            return vigente or None
+
+        cerrojo = self._cerrojo(ruta)
+        if not cerrojo.acquire(blocking=False):
+            # Otra petición ya está descargando: se espera a su resultado
+            self.stats["esperas_compartidas"] += 1
+            cerrojo.acquire()
+        try:
+            vigente = self._fresca(ruta, time.time())
+            if vigente is not None:
+                return vigente or None
+            entrada = self._entradas.get(ruta) or self._leer_disco(ruta)
+            try:
+                nueva = self._pedir_origen(ruta, entrada)
+            except OSError:
+                self.stats["errores_origen"] += 1
+                if entrada is None:
+                    raise
+                self.stats["vencidas_servidas"] += 1
+                self._entradas[ruta] = entrada
+                return entrada
+            with self._lock:
+                if nueva is None:
+                    self._entradas.pop(ruta, None)
+                    self._ausentes[ruta] = time.time()
+                else:
+                    self._entradas[ruta] = nueva
+                    self._ausentes.pop(ruta, None)
+            return nueva
+        finally:
+            cerrojo.release()
+
+    def estado(self) -> dict:
+        with self._lock:
+            entradas = {r: {"bytes": len(e.datos), "etag": e.etag,
+                            "comprobado_hace": round(time.time() - e.comprobado, 1)}
+                        for r, e in self._entradas.items()}
+        return {"origen": self.origen, "stats": dict(self.stats), "recursos": entradas}
+
+
+# -------------------------------------------------------------------------
+# HTTP
+# -------------------------------------------------------------------------
+
+
+def crear_manejador(espejo: Espejo):
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _responder(self, codigo, datos: bytes, tipo="text/plain; charset=utf-8",
+                       extra=None, cuerpo=True):
+            self.send_response(codigo)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(datos)))
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            if cuerpo and datos:
+                self.wfile.write(datos)
+                espejo.stats["bytes_servidos"] += len(datos)
+
+        def _servir(self, cuerpo=True):
+            espejo.stats["peticiones"] += 1
+            ruta = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip("/")
+            if ruta == "__estado":
+                datos = json.dumps(espejo.estado(), ensure_ascii=False).encode("utf-8")
+                self._responder(200, datos, "application/json; charset=utf-8", cuerpo=cuerpo)
+                return
+            if ruta not in RECURSOS:
+                self._responder(404, b"no encontrado", cuerpo=cuerpo)
+                return
+            try:
+                entrada = espejo.obtener(ruta)
+            except OSError:
+                self._responder(502, b"origen no disponible", extra={"Retry-After": "5"},
+                                cuerpo=cuerpo)
+                return
+            if entrada is None:
+                self._responder(404, b"no encontrado", cuerpo=cuerpo)
+                return
+
+            datos = entrada.datos
+            validadores = {
+                "ETag": entrada.etag,
+                "Last-Modified": formatdate(entrada.modificado, usegmt=True),
+                "Accept-Ranges": "bytes",
+                "Cache-Control": f"max-age={int(espejo.frescura)}",
+            }
+            if self._sin_cambios(entrada):
+                self._responder(304, b"", extra=validadores, cuerpo=False)
+                return
+            rango = _rango(self.headers.get("Range"), len(datos))
+            if rango is False:
+                self._responder(416, b"", extra={"Content-Range": f"bytes */{len(datos)}"})
+                return
+            if rango and self.headers.get("If-Range", entrada.etag).strip() == entrada.etag:
+                a, b = rango
+                validadores["Content-Range"] = f"bytes {a}-{b}/{len(datos)}"
+                self._responder(206, datos[a:b + 1], BINARIO, validadores, cuerpo)
+                return
+            self._responder(200, datos, BINARIO, validadores, cuerpo)
+
+        def _sin_cambios(self, entrada: Entrada) -> bool:
+            inm = self.headers.get("If-None-Match")
+            if inm is not None:
+                return inm.strip() == "*" or entrada.etag in [e.strip() for e in inm.split(",")]
+            ims = self.headers.get("If-Modified-Since")
+            if ims:
+                try:
+                    return int(entrada.modificado) <= parsedate_to_datetime(ims).timestamp()
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+        def do_GET(self):
+            self._servir()
+
+        def do_HEAD(self):
+            self._servir(cuerpo=False)
+
+        def log_message(self, formato, *args):
+            pass
+
+    return Manejador
+
+
+def crear_servidor(host, puerto, **opciones):
+    """Espejo listo para serve_forever() (puerto 0 = cualquiera libre)."""
+    espejo = Espejo(**opciones)
+    servidor = ThreadingHTTPServer((host, puerto), crear_manejador(espejo))
+    servidor.daemon_threads = True
+    servidor.espejo = espejo
+    return servidor
+
+
+# -------------------------------------------------------------------------
+# ANUNCIO EN LA RED LOCAL
+# -------------------------------------------------------------------------
+
+
+def _ip_hacia(direccion: str) -> str:
+    """IP local con la que se llega a direccion (la que verá el cliente)."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.connect((direccion, 9))
+            return s.getsockname()[0]
+        except OSError:
+            return "127.0.0.1"
+
+
+def anunciar(puerto_http: int, url=None, puerto=PUERTO_ANUNCIO):
+    """
+    Hilo que responde a la búsqueda de configuracion._buscar_espejo con la
+    URL del espejo (url o http://<ip hacia el cliente>:<puerto_http>/).
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(("", puerto))
+
+    def responder():
+        while True:
+            try:
+                datos, (ip, p) = s.recvfrom(512)
+                if datos.strip() != PREGUNTA:
+                    continue
+                propia = url or f"http://{_ip_hacia(ip)}:{puerto_http}/"
+                s.sendto(b"FIUMH-ESPEJO " + propia.encode("utf-8"), (ip, p))
+            except OSError:
+                continue
+
+    hilo = threading.Thread(target=responder, daemon=True)
+    hilo.start()
+    return hilo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Espejo de los recursos de FI-UMH/Thonny.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--puerto", type=int, default=8800)
+    parser.add_argument("--origen", default=ORIGEN, help="URL base que se replica")
+    parser.add_argument("--cache", default=CACHE_DIR, help="directorio de la copia")
+    parser.add_argument("--frescura", type=float, default=60.0,
+                        help="segundos entre revalidaciones con el origen")
+    parser.add_argument("--url", help="URL que se anuncia (por defecto, la IP del equipo)")
+    parser.add_argument("--sin-anuncio", action="store_true",
+                        help="no responder a FIUMH_ESPEJO=auto")
+    parser.add_argument("--precargar", action="store_true",
+                        help="descarga tests.json y ficheros.zip al arrancar")
+    args = parser.parse_args(argv)
+
+    servidor = crear_servidor(args.host, args.puerto, origen=args.origen,
+                              cache_dir=args.cache, frescura=args.frescura)
+    espejo = servidor.espejo
+    if args.precargar:
+        for ruta in RECURSOS:
+            try:
+                entrada = espejo.obtener(ruta)
+                print(f"  {ruta}: {len(entrada.datos) if entrada else 'no existe'}",
+                      file=sys.stderr)
+            except OSError as e:
+                print(f"  {ruta}: {e}", file=sys.stderr)
+    if not args.sin_anuncio:
+        try:
+            anunciar(servidor.server_port, args.url)
+        except OSError as e:
+            print(f"Sin anuncio en la red local: {e}", file=sys.stderr)
+
+    url = args.url or f"http://{socket.gethostname()}:{servidor.server_port}/"
+    print(f"Espejo de {espejo.origen} en {url} (copia en {espejo.cache_dir})", file=sys.stderr)
+    print(f"  FIUMH_ESPEJO={url}  (o FIUMH_ESPEJO=auto)", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(espejo.estado(), indent=2, ensure_ascii=False), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+generar_esperados.py
+----------------------
+Genera los resultados esperados de tests.json a partir de una solución
+de referencia, en lugar de escribirlos a mano.
+
+Las entradas de cada caso (args, stdin, filesIni) se leen de un fichero
+JSON con la misma forma que tests.json, sin los campos *_ok:
+
+    {"f000": [{"args": ["nombre.txt", "salida1.txt"], "stdin": "1\\n2\\n",
+               "filesIni": {"nombre.txt": "Alejandro"}}, ...]}
+
+o, con --desde-tests, de los casos que ya hay en tests.json. Cada caso se
+ejecuta con _run_test_programa / _run_test_funcion (el mismo entorno
+aislado que usa la corrección), en paralelo y --repeticiones veces: si
+las ejecuciones no coinciden, el caso se marca como inestable y no se
+escribe. Los campos se escriben siempre en el mismo orden y los ficheros
+ordenados por nombre, para que los cambios en tests.json sean legibles.
+Los demás campos de cada caso ("pasos", "rapido"...) se conservan.
+Los casos de complejidad no tienen resultados esperados y se copian sin
+cambios. En los generadores ({"generador": ...}) se ejecutan todos sus
+casos y se escribe la lista "esperados" del generador (sin "referencia",
+que ya no hace falta en cada equipo).
+
+Uso:
+    python -m herramientas.generar_esperados f000 --referencia sol.py --entradas casos.json
+    python -m herramientas.generar_esperados p000 --referencia sol.py --desde-tests --escribir
+"""
+
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from herramientas._headless import (
+    cargar_corrector, cargar_tests, guardar_tests, TESTS_PATH,
+)
+
+
+def _entrada(caso: dict, tipo: str, ejercicio: str) -> dict:
+    """Solo los campos de entrada del caso, en el orden de tests.json."""
+    entrada = {}
+    if tipo == "funcion":
+        entrada["funcName"] = caso.get("funcName") or ejercicio
+        entrada["args"] = caso.get("args", [])
+    entrada["stdin"] = caso.get("stdin", "")
+    entrada["filesIni"] = caso.get("filesIni") or {}
+    return entrada
+
+
+def _caso_generado(caso: dict, entrada: dict, esperado: dict) -> dict:
+    """
+    Caso para tests.json: las entradas, el resto de campos del caso
+    original sin cambios ("pasos", "rapido"...) y los *_ok nuevos.
+    """
+    nuevo = dict(entrada)
+    nuevo.update((k, v) for k, v in caso.items()
+                 if k not in nuevo and not k.endswith("_ok"))
+    nuevo.update(esperado)
+    return nuevo
+
+
+def generar(ejercicio, referencia, casos, repeticiones=2, hilos=None):
+    """
+    Devuelve (tests generados, inestables, fallidos); inestables y fallidos
+    son listas de (número de caso, detalle), numerados en la batería con
+    los generadores expandidos.
+    """
+    ce = cargar_corrector()
+    tipo = ce._tipo_ejercicio(ejercicio)
+    if tipo is None:
+        raise SystemExit("El ejercicio debe empezar por 'p' o por 'f'.")
+    # Entradas de cada elemento de la lista: una por caso literal, las de
+    # todos sus casos en un generador
+    entradas = [
+        [_entrada(c, tipo, ejercicio)
+         for c in ce._expandir_generador(caso["generador"], con_esperados=False)]
+        if "generador" in caso else [_entrada(caso, tipo, ejercicio)]
+        for caso in casos
+    ]
+    runner = ce._run_test_programa if tipo == "programa" else ce._run_test_funcion
+
+    # Los casos de complejidad no tienen campos *_ok: se conservan tal cual
+    trabajos = [(i, k, r) for i in range(len(entradas)) for k in range(len(entradas[i]))
+                for r in range(repeticiones) if not casos[i].get("complejidad")]
+    with ThreadPoolExecutor(hilos or os.cpu_count() or 2) as pool:
+        resultados = list(pool.map(
+            lambda t: runner(referencia, entradas[t[0]][t[1]]), trabajos
+        ))
+
+    por_caso = [[[] for _ in grupo] for grupo in entradas]
+    for (i, k, _r), res in zip(trabajos, resultados):
+        por_caso[i][k].append(res)
+
+    generados, inestables, fallidos = [], [], []
+    numero = 0
+    for i, grupo in enumerate(por_caso):
+        if casos[i].get("complejidad"):
+            numero += 1
+            generados.append(casos[i])
+            continue
+        esperados_grupo = []
+        for k, ejecuciones in enumerate(grupo):
+            numero += 1
+            errores = [r for r in ejecuciones if r.get("error_tipo")]
+            if errores:
+                fallidos.append((numero, errores[0]["error_detalle"].strip()))
+                continue
+            esperados = [ce._resultado_esperado(tipo, r) for r in ejecuciones]
+            distintos = [
+                campo for campo in esperados[0]
+                if any(e[campo] != esperados[0][campo] for e in esperados[1:])
+            ]
+            if distintos:
+                inestables.append((numero, ", ".join(distintos)))
+                continue
+            esperados_grupo.append(esperados[0])
+        if len(esperados_grupo) < len(grupo):
+            continue
+        if "generador" in casos[i]:
+            spec = dict(casos[i]["generador"])
+            spec.pop("referencia", None)
+            spec["esperados"] = esperados_grupo
+            generados.append({"generador": spec})
+            continue
+        generados.append(_caso_generado(casos[i], entradas[i][0], esperados_grupo[0]))
+    return generados, inestables, fallidos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera los campos *_ok de tests.json.")
+    parser.add_argument("ejercicio")
+    parser.add_argument("--referencia", required=True, help="solución correcta (.py)")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--entradas", help="JSON con las entradas de los casos")
+    origen.add_argument("--desde-tests", action="store_true",
+                        help="regenera los casos que ya hay en tests.json")
+    parser.add_argument("--tests", default=TESTS_PATH)
+    parser.add_argument("--repeticiones", type=int, default=2,
+                        help="ejecuciones por caso para detectar resultados inestables")
+    parser.add_argument("--hilos", type=int, default=None)
+    parser.add_argument("--escribir", action="store_true",
+                        help="sustituye los casos del ejercicio en tests.json")
+    args = parser.parse_args(argv)
+
+    with open(args.referencia, "r", encoding="utf-8") as f:
+        referencia = f.read()
+    tests = cargar_tests(args.tests)
+    if args.desde_tests:
+        casos = tests.get(args.ejercicio, [])
+    else:
+        with open(args.entradas, "r", encoding="utf-8") as f:
+            casos = json.load(f)[args.ejercicio]
+
+    try:
+        generados, inestables, fallidos = generar(
+            args.ejercicio, referencia, casos, args.repeticiones, args.hilos
+        )
+    except ValueError as e:
+        print(f"{args.ejercicio}: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.ejercicio}: {len(generados)} de {len(casos)} elementos generados")
+    for n, detalle in fallidos:
+        print(f"  caso {n}: la referencia falla\n    {detalle}")
+    for n, campos in inestables:
+        print(f"  caso {n}: resultado inestable entre ejecuciones ({campos})")
+
+    if args.escribir:
+        if fallidos or inestables:
+            print("No se escribe tests.json: hay casos fallidos o inestables.")
+            return 1
+        tests[args.ejercicio] = generados
+        guardar_tests(tests, args.tests)
+        print(f"Escrito {args.tests}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+indice_ficheros.py
+----------------------
+Índice de ficheros.zip por ejercicio: qué miembros necesita cada uno,
+para que "Descargar ficheros" baje y extraiga solo esos (ver
+descargar_ficheros.py).
+
+El mapa se escribe a mano en un JSON:
+
+    {"comunes": ["Software_del_computador.txt"],
+     "f000": ["Hardware_del_computador.txt"],
+     "p000": ["corrector.db", "udsclient.log"]}
+
+y esta herramienta lo comprueba contra el zip, añade los tamaños y lo
+guarda dentro del zip como indice.json. Al reescribir el zip se ordenan
+los miembros por ejercicio (comunes primero), de modo que los de cada
+ejercicio quedan contiguos y se descargan con un solo Range.
+
+Sin indice.json no hace falta esta herramienta si los ficheros de cada
+ejercicio van en una carpeta con su nombre (p000/, f001/...): el resto
+son comunes y descargar_ficheros.py deduce el índice de los nombres.
+
+Uso:
+    python -m herramientas.indice_ficheros                     # muestra el índice
+    python -m herramientas.indice_ficheros --mapa mapa.json    # lo crea o cambia
+    python -m herramientas.indice_ficheros otro.zip --mapa mapa.json --salida nuevo.zip
+"""
+
+import os
+import sys
+import json
+import argparse
+import zipfile
+
+from herramientas._headless import REPO_DIR
+
+ZIP_PATH = os.path.join(REPO_DIR, "ficheros.zip")
+INDICE = "indice.json"
+
+
+def leer_indice(ruta_zip: str):
+    with zipfile.ZipFile(ruta_zip) as z:
+        if INDICE not in z.namelist():
+            return None
+        return json.loads(z.read(INDICE).decode("utf-8"))
+
+
+def construir_indice(z: zipfile.ZipFile, mapa: dict) -> dict:
+    """Índice {"comunes", "ejercicios"} con tamaños; ValueError si falta algún miembro."""
+    tamanos = {i.filename: i.file_size for i in z.infolist() if not i.is_dir()}
+    faltan = sorted({n for nombres in mapa.values() for n in nombres} - set(tamanos))
+    if faltan:
+        raise ValueError(f"No están en el zip: {', '.join(faltan)}")
+    return {
+        "comunes": {n: tamanos[n] for n in mapa.get("comunes", [])},
+        "ejercicios": {
+            e: {n: tamanos[n] for n in nombres}
+            for e, nombres in sorted(mapa.items()) if e != "comunes"
+        },
+    }
+
+
+def _orden(indice: dict, nombres) -> list:
+    """Comunes, después los de cada ejercicio y al final el resto."""
+    orden = list(indice["comunes"])
+    for ficheros in indice["ejercicios"].values():
+        orden.extend(n for n in ficheros if n not in orden)
+    orden.extend(n for n in nombres if n not in orden)
+    return orden
+
+
+def escribir_indice(ruta_zip: str, mapa: dict, salida=None) -> dict:
+    """Reescribe el zip con el índice y los miembros ordenados por ejercicio."""
+    salida = salida or ruta_zip
+    with zipfile.ZipFile(ruta_zip) as z:
+        indice = construir_indice(z, mapa)
+        infos = {i.filename: i for i in z.infolist() if i.filename != INDICE}
+        contenidos = {n: z.read(n) for n in infos}
+    temporal = salida + ".tmp"
+    with zipfile.ZipFile(temporal, "w", zipfile.ZIP_DEFLATED) as nuevo:
+        for nombre in _orden(indice, list(infos)):
+            nuevo.writestr(infos[nombre], contenidos[nombre])
+        nuevo.writestr(INDICE, json.dumps(indice, indent=1, ensure_ascii=False))
+    os.replace(temporal, salida)
+    return indice
+
+
+def imprimir_indice(ruta_zip: str, indice):
+    with zipfile.ZipFile(ruta_zip) as z:
+        infos = [i for i in z.infolist() if not i.is_dir() and i.filename != INDICE]
+    total = sum(i.compress_size for i in infos)
+    print(f"{ruta_zip}: {len(infos)} ficheros, {total / 1024:.0f} KB comprimidos")
+    if not indice:
+        print("Sin índice: se descargan siempre todos los ficheros.")
+        return
+    comprimido = {i.filename: i.compress_size for i in infos}
+    comunes = indice.get("comunes", {})
+    print(f"  comunes: {', '.join(comunes) or '-'}")
+    for ejercicio, ficheros in indice["ejercicios"].items():
+        nombres = set(ficheros) | set(comunes)
+        kb = sum(comprimido.get(n, 0) for n in nombres) / 1024
+        print(f"  {ejercicio}: {len(nombres)} ficheros, {kb:.0f} KB comprimidos "
+              f"({kb * 1024 / total if total else 0:.0%} del zip)")
+    sin_uso = [i.filename for i in infos
+               if i.filename not in comunes
+               and not any(i.filename in f for f in indice["ejercicios"].values())]
+    if sin_uso:
+        print(f"  sin ejercicio (solo con 'todos'): {', '.join(sin_uso)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Índice de ficheros.zip por ejercicio.")
+    parser.add_argument("zip", nargs="?", default=ZIP_PATH)
+    parser.add_argument("--mapa", help="JSON {ejercicio|\"comunes\": [ficheros]}")
+    parser.add_argument("--salida", help="zip resultante (por defecto, el mismo)")
+    args = parser.parse_args(argv)
+
+    if args.mapa:
+        with open(args.mapa, "r", encoding="utf-8") as f:
+            mapa = json.load(f)
+        try:
+            escribir_indice(args.zip, mapa, args.salida)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        args.zip = args.salida or args.zip
+
+    imprimir_indice(args.zip, leer_indice(args.zip))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+minimizar_tests.py
+----------------------
+Análisis de redundancia de la batería de tests de un ejercicio.
+
+1. Comprueba que la solución de referencia supera todos los tests.
+2. Genera mutantes de la referencia (operadores aritméticos y de
+   comparación cambiados, constantes alteradas, condiciones negadas,
+   sentencias eliminadas) y ejecuta todos los tests sobre cada uno:
+   matriz test -> mutantes que detecta.
+3. Mide qué líneas de la referencia recorre cada test.
+4. Propone un subconjunto mínimo y ordenado (voraz: en cada paso el test
+   que detecta más mutantes y cubre más líneas nuevas) que detecta los
+   mismos mutantes y cubre las mismas líneas que la batería completa.
+
+Con --escribir se marcan esos tests con "rapido": true en tests.json;
+corregir_ejercicio los ejecuta primero y solo lanza el resto si se superan.
+La copia cifrada tests.json.cr no se toca: hay que volver a cifrarla
+(se avisa al escribir).
+Los casos de un generador se analizan uno a uno, pero se marca el
+generador completo si se elige alguno de ellos.
+
+Uso:
+    python -m herramientas.minimizar_tests f000 --referencia sol_f000.py
+    python -m herramientas.minimizar_tests p000 --referencia sol_p000.py --escribir
+"""
+
+import os
+import ast
+import sys
+import json
+import random
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from herramientas._headless import (
+    cargar_corrector, cargar_tests, guardar_tests, TESTS_PATH,
+)
+
+
+# -------------------------------------------------------------------------
+# MUTANTES
+# -------------------------------------------------------------------------
+
+_BINOPS = {
+    ast.Add: ast.Sub, ast.Sub: ast.Add, ast.Mult: ast.Add,
+    ast.Div: ast.Mult, ast.FloorDiv: ast.Div, ast.Mod: ast.FloorDiv,
+}
+_CMPOPS = {
+    ast.Lt: ast.LtE, ast.LtE: ast.Lt, ast.Gt: ast.GtE, ast.GtE: ast.Gt,
+    ast.Eq: ast.NotEq, ast.NotEq: ast.Eq, ast.In: ast.NotIn, ast.NotIn: ast.In,
+}
+_BOOLOPS = {ast.And: ast.Or, ast.Or: ast.And}
+
+
+class _Mutador(ast.NodeTransformer):
+    """
+    Recorre el árbol contando puntos de mutación; aplica solo el número
+    objetivo (o ninguno si objetivo es None, para contarlos).
+    """
+
+    def __init__(self, objetivo=None):
+        self.objetivo = objetivo
+        self.contador = 0
+        self.descripcion = None
+
+    def _toca(self, descripcion, nodo):
+        aplicar = self.contador == self.objetivo
+        self.contador += 1
+        if aplicar:
+            self.descripcion = f"línea {getattr(nodo, 'lineno', '?')}: {descripcion}"
+        return aplicar
+
+    def visit_BinOp(self, nodo):
+        self.generic_visit(nodo)
+        nuevo = _BINOPS.get(type(nodo.op))
+        if nuevo and self._toca(f"{type(nodo.op).__name__} -> {nuevo.__name__}", nodo):
+            nodo.op = nuevo()
+        return nodo
+
+    def visit_Compare(self, nodo):
+        self.generic_visit(nodo)
+        nuevo = _CMPOPS.get(type(nodo.ops[0]))
+        if nuevo and self._toca(f"{type(nodo.ops[0]).__name__} -> {nuevo.__name__}", nodo):
+            nodo.ops[0] = nuevo()
+        return nodo
+
+    def visit_BoolOp(self, nodo):
+        self.generic_visit(nodo)
+        nuevo = _BOOLOPS[type(nodo.op)]
+        if self._toca(f"{type(nodo.op).__name__} -> {nuevo.__name__}", nodo):
+            nodo.op = nuevo()
+        return nodo
+
+    def visit_Constant(self, nodo):
+        if isinstance(nodo.value, bool):
+            if self._toca(f"{nodo.value!r} -> {not nodo.value!r}", nodo):
+                return ast.copy_location(ast.Constant(not nodo.value), nodo)
+        elif isinstance(nodo.value, int):
+            if self._toca(f"{nodo.value!r} -> {nodo.value + 1!r}", nodo):
+                return ast.copy_location(ast.Constant(nodo.value + 1), nodo)
+        elif isinstance(nodo.value, str) and nodo.value:
+            if self._toca(f"{nodo.value!r} -> {nodo.value + 'X'!r}", nodo):
+                return ast.copy_location(ast.Constant(nodo.value + "X"), nodo)
+        return nodo
+
+    def visit_JoinedStr(self, nodo):
+        # Los trozos literales de los f-string deben seguir siendo str
+        return nodo
+
+    def visit_If(self, nodo):
+        self.generic_visit(nodo)
+        if self._toca("condición negada", nodo):
+            nodo.test = ast.UnaryOp(ast.Not(), nodo.test)
+        return nodo
+
+    visit_While = visit_If
+
+    def _sentencia(self, nodo):
+        self.generic_visit(nodo)
+        if self._toca("sentencia eliminada", nodo):
+            return ast.copy_location(ast.Pass(), nodo)
+        return nodo
+
+    visit_Assign = visit_AugAssign = visit_Expr = visit_Return = _sentencia
+
+
+def mutantes(fuente: str, maximo=None, semilla=0):
+    """[(descripción, fuente_mutada)] de la referencia."""
+    contador = _Mutador()
+    contador.visit(ast.parse(fuente))
+    puntos = list(range(contador.contador))
+    if maximo is not None and len(puntos) > maximo:
+        puntos = sorted(random.Random(semilla).sample(puntos, maximo))
+
+    resultado = []
+    for objetivo in puntos:
+        m = _Mutador(objetivo)
+        arbol = ast.fix_missing_locations(m.visit(ast.parse(fuente)))
+        try:
+            codigo = ast.unparse(arbol)
+        except Exception:
+            continue
+        # Conservamos la cabecera (DNI/EJERCICIO), que ast.unparse descarta
+        cabecera = "".join(
+            linea for linea in fuente.splitlines(keepends=True)[:2]
+            if linea.lstrip().startswith("#")
+        )
+        resultado.append((m.descripcion, cabecera + codigo + "\n"))
+    return resultado
+
+
+# -------------------------------------------------------------------------
+# COBERTURA
+# -------------------------------------------------------------------------
+
+# Se antepone a la referencia: anota las líneas de alumno.py que se
+# ejecutan y las escribe al salir en un fichero fuera del sandbox.
+_COBERTURA = '''import sys as _cs, atexit as _ca, json as _cj
+_c_lineas = set()
+def _c_traza(frame, evento, arg):
+    if not frame.f_code.co_filename.endswith("alumno.py"):
+        return None
+    if evento == "line":
+        _c_lineas.add(frame.f_lineno)
+    return _c_traza
+_cs.settrace(_c_traza)
+_cs._getframe().f_trace = _c_traza  # el propio módulo ya está en marcha
+_ca.register(lambda: _cj.dump(sorted(_c_lineas), open({ruta!r}, "w")))
+'''
+
+
+def _lineas_cubiertas(ce, tipo, fuente, test):
+    """Líneas de fuente (numeración original) que recorre el test."""
+    fd, ruta = tempfile.mkstemp(prefix="cov_", suffix=".json")
+    os.close(fd)
+    try:
+        prefijo = _COBERTURA.format(ruta=ruta)
+        # _preprocesar_fuente antepone además la definición de inputt
+        desplazamiento = prefijo.count("\n") + ce._preprocesar_fuente("").count("\n")
+        ce._evaluar_test(tipo, prefijo + fuente, test)
+        with open(ruta, "r", encoding="utf-8") as f:
+            texto = f.read()
+        lineas = json.loads(texto) if texto else []
+    finally:
+        os.remove(ruta)
+    return {n - desplazamiento for n in lineas if n > desplazamiento}
+
+
+# -------------------------------------------------------------------------
+# ANÁLISIS
+# -------------------------------------------------------------------------
+
+
+def analizar(ejercicio, referencia, lista_tests, max_mutantes=None, hilos=None):
+    ce = cargar_corrector()
+    tipo = ce._tipo_ejercicio(ejercicio)
+    n = len(lista_tests)
+    hilos = hilos or os.cpu_count() or 2
+
+    with ThreadPoolExecutor(hilos) as pool:
+        # Referencia: debe superar todo
+        fallos_ref = [
+            i for i, (_res, errores) in enumerate(
+                pool.map(lambda t: ce._evaluar_test(tipo, referencia, t), lista_tests)
+            ) if errores
+        ]
+        if fallos_ref:
+            raise SystemExit(
+                f"La referencia no supera los tests {[i + 1 for i in fallos_ref]}."
+            )
+
+        cobertura = list(pool.map(
+            lambda t: _lineas_cubiertas(ce, tipo, referencia, t), lista_tests
+        ))
+
+        lista_mutantes = mutantes(referencia, max_mutantes)
+        trabajos = [(m, i) for m in range(len(lista_mutantes)) for i in range(n)]
+        detecta = [set() for _ in range(n)]
+
+        def ejecutar(par):
+            m, i = par
+            _res, errores = ce._evaluar_test(tipo, lista_mutantes[m][1], lista_tests[i])
+            return m, i, bool(errores)
+
+        for m, i, muerto in pool.map(ejecutar, trabajos):
+            if muerto:
+                detecta[i].add(m)
+
+    objetivos = [
+        {("m", m) for m in detecta[i]} | {("l", l) for l in cobertura[i]}
+        for i in range(n)
+    ]
+    pendiente = set().union(*objetivos) if objetivos else set()
+    elegidos = []
+    while pendiente:
+        # Más objetivos nuevos; a igualdad, el primero de la batería
+        mejor = max(range(n), key=lambda i: (len(objetivos[i] & pendiente), -i))
+        if not objetivos[mejor] & pendiente:
+            break
+        elegidos.append(mejor)
+        pendiente -= objetivos[mejor]
+
+    muertos = set().union(*detecta) if detecta else set()
+    return {
+        "ejercicio": ejercicio,
+        "tests": n,
+        "mutantes": len(lista_mutantes),
+        "mutantes_detectados": len(muertos),
+        "mutantes_vivos": [
+            lista_mutantes[m][0] for m in range(len(lista_mutantes)) if m not in muertos
+        ],
+        "detecta": {i + 1: sorted(detecta[i]) for i in range(n)},
+        "cobertura": {i + 1: sorted(cobertura[i]) for i in range(n)},
+        "rapidos": [i + 1 for i in elegidos],
+    }
+
+
+def _imprimir(informe):
+    print(f"Ejercicio {informe['ejercicio']}: {informe['tests']} tests, "
+          f"{informe['mutantes']} mutantes, {informe['mutantes_detectados']} detectados")
+    print(f"\n{'test':>5}{'mutantes':>10}{'líneas':>8}")
+    for i in range(1, informe["tests"] + 1):
+        print(f"{i:>5}{len(informe['detecta'][i]):>10}{len(informe['cobertura'][i]):>8}")
+    if informe["mutantes_vivos"]:
+        print("\nMutantes que ningún test detecta:")
+        for d in informe["mutantes_vivos"]:
+            print(f"  - {d}")
+    print(f"\nNivel rápido ({len(informe['rapidos'])} de {informe['tests']} tests, "
+          f"en orden): {informe['rapidos']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Minimización de baterías de tests.")
+    parser.add_argument("ejercicio")
+    parser.add_argument("--referencia", required=True, help="solución correcta (.py)")
+    parser.add_argument("--tests", default=TESTS_PATH)
+    parser.add_argument("--max-mutantes", type=int, default=None)
+    parser.add_argument("--hilos", type=int, default=None)
+    parser.add_argument("--json", help="guarda el informe completo en este fichero")
+    parser.add_argument("--escribir", action="store_true",
+                        help='marca en tests.json los tests elegidos con "rapido": true')
+    args = parser.parse_args(argv)
+
+    with open(args.referencia, "r", encoding="utf-8") as f:
+        referencia = f.read()
+    tests = cargar_tests(args.tests)
+    ce = cargar_corrector()
+    informe = analizar(
+        args.ejercicio, referencia, list(ce._casos(tests[args.ejercicio])),
+        args.max_mutantes, args.hilos,
+    )
+    _imprimir(informe)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+
+    if args.escribir:
+        rapidos = set(informe["rapidos"])
+        i = 1
+        for entrada in tests[args.ejercicio]:
+            # Un generador no se puede partir: entra en el nivel rápido
+            # entero si se elige alguno de sus casos
+            n = ce._num_casos(entrada)
+            marcar = entrada.get("generador", entrada)
+            if rapidos & set(range(i, i + n)):
+                marcar["rapido"] = True
+            else:
+                marcar.pop("rapido", None)
+            i += n
+        guardar_tests(tests, args.tests)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
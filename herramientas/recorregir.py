@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+recorregir.py
+----------------------
+Recorrección incremental de un archivo de entregas cuando cambia tests.json.
+
+Un fichero de estado guarda, por ejercicio, el hash de su lista de tests
+y, por entrega, el hash de la fuente, el veredicto y el resultado de cada
+caso que llegó a ejecutarse (indexado por el hash del caso). Al volver a
+corregir:
+
+- Si ni la entrega ni la lista de tests de su ejercicio han cambiado, no
+  se ejecuta nada.
+- Si la lista ha cambiado, se recorren los casos en el orden de corrección
+  (_orden_tests) reutilizando el resultado de los casos que no cambiaron y
+  ejecutando solo los nuevos o modificados, hasta el primer fallo: igual
+  que corregir_ejercicio, pero sin repetir lo ya conocido.
+- Si la fuente ha cambiado, se corrige desde cero.
+- Las entregas idénticas se corrigen una sola vez, y cada resultado
+  distinto de un caso se compara e informa una sola vez.
+- Los generadores de tests.json se expanden antes de comparar: los
+  números de caso son los de la batería expandida.
+
+Las entregas se corrigen en paralelo y se muestran los veredictos que
+cambian.
+
+Uso:
+    python -m herramientas.recorregir corregir ENTREGAS/ --estado veredictos.json
+    python -m herramientas.recorregir corregir ENTREGAS/ --estado veredictos.json --tests nuevo.json
+    python -m herramientas.recorregir diferencias viejo.json nuevo.json
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from herramientas._headless import cargar_corrector, cargar_tests, TESTS_PATH
+from herramientas.similitud import fuentes_de
+
+
+def _hash(datos) -> str:
+    texto = json.dumps(datos, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def hashes_casos(lista_tests) -> list:
+    return [_hash(t) for t in lista_tests]
+
+
+def hash_lista(lista_tests) -> str:
+    return _hash(hashes_casos(lista_tests))
+
+
+def expandir(ce, tests: dict) -> dict:
+    """Listas de casos con los generadores expandidos (ver ce._casos)."""
+    return {ej: list(ce._casos(lista)) for ej, lista in tests.items()}
+
+
+# -------------------------------------------------------------------------
+# DIFERENCIAS ENTRE VERSIONES DE tests.json
+# -------------------------------------------------------------------------
+
+
+def diferencias(viejos: dict, nuevos: dict) -> dict:
+    """
+    ejercicio -> {"nuevos", "quitados", "modificados"} (números de caso en
+    la versión nueva, salvo quitados) de los ejercicios que cambian.
+    """
+    ce = cargar_corrector()
+    viejos, nuevos = expandir(ce, viejos), expandir(ce, nuevos)
+    cambios = {}
+    for ejercicio in sorted(set(viejos) | set(nuevos)):
+        antes = hashes_casos(viejos.get(ejercicio, []))
+        despues = hashes_casos(nuevos.get(ejercicio, []))
+        if antes == despues:
+            continue
+        conocidos = set(antes)
+        actuales = set(despues)
+        modificados, anadidos = [], []
+        for i, h in enumerate(despues, start=1):
+            if h in conocidos:
+                continue
+            # Misma posición con otro contenido: caso modificado
+            if i <= len(antes) and antes[i - 1] not in actuales:
+                modificados.append(i)
+            else:
+                anadidos.append(i)
+        quitados = [
+            i for i, h in enumerate(antes, start=1)
+            if h not in actuales and not (i <= len(despues) and i in modificados)
+        ]
+        cambios[ejercicio] = {
+            "nuevos": anadidos, "quitados": quitados, "modificados": modificados,
+        }
+    return cambios
+
+
+# -------------------------------------------------------------------------
+# ESTADO Y RECORRECCIÓN
+# -------------------------------------------------------------------------
+
+
+def cargar_estado(ruta: str) -> dict:
+    if not os.path.exists(ruta):
+        return {"tests": {}, "entregas": {}}
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def guardar_estado(estado: dict, ruta: str):
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _veredicto(superado, test):
+    return "supera" if superado else f"falla el test {test}"
+
+
+def corregir_entrega(ce, ejercicio, fuente, lista_tests, hashes, anteriores,
+                     clases, mensajes_previos=None):
+    """
+    Primer fallo de la entrega reutilizando los resultados conocidos
+    (hash del caso -> superado). Devuelve (entrada de estado, casos ejecutados).
+    mensajes_previos guarda el informe de los casos que ya se sabían
+    fallados (hash del caso -> mensaje).
+    """
+    tipo = ce._tipo_ejercicio(ejercicio)
+    casos = dict(anteriores)
+    ejecutados = 0
+    test_fallado = None
+    mensaje = None
+    for idx, test in ce._orden_tests(lista_tests):
+        h = hashes[idx - 1]
+        if h not in casos:
+            res, errores = clases.evaluar(tipo, fuente, test)
+            casos[h] = not errores
+            ejecutados += 1
+            if errores:
+                mensaje = clases.mensaje(tipo, errores, test, res)
+        elif not casos[h]:
+            mensaje = (mensajes_previos or {}).get(h)
+        if not casos[h]:
+            test_fallado = idx
+            break
+    entrada = {
+        "ejercicio": ejercicio,
+        "superado": test_fallado is None,
+        "test": test_fallado,
+        "caso_fallado": hashes[test_fallado - 1] if test_fallado else None,
+        "mensaje": mensaje,
+        "casos": casos,
+    }
+    return entrada, ejecutados
+
+
+def recorregir(entregas, tests: dict, estado: dict, hilos=None):
+    """
+    Recorrige [(id, fuente)] contra tests y actualiza estado. Devuelve
+    (cambios [(id, ejercicio, antes, después)], estadísticas).
+
+    Las entregas con la misma fuente se corrigen una sola vez, y la
+    comprobación e informe de cada caso se hacen una vez por resultado
+    distinto (_ClasesResultado).
+    """
+    ce = cargar_corrector()
+    clases = ce._ClasesResultado()
+    tests = expandir(ce, ce._internar_tests(tests))
+    hashes = {ej: hashes_casos(lista) for ej, lista in tests.items()}
+    listas = {ej: _hash(hs) for ej, hs in hashes.items()}
+    guardadas = estado.setdefault("entregas", {})
+    listas_previas = estado.get("tests", {})
+
+    # (ejercicio, hash de la fuente) -> [fuente, [(id, previa, anterior)]]:
+    # previa solo si es de esta misma fuente (sus casos se reutilizan),
+    # anterior siempre (para informar del cambio de veredicto)
+    grupos = {}
+    stats = {"entregas": 0, "sin_cambios": 0, "recorregidas": 0, "fuentes_distintas": 0,
+             "casos_ejecutados": 0, "sin_tests": 0}
+    for id_entrega, fuente in entregas:
+        stats["entregas"] += 1
+        _dni, ejercicio = ce._extraer_dni_ejercicio(fuente)
+        if not ejercicio or not tests.get(ejercicio) or ce._tipo_ejercicio(ejercicio) is None:
+            stats["sin_tests"] += 1
+            continue
+        h_fuente = _hash(fuente)
+        anterior = guardadas.get(id_entrega)
+        previa = anterior
+        if previa and (previa.get("fuente") != h_fuente or previa.get("ejercicio") != ejercicio):
+            previa = None
+        if previa and listas_previas.get(ejercicio) == listas[ejercicio]:
+            stats["sin_cambios"] += 1
+            continue
+        grupo = grupos.setdefault((ejercicio, h_fuente), [fuente, []])
+        grupo[1].append((id_entrega, previa, anterior))
+
+    def ejecutar(clave):
+        ejercicio, h_fuente = clave
+        fuente, miembros = grupos[clave]
+        # Misma fuente, mismos resultados: vale lo conocido de cualquiera de
+        # las copias, pero solo de los casos que siguen en la lista nueva
+        vigentes = set(hashes[ejercicio])
+        anteriores = {}
+        mensajes_previos = {}
+        for _id, previa, _anterior in miembros:
+            for h, ok in (previa or {}).get("casos", {}).items():
+                if h in vigentes:
+                    anteriores.setdefault(h, ok)
+            if previa and previa.get("caso_fallado") in vigentes:
+                mensajes_previos.setdefault(previa["caso_fallado"], previa.get("mensaje"))
+        entrada, n = corregir_entrega(
+            ce, ejercicio, fuente, tests[ejercicio], hashes[ejercicio], anteriores,
+            clases, mensajes_previos,
+        )
+        entrada["fuente"] = h_fuente
+        return miembros, entrada, n
+
+    cambios = []
+    with ThreadPoolExecutor(hilos or os.cpu_count() or 2) as pool:
+        for miembros, entrada, n in pool.map(ejecutar, list(grupos)):
+            stats["fuentes_distintas"] += 1
+            stats["casos_ejecutados"] += n
+            despues = _veredicto(entrada["superado"], entrada["test"])
+            for id_entrega, _previa, anterior in miembros:
+                stats["recorregidas"] += 1
+                guardadas[id_entrega] = dict(entrada)
+                antes = _veredicto(anterior["superado"], anterior["test"]) if anterior else None
+                if antes != despues:
+                    cambios.append((id_entrega, entrada["ejercicio"], antes, despues))
+    stats["clases_reutilizadas"] = clases.aciertos
+    stats["clases_distintas"] = clases.fallos
+
+    estado["tests"] = listas
+    cambios.sort()
+    return cambios, stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recorrección incremental de entregas.")
+    sub = parser.add_subparsers(dest="orden", required=True)
+
+    p = sub.add_parser("corregir", help="recorrige un directorio de entregas")
+    p.add_argument("directorio")
+    p.add_argument("--estado", required=True, help="fichero de veredictos (se actualiza)")
+    p.add_argument("--tests", default=TESTS_PATH)
+    p.add_argument("--hilos", type=int, default=None)
+    p.add_argument("--json", help="guarda la lista de cambios en este fichero")
+
+    p = sub.add_parser("diferencias", help="ejercicios y casos que cambian entre dos tests.json")
+    p.add_argument("viejo")
+    p.add_argument("nuevo")
+
+    args = parser.parse_args(argv)
+
+    if args.orden == "diferencias":
+        cambios = diferencias(cargar_tests(args.viejo), cargar_tests(args.nuevo))
+        for ejercicio, c in cambios.items():
+            print(f"{ejercicio}: nuevos {c['nuevos']}, modificados {c['modificados']}, "
+                  f"quitados {c['quitados']}")
+        if not cambios:
+            print("Sin cambios.")
+        return 0
+
+    estado = cargar_estado(args.estado)
+    cambios, stats = recorregir(
+        fuentes_de(args.directorio), cargar_tests(args.tests), estado, args.hilos
+    )
+    guardar_estado(estado, args.estado)
+
+    for id_entrega, ejercicio, antes, despues in cambios:
+        print(f"{id_entrega} ({ejercicio}): {antes or 'sin corregir'} -> {despues}")
+    print(f"\n{stats['entregas']} entregas: {stats['recorregidas']} recorregidas "
+          f"({stats['fuentes_distintas']} fuentes distintas, {stats['casos_ejecutados']} "
+          f"casos ejecutados), {stats['sin_cambios']} sin cambios, {stats['sin_tests']} "
+          f"sin tests; {len(cambios)} veredictos cambian.")
+    print(f"Comprobaciones: {stats['clases_distintas']} resultados distintos, "
+          f"{stats['clases_reutilizadas']} reutilizados.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                [{"entrega": i, "ejercicio": e, "antes": a, "despues": d,
+                  "mensaje": estado["entregas"][i].get("mensaje")}
+                 for i, e, a, d in cambios],
+                f, indent=2, ensure_ascii=False,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+servidor_correccion.py
+----------------------
+Servidor de corrección para el laboratorio.
+
+Corrige con la misma lógica que corregir_ejercicio.py, pero en una
+máquina con muchos núcleos en lugar de en cada PC de alumno.
+
+- POST /corregir   {"dni", "ejercicio", "fuente"}
+      200 -> {"superado": bool, "test": int | null, "total": int,
+              "mensaje": str | null}
+      404 -> ejercicio sin tests en el servidor
+      413 -> envío de más de CUERPO_MAX bytes
+      503 -> cola llena (cabecera Retry-After); el cliente corrige en local
+- GET /estado      -> trabajos en cola, en curso y atendidos, envíos
+      repetidos, y cuántas comprobaciones se han reutilizado entre envíos
+      con el mismo resultado.
+
+Los trabajos esperan en una cola acotada con una subcola por cliente
+(DNI, o IP si no hay DNI) que se atiende por turnos, de modo que un
+alumno que envía muchas veces no retrasa a los demás. Un conjunto fijo
+de hilos trabajadores saca trabajos y lanza los tests en subprocesos.
+Un envío idéntico a otro (mismo ejercicio, fuente y tests) no ocupa
+sitio en la cola: espera al que ya está pendiente o toma su resultado.
+
+Ejecuta el código de cualquier alumno, así que debe correr con una
+cuenta dedicada sin privilegios (p. ej. "corrector"), sin acceso a los
+ficheros del profesor ni a nada más: nunca con la cuenta del profesor ni
+como root. Arrancado como root con --usuario, abre el puerto y pasa a esa
+cuenta; como root sin --usuario no arranca. Además, cada proceso de un
+alumno tiene límites de CPU, memoria, procesos y tamaño de fichero
+(resource.setrlimit, ver LIMITES_RECURSOS en corregir_ejercicio.py). El
+límite de procesos cuenta todos los de la cuenta, servidor incluido.
+
+Uso:
+    python -m herramientas.servidor_correccion --puerto 8765 --trabajadores 16
+    sudo python -m herramientas.servidor_correccion --usuario corrector
+
+En los equipos de los alumnos: FIUMH_SERVIDOR=http://servidor:8765
+"""
+
+import os
+import sys
+import json
+import getpass
+import time
+import argparse
+import threading
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from herramientas._headless import cargar_corrector, cargar_tests, TESTS_PATH
+
+
+# -------------------------------------------------------------------------
+# COLA CON REPARTO POR CLIENTE
+# -------------------------------------------------------------------------
+
+
+class ColaLlena(Exception):
+    pass
+
+
+class Trabajo:
+    def __init__(self, cliente, dni, ejercicio, fuente):
+        self.cliente = cliente
+        self.dni = dni
+        self.ejercicio = ejercicio
+        self.fuente = fuente
+        self.creado = time.monotonic()
+        self.clave = None
+        self.resultado = None
+        self.estable = False
+        self.terminado = threading.Event()
+
+
+class ColaJusta:
+    """
+    Cola acotada (capacidad total y por cliente) que reparte por turnos
+    entre clientes: cada sacar() atiende al siguiente cliente con trabajo.
+    """
+
+    def __init__(self, capacidad: int, por_cliente: int):
+        self.capacidad = capacidad
+        self.por_cliente = por_cliente
+        self._colas = OrderedDict()
+        self._total = 0
+        self._cond = threading.Condition()
+
+    def poner(self, trabajo: Trabajo):
+        with self._cond:
+            cola = self._colas.get(trabajo.cliente)
+            if self._total >= self.capacidad:
+                raise ColaLlena("cola llena")
+            if cola is not None and len(cola) >= self.por_cliente:
+                raise ColaLlena("demasiados trabajos pendientes de este cliente")
+            if cola is None:
+                cola = self._colas[trabajo.cliente] = deque()
+            cola.append(trabajo)
+            self._total += 1
+            self._cond.notify()
+
+    def sacar(self) -> Trabajo:
+        with self._cond:
+            while not self._total:
+                self._cond.wait()
+            cliente, cola = next(iter(self._colas.items()))
+            trabajo = cola.popleft()
+            if cola:
+                self._colas.move_to_end(cliente)
+            else:
+                del self._colas[cliente]
+            self._total -= 1
+            return trabajo
+
+    def __len__(self):
+        with self._cond:
+            return self._total
+
+
+# -------------------------------------------------------------------------
+# SERVICIO
+# -------------------------------------------------------------------------
+
+
+# Límites de cada proceso de alumno (ver LIMITES_RECURSOS en
+# corregir_ejercicio.py); la CPU, por encima del mayor tiempo de un test
+LIMITES = {
+    "CPU": 70,
+    "AS": 1024 * 1024 * 1024,
+    "NPROC": 512,
+    "FSIZE": 16 * 1024 * 1024,
+}
+
+
+# Resultados guardados por (ejercicio, hash de la fuente, hash de los tests)
+RESULTADOS_MAX = 1024
+# Bytes como máximo del cuerpo de un envío (se lee entero antes de la cola)
+CUERPO_MAX = 1024 * 1024
+
+
+class ServicioCorreccion:
+    def __init__(self, tests: dict, trabajadores: int, capacidad: int,
+                 por_cliente: int, limites=None):
+        self.ce = cargar_corrector()
+        self.ce.LIMITES_RECURSOS = dict(LIMITES if limites is None else limites)
+        self.tests = tests
+        self._hash_tests = {
+            e: self.ce._hash_contenido(json.dumps(l, sort_keys=True, ensure_ascii=False))
+            for e, l in tests.items()
+        }
+        # Comprobación e informes compartidos entre envíos con el mismo resultado
+        self.clases = self.ce._ClasesResultado()
+        self.cola = ColaJusta(capacidad, por_cliente)
+        self.en_curso = 0
+        self.atendidos = 0
+        self.repetidos = 0
+        # Envíos idénticos (en ráfaga, o el mismo alumno pulsando otra vez):
+        # se unen al trabajo en cola o en curso, o toman su resultado
+        self._en_vuelo = {}
+        self._resultados = OrderedDict()
+        self._lock = threading.Lock()
+        self._hilos = [
+            threading.Thread(target=self._trabajar, name=f"corrector-{i}", daemon=True)
+            for i in range(trabajadores)
+        ]
+        for h in self._hilos:
+            h.start()
+
+    def enviar(self, trabajo: Trabajo) -> Trabajo:
+        """
+        Trabajo cuyo resultado responde a este envío: uno idéntico ya
+        corregido o pendiente, o este mismo puesto en la cola (ColaLlena
+        si no cabe).
+        """
+        clave = (trabajo.ejercicio, self.ce._hash_contenido(trabajo.fuente),
+                 self._hash_tests.get(trabajo.ejercicio))
+        with self._lock:
+            igual = self._resultados.get(clave)
+            if igual is not None:
+                self._resultados.move_to_end(clave)
+            else:
+                igual = self._en_vuelo.get(clave)
+            if igual is not None:
+                self.repetidos += 1
+                return igual
+            self.cola.poner(trabajo)
+            trabajo.clave = clave
+            self._en_vuelo[clave] = trabajo
+        return trabajo
+
+    def corregir(self, trabajo: Trabajo) -> dict:
+        """Corrige un envío (mismo recorrido que corregir_ejercicio)."""
+        ce = self.ce
+        lista_tests = self.tests.get(trabajo.ejercicio) or []
+        tipo = ce._tipo_ejercicio(trabajo.ejercicio)
+        fallo = ce._primer_fallo(
+            tipo, trabajo.ejercicio, trabajo.fuente, lista_tests, self.clases
+        )
+        trabajo.estable = ce._fallo_estable(fallo)
+        if fallo is None:
+            return {"superado": True, "test": None, "total": ce._total_casos(lista_tests),
+                    "mensaje": None}
+        idx, test, res, errores = fallo
+        return {
+            "superado": False,
+            "test": idx,
+            "total": ce._total_casos(lista_tests),
+            "mensaje": self.clases.mensaje(tipo, errores, test, res),
+        }
+
+    def _trabajar(self):
+        while True:
+            trabajo = self.cola.sacar()
+            with self._lock:
+                self.en_curso += 1
+            try:
+                trabajo.resultado = self.corregir(trabajo)
+            except Exception as e:
+                trabajo.resultado = {"error": f"Error interno: {e}"}
+            finally:
+                with self._lock:
+                    self.en_curso -= 1
+                    self.atendidos += 1
+                    self._en_vuelo.pop(trabajo.clave, None)
+                    if trabajo.estable and "error" not in trabajo.resultado:
+                        trabajo.fuente = None
+                        self._resultados[trabajo.clave] = trabajo
+                        while len(self._resultados) > RESULTADOS_MAX:
+                            self._resultados.popitem(last=False)
+                trabajo.terminado.set()
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                "en_cola": len(self.cola),
+                "en_curso": self.en_curso,
+                "atendidos": self.atendidos,
+                "repetidos": self.repetidos,
+                "trabajadores": len(self._hilos),
+                "clases_reutilizadas": self.clases.aciertos,
+                "clases_distintas": self.clases.fallos,
+            }
+
+
+def crear_manejador(servicio: ServicioCorreccion, espera_max: float):
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _responder(self, codigo, datos, cabeceras=None):
+            cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            for k, v in (cabeceras or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def do_GET(self):
+            if self.path == "/estado":
+                self._responder(200, servicio.estado())
+            else:
+                self._responder(404, {"error": "ruta desconocida"})
+
+        def do_POST(self):
+            if self.path != "/corregir":
+                self._responder(404, {"error": "ruta desconocida"})
+                return
+            try:
+                n = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                n = -1
+            if n > CUERPO_MAX:
+                self.close_connection = True
+                self._responder(413, {"error": "envío demasiado grande"})
+                return
+            try:
+                if n < 0:
+                    raise ValueError(n)
+                datos = json.loads(self.rfile.read(n).decode("utf-8"))
+                ejercicio = datos["ejercicio"]
+                fuente = datos["fuente"]
+            except Exception:
+                self._responder(400, {"error": "petición no válida"})
+                return
+
+            if ejercicio not in servicio.tests:
+                self._responder(404, {"error": f"sin tests para {ejercicio}"})
+                return
+
+            dni = datos.get("dni") or ""
+            trabajo = Trabajo(dni or self.client_address[0], dni, ejercicio, fuente)
+            try:
+                trabajo = servicio.enviar(trabajo)
+            except ColaLlena as e:
+                self._responder(503, {"error": str(e)}, {"Retry-After": "5"})
+                return
+
+            if not trabajo.terminado.wait(espera_max):
+                self._responder(504, {"error": "la corrección no terminó a tiempo"})
+                return
+            codigo = 500 if "error" in trabajo.resultado else 200
+            self._responder(codigo, trabajo.resultado)
+
+        def log_message(self, formato, *args):
+            sys.stderr.write("%s %s\n" % (self.address_string(), formato % args))
+
+    return Manejador
+
+
+def crear_servidor(host, puerto, tests, trabajadores=4, capacidad=64,
+                   por_cliente=2, espera_max=120.0, limites=None):
+    """Servidor listo para serve_forever() (puerto 0 = cualquiera libre)."""
+    servicio = ServicioCorreccion(tests, trabajadores, capacidad, por_cliente, limites)
+    servidor = ThreadingHTTPServer((host, puerto), crear_manejador(servicio, espera_max))
+    servidor.daemon_threads = True
+    servidor.servicio = servicio
+    return servidor
+
+
+def cambiar_usuario(usuario: str):
+    """Pasa el proceso (arrancado como root) a la cuenta indicada."""
+    import pwd
+    cuenta = pwd.getpwnam(usuario)
+    if cuenta.pw_uid == 0:
+        raise ValueError(f"{usuario} es root")
+    os.setgroups([])
+    os.setgid(cuenta.pw_gid)
+    os.setuid(cuenta.pw_uid)
+    os.environ["HOME"] = cuenta.pw_dir
+    os.environ["USER"] = os.environ["LOGNAME"] = usuario
+    os.chdir(cuenta.pw_dir if os.path.isdir(cuenta.pw_dir) else "/")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de corrección FI-UMH.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--trabajadores", type=int, default=4,
+                        help="correcciones simultáneas")
+    parser.add_argument("--cola", type=int, default=64,
+                        help="trabajos en espera como máximo")
+    parser.add_argument("--por-cliente", type=int, default=2,
+                        help="trabajos en espera como máximo por cliente")
+    parser.add_argument("--tests", default=TESTS_PATH, help="ruta de tests.json")
+    parser.add_argument("--usuario",
+                        help="cuenta sin privilegios a la que pasar si se arranca como root")
+    parser.add_argument("--limite-cpu", type=int, default=LIMITES["CPU"],
+                        help="segundos de CPU por proceso de alumno")
+    parser.add_argument("--limite-memoria", type=int, default=LIMITES["AS"] >> 20,
+                        help="MB de memoria por proceso de alumno")
+    parser.add_argument("--limite-procesos", type=int, default=LIMITES["NPROC"],
+                        help="procesos de la cuenta que puede haber al crear uno")
+    parser.add_argument("--limite-fichero", type=int, default=LIMITES["FSIZE"] >> 20,
+                        help="MB como máximo por fichero escrito")
+    args = parser.parse_args(argv)
+
+    es_root = hasattr(os, "geteuid") and os.geteuid() == 0
+    if es_root and not args.usuario:
+        print("No se ejecuta código de alumnos como root: usa --usuario con una "
+              "cuenta dedicada sin privilegios.", file=sys.stderr)
+        return 1
+    if args.usuario and not es_root:
+        print("--usuario solo tiene efecto arrancando como root.", file=sys.stderr)
+        return 1
+
+    tests = cargar_tests(args.tests)
+    limites = {
+        "CPU": args.limite_cpu,
+        "AS": args.limite_memoria << 20,
+        "NPROC": args.limite_procesos,
+        "FSIZE": args.limite_fichero << 20,
+    }
+    servidor = crear_servidor(
+        args.host, args.puerto, tests,
+        args.trabajadores, args.cola, args.por_cliente, limites=limites,
+    )
+    if args.usuario:
+        try:
+            cambiar_usuario(args.usuario)
+        except (KeyError, ValueError, OSError) as e:
+            print(f"No se pudo pasar a la cuenta {args.usuario}: {e}", file=sys.stderr)
+            return 1
+    else:
+        print(f"Aviso: el código de los alumnos se ejecuta como {getpass.getuser()}; "
+              "debe ser una cuenta dedicada, nunca la del profesor.", file=sys.stderr)
+    print(f"Servidor de corrección en http://{args.host}:{servidor.server_port}",
+          file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
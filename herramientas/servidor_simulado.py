@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+servidor_simulado.py
+----------------------
+Sustituto local de GitHub y de los scripts de Google Apps Script para
+medir y probar sin red los caminos de descarga y de subida.
+
+- GET /<ruta>         -> los ficheros publicados (PUBLICADOS: los módulos
+      de BASE_URL, tests.json, ficheros.zip y sus copias .cr) de --raiz
+      (por defecto, el repositorio); cualquier otra ruta, 404. Con ETag y Last-Modified; If-None-Match / If-Modified-Since -> 304,
+      y Range (un solo intervalo) -> 206.
+- POST /subida/<nombre> -> acepta subidas como las de _subir_ejercicios
+      (form-urlencoded, con o sin gzip) y responde como Apps Script.
+- GET /__estado       -> peticiones, bytes, respuestas por código y
+      subidas recibidas.
+
+Las condiciones de la red se simulan con:
+    --latencia / --variacion   ms antes de cada respuesta
+    --ancho-banda              KB/s compartidos por todas las conexiones
+                               (el enlace de salida del aula)
+    --errores                  probabilidad de responder 503
+    --sin-304, --sin-rangos    servidor que no los admite
+
+Uso:
+    python -m herramientas.servidor_simulado --puerto 8800 --latencia 80 --ancho-banda 2000
+    FIUMH_BASE_URL=http://127.0.0.1:8800/ thonny
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from collections import Counter
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from herramientas._headless import REPO_DIR
+
+
+BLOQUE = 16 * 1024
+BINARIO = "application/octet-stream"
+
+# Lo único que se sirve de la raíz: lo que publica BASE_URL. Nunca .git/,
+# herramientas/ ni lo que haya en la copia de trabajo
+PUBLICADOS = frozenset(
+    nombre + sufijo
+    for nombre in ("configuracion.py", "corregir_ejercicio.py", "descargar_ficheros.py",
+                   "tests.json", "ficheros.zip")
+    for sufijo in ("", ".cr")
+)
+
+
+# -------------------------------------------------------------------------
+# CONDICIONES DE LA RED
+# -------------------------------------------------------------------------
+
+
+class Enlace:
+    """
+    Cubo de fichas compartido: limita los bytes por segundo de todas las
+    conexiones juntas (None = sin límite).
+    """
+
+    def __init__(self, bytes_por_segundo=None):
+        self.tasa = bytes_por_segundo
+        self._disponible = float(bytes_por_segundo or 0)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consumir(self, n: int):
+        if not self.tasa:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            self._disponible = min(
+                self.tasa, self._disponible + (ahora - self._ultimo) * self.tasa
+            )
+            self._ultimo = ahora
+            self._disponible -= n
+            espera = -self._disponible / self.tasa if self._disponible < 0 else 0.0
+        if espera:
+            time.sleep(espera)
+
+
+class Simulacion:
+    def __init__(self, raiz=REPO_DIR, latencia=0.0, variacion=0.0,
+                 ancho_banda=None, errores=0.0, con_304=True, con_rangos=True,
+                 registro_subidas=None):
+        self.raiz = os.path.realpath(raiz)
+        self.latencia = latencia
+        self.variacion = variacion
+        self.enlace = Enlace(ancho_banda)
+        self.errores = errores
+        self.con_304 = con_304
+        self.con_rangos = con_rangos
+        self.registro_subidas = registro_subidas
+        self._lock = threading.Lock()
+        self._etags = {}   # ruta -> (mtime, tamaño, etag)
+        self.peticiones = Counter()
+        self.codigos = Counter()
+        self.bytes_enviados = 0
+        self.subidas = Counter()
+        self.subidas_ref = 0
+
+    def esperar(self):
+        retardo = self.latencia + random.uniform(-self.variacion, self.variacion)
+        if retardo > 0:
+            time.sleep(retardo / 1000)
+
+    def falla(self) -> bool:
+        return self.errores > 0 and random.random() < self.errores
+
+    def fichero(self, ruta_url: str):
+        """Ruta en disco de ruta_url, o None si no existe o no está publicada."""
+        relativa = urllib.parse.unquote(urllib.parse.urlsplit(ruta_url).path).lstrip("/")
+        if relativa not in PUBLICADOS:
+            return None
+        ruta = os.path.realpath(os.path.join(self.raiz, relativa))
+        if not ruta.startswith(self.raiz + os.sep) or not os.path.isfile(ruta):
+            return None
+        return ruta
+
+    def etag(self, ruta: str, st) -> str:
+        with self._lock:
+            guardado = self._etags.get(ruta)
+            if guardado and guardado[:2] == (st.st_mtime, st.st_size):
+                return guardado[2]
+        with open(ruta, "rb") as f:
+            etag = '"' + hashlib.sha1(f.read()).hexdigest() + '"'
+        with self._lock:
+            self._etags[ruta] = (st.st_mtime, st.st_size, etag)
+        return etag
+
+    def anotar(self, ruta: str, codigo: int, enviados: int):
+        with self._lock:
+            self.peticiones[ruta] += 1
+            self.codigos[codigo] += 1
+            self.bytes_enviados += enviados
+
+    def anotar_subida(self, nombre: str, datos: dict):
+        with self._lock:
+            self.subidas[nombre] += 1
+            if datos.get("fuente_ref"):
+                self.subidas_ref += 1
+            if self.registro_subidas:
+                with open(self.registro_subidas, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"endpoint": nombre, **datos}, ensure_ascii=False) + "\n")
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                "peticiones": dict(self.peticiones),
+                "codigos": {str(k): v for k, v in sorted(self.codigos.items())},
+                "bytes_enviados": self.bytes_enviados,
+                "subidas": dict(self.subidas),
+                "subidas_solo_hash": self.subidas_ref,
+            }
+
+
+# -------------------------------------------------------------------------
+# HTTP
+# -------------------------------------------------------------------------
+
+
+def _rango(cabecera: str, tamano: int):
+    """
+    (inicio, fin incluido) de un Range "bytes=..." de un solo intervalo;
+    None si no se entiende (se sirve entero), False si no es satisfacible.
+    """
+    if not cabecera or not cabecera.startswith("bytes=") or "," in cabecera:
+        return None
+    inicio, _, fin = cabecera[6:].strip().partition("-")
+    try:
+        if not inicio:
+            n = int(fin)
+            if n <= 0:
+                return False
+            return max(tamano - n, 0), tamano - 1
+        a = int(inicio)
+        b = int(fin) if fin else tamano - 1
+    except ValueError:
+        return None
+    if a >= tamano or b < a:
+        return False
+    return a, min(b, tamano - 1)
+
+
+def crear_manejador(sim: Simulacion):
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _cabeceras(self, codigo, longitud, tipo, extra=None):
+            self.send_response(codigo)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(longitud))
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+
+        def _cuerpo(self, datos: bytes):
+            for i in range(0, len(datos), BLOQUE):
+                trozo = datos[i:i + BLOQUE]
+                sim.enlace.consumir(len(trozo))
+                self.wfile.write(trozo)
+
+        def _responder(self, codigo, datos: bytes, tipo="text/plain; charset=utf-8",
+                       extra=None, cuerpo=True):
+            self._cabeceras(codigo, len(datos), tipo, extra)
+            if cuerpo:
+                self._cuerpo(datos)
+            sim.anotar(self.path, codigo, len(datos) if cuerpo else 0)
+
+        def _servir(self, cuerpo=True):
+            sim.esperar()
+            if self.path == "/__estado":
+                datos = json.dumps(sim.estado(), ensure_ascii=False).encode("utf-8")
+                self._responder(200, datos, "application/json; charset=utf-8", cuerpo=cuerpo)
+                return
+            if sim.falla():
+                self._responder(503, b"error simulado", extra={"Retry-After": "1"})
+                return
+            ruta = sim.fichero(self.path)
+            if ruta is None:
+                self._responder(404, b"no encontrado")
+                return
+
+            st = os.stat(ruta)
+            etag = sim.etag(ruta, st)
+            validadores = {
+                "ETag": etag,
+                "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+            }
+            if sim.con_304 and self._sin_cambios(etag, st.st_mtime):
+                self._responder(304, b"", extra=validadores, cuerpo=False)
+                return
+
+            with open(ruta, "rb") as f:
+                datos = f.read()
+            if sim.con_rangos:
+                validadores["Accept-Ranges"] = "bytes"
+                rango = _rango(self.headers.get("Range"), len(datos))
+                if rango is False:
+                    self._responder(416, b"", extra={"Content-Range": f"bytes */{len(datos)}"})
+                    return
+                if rango and self._si_rango(etag):
+                    a, b = rango
+                    validadores["Content-Range"] = f"bytes {a}-{b}/{len(datos)}"
+                    self._responder(206, datos[a:b + 1], BINARIO, validadores, cuerpo)
+                    return
+            self._responder(200, datos, BINARIO, validadores, cuerpo)
+
+        def _sin_cambios(self, etag, mtime) -> bool:
+            inm = self.headers.get("If-None-Match")
+            if inm is not None:
+                return inm.strip() == "*" or etag in [e.strip() for e in inm.split(",")]
+            ims = self.headers.get("If-Modified-Since")
+            if ims:
+                try:
+                    return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+        def _si_rango(self, etag) -> bool:
+            # If-Range con otro validador: el fichero cambió, se sirve entero
+            valor = self.headers.get("If-Range")
+            return valor is None or valor.strip() == etag
+
+        def do_GET(self):
+            self._servir()
+
+        def do_HEAD(self):
+            self._servir(cuerpo=False)
+
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length", 0))
+            cuerpo = self.rfile.read(n)
+            sim.esperar()
+            if not self.path.startswith("/subida/"):
+                self._responder(404, b"ruta desconocida")
+                return
+            if sim.falla():
+                self._responder(503, b"error simulado", extra={"Retry-After": "1"})
+                return
+            try:
+                if self.headers.get("Content-Encoding") == "gzip":
+                    cuerpo = gzip.decompress(cuerpo)
+                datos = dict(urllib.parse.parse_qsl(cuerpo.decode("utf-8")))
+            except Exception:
+                self._responder(400, b"peticion no valida")
+                return
+            sim.anotar_subida(self.path[len("/subida/"):], datos)
+            self._responder(200, b"OK")
+
+        def log_message(self, formato, *args):
+            pass
+
+    return Manejador
+
+
+def crear_servidor(host, puerto, **opciones):
+    """Servidor listo para serve_forever() (puerto 0 = cualquiera libre)."""
+    sim = Simulacion(**opciones)
+    servidor = ThreadingHTTPServer((host, puerto), crear_manejador(sim))
+    servidor.daemon_threads = True
+    servidor.simulacion = sim
+    return servidor
+
+
+def variables_cliente(url_base: str) -> dict:
+    """
+    Variables de entorno que dirigen un cliente a este servidor (que sí
+    admite subidas con gzip y con la fuente por referencia).
+    """
+    url_base = url_base.rstrip("/")
+    return {
+        "FIUMH_BASE_URL": url_base + "/",
+        "FIUMH_SUBIDA_FI": url_base + "/subida/fi",
+        "FIUMH_SUBIDA_POMARES": url_base + "/subida/pomares",
+        "FIUMH_SUBIDA_GZIP": "1",
+        "FIUMH_SUBIDA_REFS": "1",
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor simulado de recursos y subidas.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8800)
+    parser.add_argument("--raiz", default=REPO_DIR, help="directorio que se sirve")
+    parser.add_argument("--latencia", type=float, default=0.0, help="ms por respuesta")
+    parser.add_argument("--variacion", type=float, default=0.0,
+                        help="variación aleatoria de la latencia (± ms)")
+    parser.add_argument("--ancho-banda", type=float, default=None,
+                        help="KB/s compartidos por todas las conexiones")
+    parser.add_argument("--errores", type=float, default=0.0,
+                        help="probabilidad de responder 503 (0-1)")
+    parser.add_argument("--sin-304", action="store_true")
+    parser.add_argument("--sin-rangos", action="store_true")
+    parser.add_argument("--subidas", help="guarda cada subida recibida (JSON por línea)")
+    args = parser.parse_args(argv)
+
+    servidor = crear_servidor(
+        args.host, args.puerto, raiz=args.raiz, latencia=args.latencia,
+        variacion=args.variacion,
+        ancho_banda=args.ancho_banda * 1024 if args.ancho_banda else None,
+        errores=args.errores, con_304=not args.sin_304, con_rangos=not args.sin_rangos,
+        registro_subidas=args.subidas,
+    )
+    url = f"http://{args.host}:{servidor.server_port}"
+    print(f"Servidor simulado en {url} (raíz {args.raiz})", file=sys.stderr)
+    for nombre, valor in variables_cliente(url).items():
+        print(f"  {nombre}={valor}", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(servidor.simulacion.estado(), indent=2, ensure_ascii=False),
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+similitud.py
+----------------------
+Índice de huellas para encontrar entregas casi idénticas (posibles copias).
+
+- Cada fuente se reduce a tokens normalizados: los identificadores pasan
+  a ser "V", los números "N" y las cadenas "S"; se descartan comentarios
+  (incluida la cabecera DNI/EJERCICIO) y líneas en blanco. Renombrar
+  variables o cambiar literales no cambia la huella.
+- De los k-gramas de tokens se eligen huellas por winnowing (mínimo de
+  cada ventana de w hashes), que garantiza detectar cualquier coincidencia
+  de al menos w + k - 1 tokens.
+- Un índice invertido huella -> entregas (por ejercicio) permite buscar
+  candidatas mirando solo las entregas que comparten alguna huella, sin
+  comparar contra todo el archivo.
+
+Uso:
+    python -m herramientas.similitud construir ARCHIVO/ --indice indice.json
+    python -m herramientas.similitud agregar entrega.py --indice indice.json
+    python -m herramientas.similitud buscar entrega.py --indice indice.json
+"""
+
+import os
+import io
+import sys
+import json
+import keyword
+import hashlib
+import argparse
+import tokenize
+
+from herramientas._headless import cargar_corrector
+
+K_GRAMA = 5          # tokens por k-grama
+VENTANA = 4          # ventana de winnowing
+UMBRAL = 0.5         # fracción mínima de huellas compartidas
+FRECUENCIA_MAX = 0.5 # huellas presentes en más entregas se ignoran (código común)
+
+_IGNORAR = {
+    tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.ENCODING,
+    tokenize.ENDMARKER, tokenize.TYPE_COMMENT,
+}
+
+
+# -------------------------------------------------------------------------
+# NORMALIZACIÓN Y HUELLAS
+# -------------------------------------------------------------------------
+
+
+def tokens_normalizados(fuente: str) -> list:
+    tokens = []
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(fuente).readline):
+            if tok.type in _IGNORAR:
+                continue
+            if tok.type == tokenize.NAME:
+                tokens.append(tok.string if keyword.iskeyword(tok.string) else "V")
+            elif tok.type == tokenize.NUMBER:
+                tokens.append("N")
+            elif tok.type == tokenize.STRING:
+                tokens.append("S")
+            elif tok.type == tokenize.INDENT:
+                tokens.append("<IN>")
+            elif tok.type == tokenize.DEDENT:
+                tokens.append("<DE>")
+            else:
+                tokens.append(tok.string)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Fuente incompleta: nos quedamos con lo que se haya podido leer
+        pass
+    return tokens
+
+
+def _hash_grama(grama) -> int:
+    h = hashlib.blake2b("\x1f".join(grama).encode("utf-8"), digest_size=8)
+    return int.from_bytes(h.digest(), "big")
+
+
+def huellas(fuente: str, k: int = K_GRAMA, w: int = VENTANA) -> set:
+    """Conjunto de huellas (enteros de 64 bits) elegidas por winnowing."""
+    tokens = tokens_normalizados(fuente)
+    if len(tokens) < k:
+        return {_hash_grama(tokens)} if tokens else set()
+    hashes = [_hash_grama(tokens[i:i + k]) for i in range(len(tokens) - k + 1)]
+    if len(hashes) <= w:
+        return {min(hashes)}
+
+    elegidas = set()
+    anterior = -1
+    for i in range(len(hashes) - w + 1):
+        ventana = hashes[i:i + w]
+        # Mínimo más a la derecha de la ventana (regla de winnowing)
+        m = min(ventana)
+        pos = i + w - 1 - ventana[::-1].index(m)
+        if pos != anterior:
+            elegidas.add(m)
+            anterior = pos
+    return elegidas
+
+
+# -------------------------------------------------------------------------
+# ÍNDICE INVERTIDO
+# -------------------------------------------------------------------------
+
+
+class IndiceSimilitud:
+    def __init__(self, k: int = K_GRAMA, w: int = VENTANA):
+        self.k = k
+        self.w = w
+        self.entregas = {}   # id -> {"dni", "ejercicio", "huellas": n}
+        self.invertido = {}  # ejercicio -> {huella: set(ids)}
+        self._huellas = {}   # id -> set(huellas)
+        self._cuantas = {}   # ejercicio -> número de entregas
+        self._extraer = cargar_corrector()._extraer_dni_ejercicio
+
+    def agregar(self, id_entrega: str, fuente: str):
+        """Añade (o sustituye) una entrega al índice."""
+        if id_entrega in self.entregas:
+            self.quitar(id_entrega)
+        dni, ejercicio = self._extraer(fuente)
+        ejercicio = ejercicio or ""
+        hs = huellas(fuente, self.k, self.w)
+        self.entregas[id_entrega] = {"dni": dni, "ejercicio": ejercicio, "huellas": len(hs)}
+        self._indexar(id_entrega, ejercicio, hs)
+
+    def _indexar(self, id_entrega, ejercicio, hs):
+        self._huellas[id_entrega] = hs
+        self._cuantas[ejercicio] = self._cuantas.get(ejercicio, 0) + 1
+        por_huella = self.invertido.setdefault(ejercicio, {})
+        for h in hs:
+            por_huella.setdefault(h, set()).add(id_entrega)
+
+    def quitar(self, id_entrega: str):
+        info = self.entregas.pop(id_entrega)
+        self._cuantas[info["ejercicio"]] -= 1
+        por_huella = self.invertido.get(info["ejercicio"], {})
+        for h in self._huellas.pop(id_entrega, ()):
+            ids = por_huella.get(h)
+            if ids is not None:
+                ids.discard(id_entrega)
+                if not ids:
+                    del por_huella[h]
+
+    def buscar(self, fuente: str, umbral: float = UMBRAL, limite: int = 20,
+               excluir_dni: bool = True):
+        """
+        Entregas del mismo ejercicio que comparten al menos una fracción
+        umbral de huellas con fuente. Devuelve [(similitud, id, dni)] de
+        mayor a menor.
+        """
+        dni, ejercicio = self._extraer(fuente)
+        por_huella = self.invertido.get(ejercicio or "", {})
+        hs = huellas(fuente, self.k, self.w)
+        if not hs or not por_huella:
+            return []
+
+        n_entregas = self._cuantas.get(ejercicio or "", 0)
+        frecuencia_max = max(2, int(n_entregas * FRECUENCIA_MAX))
+
+        comunes = {}
+        for h in hs:
+            ids = por_huella.get(h)
+            if not ids or len(ids) > frecuencia_max:
+                continue
+            for i in ids:
+                comunes[i] = comunes.get(i, 0) + 1
+
+        candidatas = []
+        for i, n in comunes.items():
+            info = self.entregas[i]
+            if excluir_dni and dni and info["dni"] == dni:
+                continue
+            similitud = n / max(1, min(len(hs), info["huellas"]))
+            if similitud >= umbral:
+                candidatas.append((round(similitud, 3), i, info["dni"]))
+        candidatas.sort(reverse=True)
+        return candidatas[:limite]
+
+    # ---- persistencia ---------------------------------------------------
+
+    def guardar(self, ruta: str):
+        datos = {
+            "k": self.k,
+            "w": self.w,
+            "entregas": {
+                i: dict(info, lista=sorted(self._huellas[i]))
+                for i, info in self.entregas.items()
+            },
+        }
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False)
+
+    @classmethod
+    def cargar(cls, ruta: str):
+        with open(ruta, "r", encoding="utf-8") as f:
+            datos = json.load(f)
+        indice = cls(datos["k"], datos["w"])
+        for i, info in datos["entregas"].items():
+            hs = set(info.pop("lista"))
+            indice.entregas[i] = info
+            indice._indexar(i, info["ejercicio"], hs)
+        return indice
+
+
+def fuentes_de(directorio: str):
+    """(id relativo, fuente) de cada .py bajo directorio."""
+    for raiz, _dirs, ficheros in os.walk(directorio):
+        for nombre in sorted(ficheros):
+            if not nombre.endswith(".py"):
+                continue
+            ruta = os.path.join(raiz, nombre)
+            with open(ruta, "r", encoding="utf-8", errors="replace") as f:
+                yield os.path.relpath(ruta, directorio), f.read()
+
+
+def _leer(ruta: str) -> str:
+    with open(ruta, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detección de entregas casi idénticas.")
+    sub = parser.add_subparsers(dest="orden", required=True)
+
+    p = sub.add_parser("construir", help="índice de todo un directorio de entregas")
+    p.add_argument("directorio")
+    p.add_argument("--indice", required=True)
+
+    p = sub.add_parser("agregar", help="añade entregas a un índice existente")
+    p.add_argument("ficheros", nargs="+")
+    p.add_argument("--indice", required=True)
+
+    p = sub.add_parser("buscar", help="candidatas a copia de una entrega")
+    p.add_argument("fichero")
+    p.add_argument("--indice", required=True)
+    p.add_argument("--umbral", type=float, default=UMBRAL)
+
+    args = parser.parse_args(argv)
+
+    if args.orden == "construir":
+        indice = IndiceSimilitud()
+        n = 0
+        for id_entrega, fuente in fuentes_de(args.directorio):
+            indice.agregar(id_entrega, fuente)
+            n += 1
+        indice.guardar(args.indice)
+        print(f"{n} entregas indexadas en {args.indice}")
+
+    elif args.orden == "agregar":
+        indice = (IndiceSimilitud.cargar(args.indice)
+                  if os.path.exists(args.indice) else IndiceSimilitud())
+        for ruta in args.ficheros:
+            indice.agregar(ruta, _leer(ruta))
+        indice.guardar(args.indice)
+
+    else:
+        indice = IndiceSimilitud.cargar(args.indice)
+        for similitud, id_entrega, dni in indice.buscar(_leer(args.fichero), args.umbral):
+            print(f"{similitud:6.1%}  {dni or '-':<12} {id_entrega}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+telemetria.py
+----------------------
+Informe de la telemetría que deja el corrector en cada equipo
+(~/.fiumh_thonny/telemetria/telemetria.bin y sus rotaciones).
+
+Para cada ejercicio y para cada caso: número de ejecuciones, p50/p95/p99
+del tiempo real, tiempo de CPU medio, porcentaje de fallos y de tiempos
+excedidos y tamaño medio de la salida. Al final, los casos más lentos por
+p95. Se pueden pasar varios ficheros o directorios (p. ej. los recogidos
+de todos los equipos de un laboratorio, o el del servidor de corrección).
+
+Uso:
+    python -m herramientas.telemetria
+    python -m herramientas.telemetria /ruta/telemetria/ otro/telemetria.bin --lentos 20
+    python -m herramientas.telemetria --ejercicio f000 --desde 2026-10-01
+"""
+
+import os
+import sys
+import time
+import argparse
+from collections import defaultdict
+
+from herramientas._headless import cargar_corrector
+from herramientas.bench_corregir import percentil
+
+
+def _ficheros(rutas):
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for nombre in sorted(os.listdir(ruta)):
+                if nombre.startswith("telemetria.bin"):
+                    yield os.path.join(ruta, nombre)
+        elif os.path.exists(ruta):
+            yield ruta
+
+
+def _estadisticas(registros) -> dict:
+    pared = [r["pared"] for r in registros]
+    n = len(registros)
+    return {
+        "n": n,
+        "p50": percentil(pared, 50),
+        "p95": percentil(pared, 95),
+        "p99": percentil(pared, 99),
+        "cpu": sum(r["cpu"] for r in registros) / n if n else 0.0,
+        "fallos": sum(not r["superado"] for r in registros) / n if n else 0.0,
+        "tiempo": sum(r["error_tipo"] == "tiempo" for r in registros) / n if n else 0.0,
+        "salida": sum(r["salida"] for r in registros) / n if n else 0.0,
+    }
+
+
+def resumir(registros):
+    """({ejercicio: stats}, {(ejercicio, test): stats})."""
+    por_ejercicio = defaultdict(list)
+    por_caso = defaultdict(list)
+    for r in registros:
+        por_ejercicio[r["ejercicio"]].append(r)
+        por_caso[(r["ejercicio"], r["test"])].append(r)
+    return (
+        {e: _estadisticas(rs) for e, rs in sorted(por_ejercicio.items())},
+        {c: _estadisticas(rs) for c, rs in sorted(por_caso.items())},
+    )
+
+
+def _fila(nombre, s):
+    return (
+        f"{nombre:<14}{s['n']:>7}{s['p50'] * 1000:>9.0f}{s['p95'] * 1000:>9.0f}"
+        f"{s['p99'] * 1000:>9.0f}{s['cpu'] * 1000:>9.0f}{s['fallos']:>8.0%}"
+        f"{s['tiempo']:>8.0%}{s['salida'] / 1024:>9.1f}"
+    )
+
+
+def imprimir_informe(ejercicios, casos, lentos=10, detalle=True):
+    cabecera = (f"{'':<14}{'n':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                f"{'cpu ms':>9}{'fallos':>8}{'tiempo':>8}{'KB sal.':>9}")
+    print(cabecera)
+    for ejercicio, s in ejercicios.items():
+        print(_fila(ejercicio, s))
+        if detalle:
+            for (e, test), sc in casos.items():
+                if e == ejercicio:
+                    print(_fila(f"  test {test}", sc))
+
+    if lentos:
+        print("\nCasos más lentos (p95):")
+        orden = sorted(casos.items(), key=lambda c: c[1]["p95"], reverse=True)
+        for (ejercicio, test), s in orden[:lentos]:
+            print(f"  {ejercicio} test {test}: p95 {s['p95'] * 1000:.0f} ms, "
+                  f"tiempo excedido {s['tiempo']:.0%} ({s['n']} ejecuciones)")
+
+
+def main(argv=None):
+    ce = cargar_corrector()
+    parser = argparse.ArgumentParser(description="Informe de telemetría de la corrección.")
+    parser.add_argument("rutas", nargs="*",
+                        default=[os.path.dirname(ce.TELEMETRIA_PATH)],
+                        help="ficheros o directorios de telemetría")
+    parser.add_argument("--ejercicio", help="solo este ejercicio")
+    parser.add_argument("--desde", help="solo registros desde esta fecha (AAAA-MM-DD)")
+    parser.add_argument("--lentos", type=int, default=10,
+                        help="cuántos casos lentos mostrar")
+    parser.add_argument("--sin-casos", action="store_true",
+                        help="solo el resumen por ejercicio")
+    args = parser.parse_args(argv)
+
+    desde = time.mktime(time.strptime(args.desde, "%Y-%m-%d")) if args.desde else 0
+    registros = [
+        r for ruta in _ficheros(args.rutas) for r in ce._leer_telemetria(ruta)
+        if r["fecha"] >= desde
+        and (not args.ejercicio or r["ejercicio"] == args.ejercicio)
+    ]
+    if not registros:
+        print("No hay registros de telemetría.")
+        return 1
+    ejercicios, casos = resumir(registros)
+    imprimir_informe(ejercicios, casos, args.lentos, not args.sin_casos)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())